@@ -0,0 +1,179 @@
+"""
+Incremental build graph with content-addressed artifact caching.
+
+Every stage is keyed by a hash of its name, version, parameters and the keys
+of its input stages. Outputs are built into <cache_dir>/<stage>/<key>/ and
+exposed at their usual paths in link_dir as symlinks, so a parameter change
+rebuilds only the stages downstream of it, and switching back to earlier
+parameters is a relink of the already cached artifacts. Independent stages
+run concurrently.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage(object):
+    """
+    A build step.
+
+    :params
+        name -- unique stage name
+        func -- callable func(out_dir, inputs, **params) writing outputs into out_dir;
+                inputs maps each input stage name to {output name -> path}
+        outputs -- file or directory names written into out_dir
+        inputs -- names of stages whose outputs are read
+        params -- json-serializable parameters, part of the key
+        version -- bump to invalidate artifacts after changing func
+        adopt -- outputs already present as plain files in link_dir are taken
+                 over into the cache instead of rebuilt (for downloads)
+    """
+
+    def __init__(self, name, func, outputs, inputs=(), params=None, version=1, adopt=False):
+        self.name = name
+        self.func = func
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.version = version
+        self.adopt = adopt
+
+
+class BuildGraph(object):
+    """
+    :public:
+        add()
+        key()
+        outputs()
+        run()
+    """
+
+    def __init__(self, cache_dir, link_dir=None):
+        self.cache_dir = Path(cache_dir)
+        self.link_dir = Path(link_dir) if link_dir is not None else None
+        self.stages = {}
+        self.keys_ = {}
+
+    def add(self, stage: Stage) -> Stage:
+        assert stage.name not in self.stages, "Duplicated stage " + stage.name
+        for i in stage.inputs:
+            assert i in self.stages, "Unknown input stage " + i + " of " + stage.name
+        self.stages[stage.name] = stage
+        return stage
+
+    def key(self, name: str) -> str:
+        """Hash of the stage definition and, recursively, of its inputs."""
+        if name not in self.keys_:
+            stage = self.stages[name]
+            spec = {'name': name, 'version': stage.version, 'params': stage.params,
+                    'outputs': stage.outputs, 'inputs': {i: self.key(i) for i in stage.inputs}}
+            blob = json.dumps(spec, sort_keys=True).encode()
+            self.keys_[name] = hashlib.sha256(blob).hexdigest()[:16]
+        return self.keys_[name]
+
+    def artifact_dir_(self, name: str) -> Path:
+        return self.cache_dir / name / self.key(name)
+
+    def outputs(self, name: str) -> dict:
+        """Output name -> cached path of a stage."""
+        return {o: self.artifact_dir_(name) / o for o in self.stages[name].outputs}
+
+    def is_fresh(self, name: str) -> bool:
+        return self.artifact_dir_(name).is_dir()
+
+    def link_(self, name: str):
+        """Points link_dir/<output> at the stage's cached outputs, replacing only symlinks."""
+        if self.link_dir is None:
+            return
+        self.link_dir.mkdir(parents=True, exist_ok=True)
+        for o, path in self.outputs(name).items():
+            link = self.link_dir / o
+            if link.is_symlink() and os.readlink(link) == str(path.resolve()):
+                continue
+            if link.exists() and not link.is_symlink():
+                raise FileExistsError("Not replacing " + str(link) + " with a link to the build cache: "
+                                      "it is a real file or directory. Move it away to rebuild.")
+            tmp = self.link_dir / (o + '.link.tmp')
+            if tmp.is_symlink() or tmp.exists():
+                os.remove(tmp)
+            os.symlink(path.resolve(), tmp)
+            os.replace(tmp, link)
+
+    def adopt_(self, name: str) -> bool:
+        """Moves plain output files found in link_dir into the cache."""
+        stage = self.stages[name]
+        if not stage.adopt or self.link_dir is None:
+            return False
+        found = [self.link_dir / o for o in stage.outputs]
+        if not all(p.exists() and not p.is_symlink() for p in found):
+            return False
+        tmp = self.artifact_dir_(name).with_name(self.key(name) + '.tmp')
+        tmp.mkdir(parents=True, exist_ok=True)
+        for p in found:
+            os.replace(p, tmp / p.name)
+        os.replace(tmp, self.artifact_dir_(name))
+        return True
+
+    def build_(self, name: str) -> str:
+        """Builds one stage whose inputs are built; returns 'cached', 'adopted' or 'built'."""
+        stage = self.stages[name]
+        if self.is_fresh(name):
+            status = 'cached'
+        elif self.adopt_(name):
+            status = 'adopted'
+        else:
+            tmp = self.artifact_dir_(name).with_name(self.key(name) + '.tmp')
+            if tmp.exists():
+                shutil.rmtree(tmp)
+            tmp.mkdir(parents=True)
+            inputs = {i: self.outputs(i) for i in stage.inputs}
+            logging.info("Building " + name + " (" + self.key(name) + ")")
+            stage.func(tmp, inputs, **stage.params)
+            for o in stage.outputs:
+                assert (tmp / o).exists(), "Stage " + name + " did not write " + o
+            os.replace(tmp, self.artifact_dir_(name))
+            status = 'built'
+        self.link_(name)
+        logging.info(name + ": " + status)
+        return status
+
+    def dependencies_(self, targets) -> list:
+        """Stages needed for targets, in topological order."""
+        order, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for i in self.stages[name].inputs:
+                visit(i)
+            order.append(name)
+
+        for t in targets:
+            visit(t)
+        return order
+
+    def run(self, targets=None, n_jobs: int = 4) -> dict:
+        """
+        Builds targets (default: all stages) and their inputs, running
+        stages whose inputs are done concurrently on n_jobs threads.
+
+        Returns:
+            stage name -> 'cached', 'adopted' or 'built'
+        """
+        todo = self.dependencies_(targets or list(self.stages))
+        status, running = {}, {}
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as pool:
+            while todo or running:
+                for name in [n for n in todo if all(i in status for i in self.stages[n].inputs)]:
+                    todo.remove(name)
+                    running[pool.submit(self.build_, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    status[running.pop(future)] = future.result()
+        return status
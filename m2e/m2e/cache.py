@@ -0,0 +1,225 @@
+"""
+Cohort cache shared by concurrent processes on one host.
+
+Experiment scripts and notebook kernels working on the same cohort each
+slice the same (cases x features) blocks out of the matrix store. The cache
+materializes a block once as a .npy file in shared memory (tmpfs, /dev/shm)
+and every process memory-maps it read-only, so all of them see the same
+physical pages: no daemon, no copies, no pickling.
+
+A SQLite registry in the cache directory records each block's size and last
+use; when the cached bytes exceed the capacity, the least recently used
+blocks are deleted. Processes still mapping an evicted block keep a valid
+view (Linux frees the pages when the last mapping closes). Blocks are loaded
+by one process at a time under a single file lock of the cache, and blocks
+of a store matrix that was re-ingested since are keyed apart and never served.
+
+    cache = CohortCache()
+    meth = cache.get(store_dir, 'TCGA-BRCA', 'methylation', cpgs)
+"""
+
+import os
+import time
+import fcntl
+import json
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from m2e.store import MatrixStore
+
+
+SHM_DIR = "/dev/shm"
+CACHE_DIR = os.path.join(SHM_DIR if os.path.isdir(SHM_DIR) else tempfile.gettempdir(), "m2e_cache")
+CAPACITY = 8 << 30  # bytes
+REGISTRY_NAME = "registry.sqlite"
+LOCK_NAME = "load.lock"
+READ_BYTES = 256 << 20  # store rows read at once when loading a block
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    key TEXT PRIMARY KEY,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    description TEXT NOT NULL
+);
+"""
+
+
+class CohortCache(object):
+    """
+    Shared-memory cache of (project, modality, feature subset) blocks of
+    matrix stores, with LRU eviction under a capacity in bytes.
+
+    Like CaseIndex, connections are opened per call, so a cache can be shared
+    by threads and pickled to worker processes.
+
+    :public:
+        get()
+        blocks()
+        clear()
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, capacity: int = CAPACITY):
+        '''
+        :params
+            cache_dir -- directory of the blocks and registry, on tmpfs for shared memory
+            capacity -- bytes of cached blocks kept
+        '''
+        self.dir = Path(cache_dir)
+        self.capacity = capacity
+        self.dir.mkdir(parents=True, exist_ok=True)
+        con = self.open_()
+        try:
+            con.executescript(SCHEMA)
+        finally:
+            con.close()
+
+    def open_(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.dir / REGISTRY_NAME), timeout=60, isolation_level=None)
+
+    @contextmanager
+    def connect_(self):
+        """Connection in an immediate (write-locking) transaction, committed on success."""
+        con = self.open_()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+        finally:
+            con.close()
+
+    @contextmanager
+    def locked_(self):
+        """Exclusive lock of block loading across processes."""
+        with open(self.dir / LOCK_NAME, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def path_(self, key: str) -> Path:
+        return self.dir / (key + '.npy')
+
+    def describe_(self, store: MatrixStore, project: str, modality: str, features) -> dict:
+        """Identity of a block: its store matrix (path, size, mtime) and features."""
+        stat = os.stat(store.matrix_path_(project, modality))
+        return {'matrix': str(store.matrix_path_(project, modality).resolve()),
+                'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'modality': modality, 'project': project,
+                'features': None if features is None else hashlib.sha256(
+                    '\n'.join(map(str, features)).encode()).hexdigest()}
+
+    def attach_(self, key: str):
+        """Read-only view of a registered block, marked as used; None if not cached."""
+        with self.connect_() as con:
+            found = con.execute("UPDATE blocks SET last_used = ? WHERE key = ?", (time.time(), key)).rowcount
+        if not found:
+            return None
+        try:
+            return np.load(self.path_(key), mmap_mode='r')
+        except FileNotFoundError:  # evicted in between
+            return None
+
+    def evict_(self, con, keep: str):
+        """Deletes least recently used blocks until the cached bytes fit the capacity."""
+        total = con.execute("SELECT COALESCE(SUM(nbytes), 0) FROM blocks").fetchone()[0]
+        for key, nbytes in con.execute("SELECT key, nbytes FROM blocks WHERE key != ? ORDER BY last_used",
+                                       (keep,)).fetchall():
+            if total <= self.capacity:
+                break
+            con.execute("DELETE FROM blocks WHERE key = ?", (key,))
+            try:
+                os.remove(self.path_(key))
+            except FileNotFoundError:
+                pass
+            total -= nbytes
+            logging.info("cache: evicted %s (%d MB)" % (key, nbytes >> 20))
+
+    def load_(self, store: MatrixStore, project: str, modality: str, features, key: str) -> Path:
+        """Copies a block from the store into the cache, row chunks at a time."""
+        m = store.matrix(project, modality)
+        cols = slice(None) if features is None else store.feature_positions(modality, features)
+        n_cols = m.shape[1] if features is None else len(cols)
+        tmp_path = self.dir / (key + '.%d.tmp.npy' % os.getpid())
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=m.dtype, shape=(m.shape[0], n_cols))
+        chunk = max(1, READ_BYTES // (m.shape[1] * m.itemsize))
+        for start in range(0, m.shape[0], chunk):
+            out[start:start + chunk] = m[start:start + chunk][:, cols]
+        out.flush()
+        del out
+        os.replace(tmp_path, self.path_(key))
+        return self.path_(key)
+
+    def get(self, store_dir, project: str, modality: str, features=None) -> np.ndarray:
+        """
+        (cases x features) block of a project's store matrix, rows as
+        MatrixStore.cases; loaded into the cache by the first process asking.
+
+        Args:
+            features: feature ids of the columns. if None: all features.
+
+        Returns:
+            read-only memory map shared with other processes, or a private
+            array if the block alone exceeds the capacity; of the codes of
+            the store's encoding, so quantized blocks take their compact size
+            in shared memory too (decode selected rows with MatrixStore.decode).
+        """
+        store = MatrixStore(store_dir)
+        description = self.describe_(store, project, modality, features)
+        key = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:24]
+
+        view = self.attach_(key)
+        if view is not None:
+            return view
+        m = store.matrix(project, modality)
+        nbytes = m.shape[0] * (m.shape[1] if features is None else len(features)) * m.itemsize
+        if nbytes > self.capacity:
+            logging.warning("cache: %s of %s (%d MB) exceeds the capacity, not cached"
+                            % (modality, project, nbytes >> 20))
+            return store.get(project, modality, features=features, decode=False)
+
+        with self.locked_():
+            # another process may have loaded it while we waited
+            view = self.attach_(key)
+            if view is not None:
+                return view
+            path = self.load_(store, project, modality, features, key)
+            view = np.load(path, mmap_mode='r')
+            with self.connect_() as con:
+                con.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?)",
+                            (key, nbytes, time.time(), json.dumps(description)))
+                self.evict_(con, keep=key)
+        logging.info("cache: loaded %s of %s (%d MB)" % (modality, project, nbytes >> 20))
+        return view
+
+    def blocks(self) -> pd.DataFrame:
+        """Cached blocks, most recently used first."""
+        with self.connect_() as con:
+            rows = con.execute("SELECT key, nbytes, last_used, description FROM blocks "
+                               "ORDER BY last_used DESC").fetchall()
+        df = pd.DataFrame(rows, columns=['key', 'nbytes', 'last_used', 'description'])
+        described = pd.DataFrame([json.loads(d) for d in df['description']],
+                                 columns=['project', 'modality', 'matrix'])
+        return pd.concat([df.drop(columns='description'), described], axis=1).set_index('key')
+
+    def clear(self):
+        """Deletes all cached blocks."""
+        with self.connect_() as con:
+            keys = [r[0] for r in con.execute("SELECT key FROM blocks").fetchall()]
+            con.execute("DELETE FROM blocks")
+            for key in keys:
+                try:
+                    os.remove(self.path_(key))
+                except FileNotFoundError:
+                    pass
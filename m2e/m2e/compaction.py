@@ -0,0 +1,148 @@
+"""
+Compaction of GDC methylation files into beta values and one shared probe
+annotation table.
+
+Every 450k methylation file repeats the same probe annotation columns next
+to its betas. compact_project verifies that invariance and removes the
+repetition:
+
+1. the annotation of every file (all columns but Beta_value, header
+   included) is hashed in a streaming pass (strip_values) on a process pool;
+2. each distinct annotation is written once, gzipped, as
+   <annotation_dir>/<digest>.tsv.gz;
+3. each file is rewritten as <file>.betas.npz, with its float64 betas, its
+   annotation digest and the path of the table relative to it, and the
+   original file is removed.
+
+m2e.readers reads compacted files at their original path, so Project,
+the matrix store ingest and batch prediction are unaffected.
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from m2e.project import data_paths
+from m2e.parallel import ordered_map
+from m2e.readers import compact_path, read_column_
+
+
+CHUNK_BYTES = 1 << 24
+
+
+def strip_values(path, sink=None) -> tuple:
+    """
+    Streams a methylation file without its value (second) column.
+
+    Args:
+        sink: binary file the stripped text is written to, if given.
+
+    Returns:
+        2-tuple of the sha256 hex digest of the stripped text and its line count.
+    """
+    digest, rest, n_lines = hashlib.sha256(), b'', 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            stripped = []
+            for line in lines:
+                fields = line.split(b'\t', 2)
+                stripped.append(fields[0] + b'\t' + fields[2] if len(fields) > 2 else fields[0])
+            stripped = b'\n'.join(stripped) + b'\n' if stripped else b''
+            digest.update(stripped)
+            n_lines += len(lines)
+            if sink is not None:
+                sink.write(stripped)
+    if rest:
+        fields = rest.split(b'\t', 2)
+        stripped = (fields[0] + b'\t' + fields[2] if len(fields) > 2 else fields[0]) + b'\n'
+        digest.update(stripped)
+        n_lines += 1
+        if sink is not None:
+            sink.write(stripped)
+    return digest.hexdigest(), n_lines
+
+
+def table_path(annotation_dir, digest: str) -> Path:
+    return Path(annotation_dir) / (digest[:16] + '.tsv.gz')
+
+
+def write_annotation_table(path, annotation_dir, digest: str) -> Path:
+    """Writes the annotation of a methylation file as its digest's shared table, once."""
+    out = table_path(annotation_dir, digest)
+    if out.is_file():
+        return out
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = str(out) + '.tmp'
+    with gzip.open(tmp_path, 'wb', compresslevel=6) as sink:
+        written, _ = strip_values(path, sink)
+    if written != digest:
+        os.remove(tmp_path)
+        raise ValueError(str(path) + " changed while being compacted.")
+    os.replace(tmp_path, out)
+    return out
+
+
+def compact_file(path, table, digest: str, n_lines: int, remove: bool = True) -> Path:
+    """
+    Rewrites a methylation file as its betas, referring to the annotation
+    table of its digest; n_lines, as counted by strip_values, checks the betas.
+    """
+    betas = read_column_(path, 'methylation', 1, dtype=np.float64)
+    if len(betas) != n_lines - 1:
+        raise ValueError("%s: %d betas for %d annotation rows" % (path, len(betas), n_lines - 1))
+    out = compact_path(path)
+    tmp_path = str(out)[:-len('.npz')] + '.tmp.npz'
+    np.savez_compressed(tmp_path, betas=betas, digest=np.array(digest),
+                        table=np.array(os.path.relpath(table, out.parent)))
+    os.replace(tmp_path, out)
+    if remove:
+        os.remove(path)
+    return out
+
+
+def compact_file_(args) -> Path:
+    return compact_file(*args)
+
+
+def compact_project(project, annotation_dir, n_jobs: int = -1, remove: bool = True) -> pd.DataFrame:
+    """
+    Verifies and compacts all methylation files of a project.
+
+    Args:
+        project: m2e.project.Project whose metadata lists the files.
+        annotation_dir: directory of the shared annotation tables, e.g. one for all projects.
+        remove: delete the original files once compacted.
+
+    Returns:
+        DataFrame of the files compacted (index file_id) with their annotation
+        digest and line count; files compacted before are skipped.
+    """
+    meth_dir = data_paths(project.dir, project.name)['methylation']
+    meta = project.modality_meta_('methylation')
+    paths = pd.Series([meth_dir / i / n for i, n in zip(meta['file_id'], meta['file_name'])],
+                      index=pd.Index(meta['file_id'], name='file_id'))
+    paths = paths[[os.path.isfile(p) for p in paths]]
+
+    digests = list(ordered_map(strip_values, paths.to_list(), n_jobs=n_jobs, backend='process'))
+    files = pd.DataFrame(digests, index=paths.index, columns=['digest', 'n_lines'])
+    counts = files['digest'].value_counts()
+    if len(counts) > 1:
+        logging.warning("%s: %d distinct probe annotations (%s)" % (project.name, len(counts), dict(counts)))
+
+    # each annotation is written from the first file having it
+    first = files.reset_index().drop_duplicates('digest').set_index('digest')['file_id']
+    tables = {digest: write_annotation_table(paths[file_id], annotation_dir, digest)
+              for digest, file_id in first.items()}
+    jobs = [(paths[file_id], tables[digest], digest, int(n_lines), remove)
+            for file_id, digest, n_lines in zip(files.index, files['digest'], files['n_lines'])]
+    for _ in ordered_map(compact_file_, jobs, n_jobs=n_jobs, backend='process'):
+        pass
+    logging.info("%s: %d methylation files compacted" % (project.name, len(files)))
+    return files
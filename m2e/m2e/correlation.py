@@ -0,0 +1,163 @@
+"""
+CpG-gene correlation ranking over the columnar store.
+
+Correlations between all probes and all genes are computed as blocked
+matrix products of column-standardized data: expression is standardized
+once, methylation is streamed from the store in probe blocks, and only the
+top-k probes per gene (by absolute correlation) are kept while streaming.
+The full probes x genes correlation matrix is never materialized.
+
+Missing beta values are mean-imputed (they contribute zero after centering),
+so correlations with missing data are slightly shrunk towards zero.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from m2e.store import MatrixStore
+from m2e.profiling import profiled
+
+
+METHODS = ('pearson', 'spearman')
+
+
+def standardize(x: np.ndarray, method: str = 'pearson') -> np.ndarray:
+    """
+    Column-standardizes x (samples x features) such that z.T @ z is the
+    correlation matrix: columns are centered and scaled to unit norm.
+    NaNs become 0 (mean-imputed), constant columns become all 0.
+    """
+    assert method in METHODS
+    if method == 'spearman':
+        x = pd.DataFrame(x).rank(axis=0).to_numpy(dtype=np.float32)
+    z = np.array(x, dtype=np.float32)
+    z -= np.nanmean(z, axis=0)
+    np.nan_to_num(z, copy=False, nan=0.0)
+    norm = np.sqrt(np.einsum('ij,ij->j', z, z))
+    norm[norm == 0] = np.inf
+    z /= norm
+    return z
+
+
+class TopK(object):
+    """Streaming selection of the k largest |scores| per row."""
+
+    def __init__(self, n_rows: int, k: int):
+        self.k = k
+        self.scores = np.zeros((n_rows, k), dtype=np.float32)
+        self.idx = np.full((n_rows, k), -1, dtype=np.int64)
+        self.abs = np.full((n_rows, k), -np.inf, dtype=np.float32)
+
+    def update(self, rows: slice, scores: np.ndarray, offset: int):
+        """Merges scores (rows x block) of columns offset..offset+block into rows."""
+        block_idx = np.broadcast_to(np.arange(offset, offset + scores.shape[1]), scores.shape)
+        cand_scores = np.concatenate([self.scores[rows], scores], axis=1)
+        cand_abs = np.concatenate([self.abs[rows], np.abs(scores)], axis=1)
+        cand_idx = np.concatenate([self.idx[rows], block_idx], axis=1)
+
+        keep = np.argpartition(-cand_abs, self.k - 1, axis=1)[:, :self.k]
+        self.scores[rows] = np.take_along_axis(cand_scores, keep, axis=1)
+        self.abs[rows] = np.take_along_axis(cand_abs, keep, axis=1)
+        self.idx[rows] = np.take_along_axis(cand_idx, keep, axis=1)
+
+    def sorted(self):
+        """Returns: (idx, scores) per row, ordered by decreasing |score|."""
+        order = np.argsort(-self.abs, axis=1, kind='stable')
+        return (np.take_along_axis(self.idx, order, axis=1),
+                np.take_along_axis(self.scores, order, axis=1))
+
+
+def top_k_correlations(probe_blocks, expr: np.ndarray, k: int,
+                       method: str = 'pearson', gene_block: int = 2048,
+                       n_jobs: int = -1):
+    """
+    Top-k most correlated probes per gene.
+
+    Args:
+        probe_blocks: iterable of (offset, array) with array of shape
+            (samples x probes in block), probe columns offset..offset+width.
+        expr: (samples x genes) expression array.
+        k: number of probes to keep per gene.
+        method: 'pearson' or 'spearman'.
+        gene_block: genes per matrix product; bounds the size of a block's
+            correlation matrix to gene_block x probe block.
+        n_jobs: threads running gene blocks concurrently, -1 for all cores.
+
+    Returns:
+        2-tuple of (genes x k) probe column indices and correlations,
+        ordered by decreasing absolute correlation.
+    """
+    n_genes = expr.shape[1]
+    z_expr = standardize(expr, method)
+    top = TopK(n_genes, k)
+    gene_slices = [slice(i, min(i + gene_block, n_genes)) for i in range(0, n_genes, gene_block)]
+    n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as pool:
+        for offset, block in probe_blocks:
+            assert block.shape[0] == expr.shape[0], "Probe and gene samples differ."
+            z_meth = standardize(block, method)
+
+            def correlate(rows):
+                # each gene block owns its rows of the top-k state
+                top.update(rows, z_expr[:, rows].T @ z_meth, offset)
+
+            list(pool.map(correlate, gene_slices))
+    return top.sorted()
+
+
+def store_probe_blocks(store: MatrixStore, projects: list, block_size: int = 8192, probes=None):
+    """
+    Yields (offset, samples x block) float32 methylation blocks over the store's
+    probes, rows being the cases of projects in order. Quantized stores are
+    read as their codes, e.g. a quarter of the bytes for beta8.
+
+    Args:
+        probes: restrict to these probe ids; offsets then index into probes.
+    """
+    if probes is None:
+        n = len(store.features('methylation'))
+        for start in range(0, n, block_size):
+            cols = slice(start, min(start + block_size, n))
+            yield start, store.decode('methylation', np.concatenate(
+                [np.asarray(store.matrix(p, 'methylation')[:, cols]) for p in projects], axis=0))
+    else:
+        positions = store.feature_positions('methylation', probes)
+        for start in range(0, len(positions), block_size):
+            cols = positions[start:start + block_size]
+            yield start, store.decode('methylation', np.concatenate(
+                [store.matrix(p, 'methylation')[:, cols] for p in projects], axis=0))
+
+
+@profiled('correlation.rank')
+def rank_cpgs(store: MatrixStore, projects: list, genes=None, probes=None, k: int = 50,
+              method: str = 'pearson', block_size: int = 8192, n_jobs: int = -1) -> pd.DataFrame:
+    """
+    Ranks CpGs by correlation of methylation with each gene's expression
+    across all cases of projects.
+
+    Args:
+        store: columnar store with both modalities of projects ingested.
+        genes: gene ids to rank for. if None: all genes of the store.
+        probes: probe ids to rank. if None: all probes of the store.
+        k: probes kept per gene.
+
+    Returns:
+        DataFrame with columns Gene, Meth_Probe, Corr_Coeff; k rows per gene
+        ordered by decreasing absolute correlation.
+    """
+    for p in projects:
+        assert store.cases(p, 'methylation').equals(store.cases(p, 'expression')), \
+            "Methylation and expression rows of " + p + " differ."
+    gene_ids = store.features('expression') if genes is None else pd.Index(genes)
+    probe_ids = store.features('methylation') if probes is None else pd.Index(probes)
+    expr = np.concatenate([store.get(p, 'expression', features=genes) for p in projects], axis=0)
+
+    idx, corr = top_k_correlations(store_probe_blocks(store, projects, block_size, probes),
+                                   expr, min(k, len(probe_ids)), method=method, n_jobs=n_jobs)
+    return pd.DataFrame({'Gene': np.repeat(gene_ids.to_numpy(), idx.shape[1]),
+                         'Meth_Probe': probe_ids.to_numpy()[idx.ravel()],
+                         'Corr_Coeff': corr.ravel()})
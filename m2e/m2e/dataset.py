@@ -0,0 +1,201 @@
+"""
+(case, gene) dataset of promoter sequence, methylation and expression.
+
+Samples are read straight from the memory-mapped matrix store (m2e.store)
+and the packed promoter store (m2e.sequence): all index arithmetic (case
+rows, gene and CpG columns, CpG offsets) is resolved once in __init__ into
+numpy arrays, and a batch of samples is gathered with a few fancy-indexing
+operations per project instead of per-case pandas lookups.
+
+Memory maps are opened lazily in the process that reads them, so the
+dataset can be handed to DataLoader(num_workers=N) with fork or spawn:
+workers share the precomputed arrays and the page cache, not file handles.
+__getitems__ serves a whole DataLoader batch in one call.
+
+    ds = MethExprDataset(store_dir, proms_store_dir, projects, genes, cpgs)
+    loader = DataLoader(ds, batch_size=256, shuffle=True, num_workers=8)
+
+torch is optional: without it the dataset is a plain indexable object and
+get_batch() returns numpy arrays.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from m2e.store import MatrixStore
+from m2e.sequence import PromoterStore, ONE_HOT, BASE2IDX
+
+try:
+    from torch.utils.data import Dataset
+except ImportError:  # torch is only needed for DataLoader
+    Dataset = object
+
+
+class MethExprDataset(Dataset):
+    """
+    Samples of (case, gene) pairs, case-major: sample i is gene i % n_genes of
+    case i // n_genes.
+
+    Each sample is (x, y):
+        x -- float32 (length x vocab) one-hot promoter with CpG beta values in
+             the cytosine channel (as methylate_seq of the DataLoaders notebook),
+             or with compose=False a 2-tuple of the one-hot promoter and a
+             float32 (length,) methylation track, NaN where there is no CpG.
+        y -- float32 expression of the gene in the case.
+
+    :public:
+        get_batch()
+        sample_ids()
+    """
+
+    def __init__(self, store_dir, promoters_dir, projects, genes, promoter_cpgs, promoter_ids=None,
+                 id_map=None, cases=None, length: int = None, window=None, max_cpgs: int = None,
+                 compose: bool = True, expr_transform=None, meth_idx: int = BASE2IDX['C']):
+        '''
+        :params
+            store_dir -- matrix store with methylation and expression of the projects
+            promoters_dir -- packed promoter store (m2e.sequence.pack_fasta)
+            projects -- project names
+            genes -- expression feature ids (version-stripped Ensembl ids)
+            promoter_cpgs -- m2e.intervals.PromoterCpgs of the promoters
+            promoter_ids -- promoter (Entrez) ids of genes, in the same order.
+                            if None: converted by id_map, or else genes are used as promoter ids.
+            id_map -- m2e.gene_ids.GeneIdMap, e.g. gene_id_map()
+            cases -- case ids to restrict to (e.g. a train split). if None: all cases.
+            length -- promoter length of samples. if None: the longest promoter.
+            window -- (upstream, downstream) window view of the promoter store
+            max_cpgs -- CpGs per promoter kept. if None: all.
+            compose -- write beta values into the sequence encoding
+            expr_transform -- vectorized function applied to expression, e.g. np.log1p
+            meth_idx -- channel receiving beta values
+        '''
+        self.store_dir = store_dir
+        self.promoters_dir = promoters_dir
+        self.window = window
+        self.compose = compose
+        self.expr_transform = expr_transform
+        self.meth_idx = meth_idx
+        self.genes = pd.Index(genes)
+        if promoter_ids is None:
+            promoter_ids = self.genes if id_map is None else id_map.to_entrez(self.genes, as_str=True)
+        self.promoter_ids = pd.Index(promoter_ids)
+        assert len(self.promoter_ids) == len(self.genes)
+
+        store = MatrixStore(store_dir)
+        promoters = PromoterStore(promoters_dir, window=window)
+
+        # cases: project code and matrix rows of both modalities
+        frames = []
+        for code, project in enumerate(projects):
+            project_cases = store.cases(project, 'methylation')
+            project_cases = project_cases[project_cases.isin(store.cases(project, 'expression'))]
+            if cases is not None:
+                project_cases = project_cases[project_cases.isin(cases)]
+            frames.append(pd.DataFrame({
+                'project': project, 'case': project_cases,
+                'code': code,
+                'meth_row': store.case_positions(project, 'methylation', project_cases),
+                'expr_row': store.case_positions(project, 'expression', project_cases)}))
+        self.cases = pd.concat(frames, ignore_index=True)
+        self.projects = list(projects)
+        self.case_codes = self.cases['code'].to_numpy()
+        self.meth_rows = self.cases['meth_row'].to_numpy()
+        self.expr_rows = self.cases['expr_row'].to_numpy()
+
+        # genes: expression columns, CpG columns and offsets, sequence codes
+        self.expr_cols = store.feature_positions('expression', self.genes)
+        offsets, cpg_ids = promoter_cpgs.padded(self.promoter_ids, max_cpgs)
+        offsets = offsets - promoters.window_starts(self.promoter_ids)[:, None]
+        cpg_cols = store.features('methylation').get_indexer(pd.Index(cpg_ids.ravel())).reshape(cpg_ids.shape)
+        self.codes = promoters.batch_codes(self.promoter_ids, length)
+        self.length = self.codes.shape[1]
+        # CpGs outside the window or not measured are dropped
+        valid = (offsets >= 0) & (offsets < self.length) & (cpg_cols >= 0) & (cpg_ids != '')
+        self.offsets = np.where(valid, offsets, -1)
+        self.cpg_cols = np.where(valid, cpg_cols, -1)
+
+        self.pid_ = None
+        self.store_ = None
+
+    def __len__(self):
+        return len(self.cases) * len(self.genes)
+
+    def __getstate__(self):
+        # memory maps are reopened by each worker process
+        state = self.__dict__.copy()
+        state['pid_'], state['store_'] = None, None
+        return state
+
+    def store(self) -> MatrixStore:
+        """Matrix store of the current process."""
+        if self.pid_ != os.getpid():
+            self.store_ = MatrixStore(self.store_dir)
+            self.pid_ = os.getpid()
+        return self.store_
+
+    def sample_ids(self, indices) -> pd.DataFrame:
+        """project, case and gene of samples."""
+        c, g = np.divmod(np.asarray(indices, dtype=np.int64), len(self.genes))
+        df = self.cases.loc[c, ['project', 'case']].reset_index(drop=True)
+        df['gene'] = self.genes[g]
+        return df
+
+    def values_(self, c: np.ndarray, g: np.ndarray):
+        """Expression (B,) and CpG betas (B x K) of case / gene positions, decoded to float32."""
+        store = self.store()
+        y = np.empty(len(c), dtype=np.float32)
+        betas = np.full(self.cpg_cols[g].shape, np.nan, dtype=np.float32)
+        codes = self.case_codes[c]
+        for code in np.unique(codes):
+            sel = np.nonzero(codes == code)[0]
+            project = self.projects[code]
+            expr = store.matrix(project, 'expression')
+            y[sel] = store.decode('expression', expr[self.expr_rows[c[sel]], self.expr_cols[g[sel]]])
+
+            cols = self.cpg_cols[g[sel]]
+            found = cols >= 0
+            if found.any():
+                meth = store.matrix(project, 'methylation')
+                rows = np.broadcast_to(self.meth_rows[c[sel]][:, None], cols.shape)
+                block = betas[sel]
+                block[found] = store.decode('methylation', meth[rows[found], cols[found]])
+                betas[sel] = block
+        if self.expr_transform is not None:
+            y = self.expr_transform(y).astype(np.float32)
+        return y, betas
+
+    def get_batch(self, indices):
+        """
+        Samples of indices, stacked.
+
+        Returns:
+            2-tuple of x (B x length x vocab) float32, or with compose=False a
+            2-tuple of it and the (B x length) methylation track, and y (B,).
+        """
+        c, g = np.divmod(np.asarray(indices, dtype=np.int64), len(self.genes))
+        y, betas = self.values_(c, g)
+        x = ONE_HOT[self.codes[g]]
+
+        offsets = self.offsets[g]
+        b, k = np.nonzero((offsets >= 0) & ~np.isnan(betas))
+        if self.compose:
+            x[b, offsets[b, k], self.meth_idx] = betas[b, k]
+            return x, y
+        track = np.full((len(g), self.length), np.nan, dtype=np.float32)
+        track[b, offsets[b, k]] = betas[b, k]
+        return (x, track), y
+
+    def __getitem__(self, i):
+        x, y = self.get_batch([i])
+        if self.compose:
+            return x[0], y[0]
+        return (x[0][0], x[1][0]), y[0]
+
+    def __getitems__(self, indices) -> list:
+        """Batched fetch used by DataLoader: one gather for all indices."""
+        x, y = self.get_batch(indices)
+        if self.compose:
+            return [(x[i], y[i]) for i in range(len(y))]
+        return [((x[0][i], x[1][i]), y[i]) for i in range(len(y))]
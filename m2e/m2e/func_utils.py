@@ -4,21 +4,183 @@
 
 import os
 import gzip
+import zlib
+import ftplib
+import hashlib
 import requests
 from urllib import request
+from urllib.parse import urlparse
 import shutil
 from contextlib import closing
 
-from Bio import SeqIO
+
+CHUNK_SIZE = 1 << 20
+
+
+class GunzipStream(object):
+    """Incremental gzip decompression, including multi-member (bgzip) files."""
+
+    def __init__(self):
+        self.d = zlib.decompressobj(wbits=31)
+
+    def feed(self, data: bytes) -> bytes:
+        out = []
+        while data:
+            out.append(self.d.decompress(data))
+            if not self.d.eof:
+                break
+            data = self.d.unused_data
+            self.d = zlib.decompressobj(wbits=31)
+        return b''.join(out)
+
+    def close(self) -> bytes:
+        return self.d.flush()
+
+
+class FastaHeaderStream(object):
+    """Incremental FASTA rewrite keeping only the first word (chromosome id) of headers."""
+
+    def __init__(self):
+        self.header = None  # bytes of the header line being read, if any
+        self.line_start = True
+
+    @staticmethod
+    def edit(header: bytes) -> bytes:
+        words = header[1:].split()
+        return b'>' + (words[0] if words else b'') + b'\n'
+
+    def feed(self, data: bytes) -> bytes:
+        out = []
+        pos, n = 0, len(data)
+        while pos < n:
+            if self.header is not None:
+                nl = data.find(b'\n', pos)
+                if nl < 0:
+                    self.header += data[pos:]
+                    break
+                out.append(self.edit(self.header + data[pos:nl]))
+                self.header, self.line_start = None, True
+                pos = nl + 1
+            elif self.line_start and data[pos:pos + 1] == b'>':
+                self.header = b''
+            else:
+                # sequence lines are copied through up to the next header
+                nxt = data.find(b'\n>', pos)
+                if nxt < 0:
+                    out.append(data[pos:])
+                    self.line_start = data.endswith(b'\n')
+                    break
+                out.append(data[pos:nxt + 1])
+                self.line_start = True
+                pos = nxt + 1
+        return b''.join(out)
+
+    def close(self) -> bytes:
+        return self.edit(self.header) if self.header else b''
+
+
+def open_remote(url, offset: int = 0):
+    """
+    Opens url for reading from byte offset.
+
+    Returns:
+        2-tuple of a file-like response and whether it starts at offset
+        (False if the server ignored the range and sends the whole file).
+    """
+    scheme = urlparse(url).scheme
+    if scheme == 'ftp':
+        u = urlparse(url)
+        ftp = ftplib.FTP(u.hostname)
+        ftp.login(u.username or 'anonymous', u.password or '')
+        ftp.voidcmd('TYPE I')
+        conn = ftp.transfercmd('RETR ' + u.path, rest=offset or None)
+        f = conn.makefile('rb')
+
+        class FtpResponse(object):
+            def read(self, n=-1):
+                return f.read(n)
+
+            def close(self):
+                f.close()
+                conn.close()
+                try:
+                    ftp.voidresp()
+                    ftp.quit()
+                except ftplib.all_errors:
+                    ftp.close()
+        return FtpResponse(), True
+
+    req = request.Request(url)
+    if offset:
+        req.add_header('Range', 'bytes=%d-' % offset)
+    r = request.urlopen(req)
+    return r, (offset == 0 or getattr(r, 'status', None) == 206)
+
+
+def stream_download(url, path, gunzip=False, fasta_headers=False, checksum=None, resume=True):
+    """
+    Downloads url to path in a single pass, optionally decompressing gzip and
+    rewriting FASTA headers on the fly.
+
+    The raw download is kept in <path>.part until complete, so an interrupted
+    download resumes with a byte range request; the already downloaded part is
+    replayed through the pipeline from local disk. The output is written to
+    <path>.tmp and renamed to path only after the checksum has been verified.
+
+    Args:
+        gunzip: decompress the gzip stream.
+        fasta_headers: keep only the first word of FASTA headers (see fasta_header).
+        checksum: expected digest of the raw download, '<algorithm>:<hex>',
+                  e.g. 'md5:...'. Mismatches raise ValueError.
+        resume: continue from an existing <path>.part.
+    Returns:
+        path
+    """
+    part_path, tmp_path = path + '.part', path + '.tmp'
+    algorithm, expected = checksum.split(':', 1) if checksum else (None, None)
+    digest = hashlib.new(algorithm) if checksum else None
+    stages = ([GunzipStream()] if gunzip else []) + ([FastaHeaderStream()] if fasta_headers else [])
+
+    def process(data):
+        for stage in stages:
+            data = stage.feed(data)
+        return data
+
+    offset = os.path.getsize(part_path) if resume and os.path.isfile(part_path) else 0
+    r, ranged = open_remote(url, offset)
+    with closing(r), open(tmp_path, 'wb') as out:
+        if ranged and offset:
+            with open(part_path, 'rb') as part:
+                for data in iter(lambda: part.read(CHUNK_SIZE), b''):
+                    if digest is not None:
+                        digest.update(data)
+                    out.write(process(data))
+        with open(part_path, 'ab' if ranged and offset else 'wb') as part:
+            for data in iter(lambda: r.read(CHUNK_SIZE), b''):
+                part.write(data)
+                if digest is not None:
+                    digest.update(data)
+                out.write(process(data))
+        # flush stages in order, feeding each one's tail to the next
+        for i, stage in enumerate(stages):
+            tail = stage.close()
+            for later in stages[i + 1:]:
+                tail = later.feed(tail)
+            out.write(tail)
+
+    if digest is not None and digest.hexdigest() != expected.lower():
+        os.remove(part_path)
+        os.remove(tmp_path)
+        raise ValueError("Checksum mismatch for " + url + ": " + digest.hexdigest())
+    os.replace(tmp_path, path)
+    os.remove(part_path)
+    return path
 
 
 def ftp_download(url, dir):
     """Downloads using ftp protocol"""
     filename = url.split('/')[-1]
-    with closing(request.urlopen(url)) as r:
-        with open(dir + filename, 'wb+') as f:
-            shutil.copyfileobj(r, f)
-    return dir + filename
+    return stream_download(url, dir + filename)
 
 
 def ungzip(path):
@@ -33,39 +195,40 @@ def ungzip(path):
 
 def fasta_header(path, new_path):
     """Edits header by removing other info than chromosome id."""
-    with open(path, 'r') as f_in:
-        with open(new_path, 'w+') as f_out:
-            records = SeqIO.parse(f_in, 'fasta')
-            for record in records:
-                record.id = record.id.split(" ")[0]
-                record.description = record.id.split(" ")[0]
-                SeqIO.write(record, f_out, 'fasta')
+    stream = FastaHeaderStream()
+    with open(path, 'rb') as f_in:
+        with open(new_path, 'wb+') as f_out:
+            for data in iter(lambda: f_in.read(CHUNK_SIZE), b''):
+                f_out.write(stream.feed(data))
+            f_out.write(stream.close())
     return new_path
 
 
-def get_genome(url, dir):
-    """Downloads genome from URL and processes: unzip +/- index generation."""
-    zip_path = ftp_download(url, dir)
-    unzip_path = ungzip(zip_path)
-
-    #edit fasta headers to be compatible with gff
-    edited_path = "".join(unzip_path.split(".")[:-1] + ['_edited'] + ['.fna'])
-    edited_path = fasta_header(unzip_path, edited_path)
-    return edited_path
+def get_genome(url, dir, checksum=None):
+    """Downloads genome from URL and processes in one pass: unzip + edit fasta headers to be compatible with gff."""
+    filename = url.split('/')[-1]
+    if filename.endswith('.gz'):
+        filename = filename[:-len('.gz')]
+    edited_path = dir + filename.rsplit('.', 1)[0] + '_edited.fna'
+    return stream_download(url, edited_path, gunzip=url.endswith('.gz'), fasta_headers=True, checksum=checksum)
 
 
-def get_gff(url, dir):
-    """Downloads gff from URL"""
-    zip_path = ftp_download(url, dir)
-    unzip_path = ungzip(zip_path)
-    return unzip_path
+def get_gff(url, dir, checksum=None):
+    """Downloads gff from URL, unzipping while downloading."""
+    filename = url.split('/')[-1]
+    gunzip = filename.endswith('.gz')
+    if gunzip:
+        filename = filename[:-len('.gz')]
+    return stream_download(url, dir + filename, gunzip=gunzip, checksum=checksum)
 
 
 def get_cpgs(url, dir) -> str:
     """Downloads platfrom cpg info from URL"""
-    r = requests.get(url)
-    if r.status_code == 200:
+    with closing(requests.get(url, stream=True)) as r:
+        r.raise_for_status()
         filename = r.headers['Content-Disposition'].split("=")[-1]
-        with open(dir + filename, 'w+') as f:
-            f.write(r.text)
-    return dir + filename
\ No newline at end of file
+        with open(dir + filename + '.tmp', 'wb') as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+    os.replace(dir + filename + '.tmp', dir + filename)
+    return dir + filename
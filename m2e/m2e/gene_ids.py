@@ -0,0 +1,153 @@
+"""
+Gene id conversion between Ensembl and Entrez (NCBI) ids.
+
+The Biomart lookup table is read once per process into integer-coded
+arrays: every unversioned Ensembl id and every Entrez id gets a dense code,
+and each direction of the mapping is a single code -> code array, so bulk
+conversion is one get_indexer plus one take. gene_id_map() returns the
+shared instance used by Project, datasets and scripts; the lookup is only
+downloaded from Biomart if the csv is missing.
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+LOOKUP_PATH = "../data/genomics/gene_id_lookup.csv"
+ENSEMBL_COL = "Gene stable ID"
+ENTREZ_COL = "NCBI gene ID"
+
+
+def strip_versions(ids) -> pd.Index:
+    """Cuts off versions of Ensembl ids, e.g. ENSG0000.1 -> ENSG0000."""
+    return pd.Index(pd.Index(ids).astype(str).str.split('.', n=1).str[0])
+
+
+# last versioned id list seen by unversioned() and its stripped ids
+_last_versioned = (None, None)
+
+
+def unversioned(ids) -> pd.Index:
+    """
+    strip_versions, cached for the last id list: GDC expression files of a
+    release list the same ids in the same order, so a repeated list costs
+    one comparison instead of string splitting.
+    """
+    global _last_versioned
+    ids = pd.Index(ids)
+    versioned, stripped = _last_versioned
+    if versioned is None or not ids.equals(versioned):
+        stripped = strip_versions(ids)
+        _last_versioned = (ids, stripped)  # one assignment: safe across threads
+    return stripped
+
+
+def download_lookup(path=LOOKUP_PATH) -> pd.DataFrame:
+    """Queries Ensembl Biomart for the Ensembl -> Entrez table and saves it to path."""
+    from pybiomart import Dataset as BiomartDataset
+
+    dataset = BiomartDataset(name='hsapiens_gene_ensembl', host='http://www.ensembl.org')
+    lk = dataset.query(attributes=['ensembl_gene_id', 'entrezgene_id'], filters=None).dropna()
+    lk[ENTREZ_COL] = lk[ENTREZ_COL].astype('int64')
+    tmp_path = str(path) + '.tmp'
+    lk.to_csv(tmp_path, index=False, header=True)
+    os.replace(tmp_path, path)
+    return lk
+
+
+class GeneIdMap(object):
+    """
+    Vectorized Ensembl <-> Entrez conversion.
+
+    Ids mapped to several partners convert to the first one in the lookup.
+
+    :public:
+        to_entrez()
+        to_ensembl()
+    """
+
+    def __init__(self, lookup: pd.DataFrame):
+        '''
+        :params
+            lookup -- table with ENSEMBL_COL and ENTREZ_COL columns
+        '''
+        lookup = lookup.dropna(subset=[ENSEMBL_COL, ENTREZ_COL])
+        ens_codes, self.ensembl = pd.factorize(strip_versions(lookup[ENSEMBL_COL]))
+        ent_codes, entrez = pd.factorize(lookup[ENTREZ_COL].to_numpy(dtype=np.int64))
+        self.entrez = pd.Index(entrez)
+        self.entrez_str = pd.Index(self.entrez.astype(str))
+
+        # code -> partner code in the first lookup row of the code; every code has a row
+        _, first = np.unique(ens_codes, return_index=True)
+        self.ens2ent = ent_codes[first].astype(np.int64)
+        _, first = np.unique(ent_codes, return_index=True)
+        self.ent2ens = ens_codes[first].astype(np.int64)
+
+    @classmethod
+    def from_csv(cls, path=LOOKUP_PATH):
+        return cls(pd.read_csv(path, usecols=[ENSEMBL_COL, ENTREZ_COL]))
+
+    def codes_(self, index: pd.Index, ids, errors: str) -> np.ndarray:
+        codes = index.get_indexer(ids)
+        if errors == 'raise' and (codes < 0).any():
+            missing = [i for i, c in zip(ids, codes) if c < 0]
+            raise KeyError("Gene ids not in lookup: " + str(missing[:10]))
+        return codes
+
+    def to_entrez(self, ids, errors: str = 'raise', as_str: bool = False) -> np.ndarray:
+        """
+        Entrez ids of (versioned or unversioned) Ensembl ids.
+
+        Args:
+            errors: 'raise' a KeyError on unknown ids or 'ignore' them.
+            as_str: return ids as strings, as in genes.json and promoter stores.
+
+        Returns:
+            int64 array (-1 for unknown and unmapped ids), or str array ('' for them).
+        """
+        codes = self.codes_(self.ensembl, strip_versions(ids), errors)
+        target = np.where(codes >= 0, self.ens2ent[codes], -1)
+        if errors == 'raise' and (target < 0).any():
+            raise KeyError("Ensembl ids without Entrez id: " + str(list(np.asarray(ids)[target < 0][:10])))
+        found = target >= 0
+        if as_str:
+            out = np.full(len(target), '', dtype=object)
+            out[found] = self.entrez_str.to_numpy()[target[found]]
+            return out
+        out = np.full(len(target), -1, dtype=np.int64)
+        out[found] = self.entrez.to_numpy()[target[found]]
+        return out
+
+    def to_ensembl(self, ids, errors: str = 'raise') -> np.ndarray:
+        """
+        Unversioned Ensembl ids of Entrez ids (int or str).
+
+        Returns:
+            str array, '' for unknown and unmapped ids with errors='ignore'.
+        """
+        ids = pd.Index(ids)
+        index = self.entrez if pd.api.types.is_integer_dtype(ids.dtype) else self.entrez_str
+        codes = self.codes_(index, ids, errors)
+        target = np.where(codes >= 0, self.ent2ens[codes], -1)
+        if errors == 'raise' and (target < 0).any():
+            raise KeyError("Entrez ids without Ensembl id: " + str(list(ids[target < 0][:10])))
+        out = np.full(len(target), '', dtype=object)
+        out[target >= 0] = self.ensembl.to_numpy()[target[target >= 0]]
+        return out
+
+
+@lru_cache(maxsize=None)
+def gene_id_map(path=LOOKUP_PATH, download: bool = True) -> GeneIdMap:
+    """
+    Shared GeneIdMap of a lookup csv, loaded once per process.
+
+    Args:
+        download: query Biomart if the csv does not exist.
+    """
+    if download and not os.path.isfile(path):
+        download_lookup(path)
+    return GeneIdMap.from_csv(path)
+
@@ -0,0 +1,228 @@
+"""
+Gene and promoter extraction from the RefSeq GFF and genome FASTA.
+
+Gene rows of the GFF are parsed into typed columns in chunks, promoter
+windows are computed for all genes at once, and promoter sequences are
+sliced out of a memory-mapped genome FASTA, one chromosome at a time.
+Outputs match the former pybedtools pipeline of 01_collect_genomics.py
+(five_prime windows, first interval per gene id, gene id in the feature
+type column, FASTA headers as <GeneID>(<strand>)) without bedtools.
+"""
+
+import os
+import csv
+import json
+import mmap
+
+import numpy as np
+import pandas as pd
+
+
+GFF_COLS = ['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes']
+COMPLEMENT = bytes.maketrans(b'ACGTNacgtn', b'TGCANtgcan')
+
+
+def read_gff_genes(path, chromosomes=None, chunksize: int = 500000) -> pd.DataFrame:
+    """
+    Loads the gene rows of a GFF3 file.
+
+    Args:
+        chromosomes: seqids to keep. if None: all.
+        chunksize: rows parsed at once; only gene rows are retained.
+
+    Returns:
+        DataFrame with the 9 GFF columns (start, end as int) and GeneID,
+        the first Dbxref entry's id (e.g. Dbxref=GeneID:7133,... -> 7133).
+    """
+    chunks = pd.read_csv(path, sep='\t', header=None, names=GFF_COLS, dtype=str,
+                         quoting=csv.QUOTE_NONE, chunksize=chunksize)
+    genes = []
+    for chunk in chunks:
+        keep = chunk['type'] == 'gene'
+        if chromosomes is not None:
+            keep &= chunk['seqid'].isin(chromosomes)
+        genes.append(chunk.loc[keep])
+    df = pd.concat(genes, ignore_index=True)
+    df = df.astype({'start': np.int64, 'end': np.int64})
+    df['GeneID'] = (df['attributes'].str.extract(r'Dbxref=([^,;]*)', expand=False)
+                    .str.rsplit(':', n=1).str[-1])
+    return df
+
+
+def read_promoters(path) -> pd.DataFrame:
+    """
+    Loads a promoter GFF written by extract_promoters (gene id in the type column).
+    """
+    df = pd.read_csv(path, sep='\t', header=None, names=GFF_COLS, dtype=str, quoting=csv.QUOTE_NONE)
+    df = df.astype({'start': np.int64, 'end': np.int64})
+    df['GeneID'] = df['type']
+    return df
+
+
+def promoter_windows(genes: pd.DataFrame, upstream: int, downstream: int = 0) -> pd.DataFrame:
+    """
+    Strand-aware promoter windows of genes, as pybedtools' five_prime: upstream
+    bases before the gene start (end on '-') and downstream bases after it.
+
+    Returns:
+        copy of genes with start, end (1-based, inclusive) of the promoters.
+    """
+    proms = genes.copy()
+    minus = (genes['strand'] == '-').to_numpy()
+    start, end = genes['start'].to_numpy(), genes['end'].to_numpy()
+    proms['start'] = np.maximum(np.where(minus, end - downstream + 1, start - upstream), 1)
+    proms['end'] = np.where(minus, end + upstream, start - 1 + downstream)
+    return proms
+
+
+def widest_window(windows) -> tuple:
+    """(upstream, downstream) window containing all (upstream, downstream) windows."""
+    return max(u for u, _ in windows), max(d for _, d in windows)
+
+
+def window_views(genes: pd.DataFrame, windows, lengths) -> dict:
+    """
+    Locates promoter windows within the sequences of the widest window.
+
+    Args:
+        genes: gene rows (one per GeneID), in the row order of the sequences.
+        windows: (upstream, downstream) windows.
+        lengths: lengths of the extracted widest-window sequences, which are
+                 shorter than the window at chromosome ends.
+
+    Returns:
+        {(upstream, downstream) -> (starts, lengths)} int64 arrays: window i is
+        widest[i][starts[i]:starts[i] + lengths[i]] of the strand-oriented sequences.
+    """
+    widest = promoter_windows(genes, *widest_window(windows))
+    w_start = widest['start'].to_numpy()
+    w_end = w_start + np.asarray(lengths, dtype=np.int64) - 1  # last extracted base
+    minus = (genes['strand'] == '-').to_numpy()
+    views = {}
+    for u, d in windows:
+        proms = promoter_windows(genes, u, d)
+        start, end = proms['start'].to_numpy(), np.minimum(proms['end'].to_numpy(), w_end)
+        length = np.maximum(end - start + 1, 0)
+        # '-' sequences are reverse complemented: they begin at the last extracted base
+        offset = np.where(minus, w_end - end, start - w_start)
+        offset = np.where(length > 0, offset, 0)
+        views[(u, d)] = (offset.astype(np.int64), length.astype(np.int64))
+    return views
+
+
+def dedup_genes(df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the first row of every GeneID."""
+    return df.loc[~df['GeneID'].duplicated(keep='first')]
+
+
+def write_gff(df: pd.DataFrame, path, type_col: str = 'type'):
+    """Writes rows as GFF; type_col fills the feature type column."""
+    out = df[GFF_COLS].copy()
+    out['type'] = df[type_col]
+    tmp_path = str(path) + '.tmp'
+    out.to_csv(tmp_path, sep='\t', header=False, index=False, quoting=csv.QUOTE_NONE)
+    os.replace(tmp_path, path)
+
+
+def genes_json(proms: pd.DataFrame) -> dict:
+    """genes.json records {GeneID -> {GeneID, chr, start, end, strand}} of promoters."""
+    return {g: {'GeneID': g, 'chr': c, 'start': str(s), 'end': str(e), 'strand': st}
+            for g, c, s, e, st in zip(proms['GeneID'], proms['seqid'], proms['start'],
+                                      proms['end'], proms['strand'])}
+
+
+def read_genome(path, names=None):
+    """
+    Yields (name, sequence bytes) of FASTA records from a memory map of path.
+    Records not in names are skipped without being copied.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(b'>')
+        while pos >= 0:
+            header_end = mm.find(b'\n', pos)
+            name = mm[pos + 1:header_end].split()[0].decode()
+            nxt = mm.find(b'\n>', header_end)
+            seq_end = len(mm) if nxt < 0 else nxt
+            if names is None or name in names:
+                yield name, mm[header_end + 1:seq_end].replace(b'\n', b'').replace(b'\r', b'')
+            pos = -1 if nxt < 0 else nxt + 1
+
+
+def reverse_complement(seq: bytes) -> bytes:
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def extract_sequences(genome_path, proms: pd.DataFrame) -> list:
+    """
+    Sequences of promoter windows in row order, reverse complemented on '-'
+    strands (as bedtools getfasta -s). Windows are clipped to chromosome ends.
+    """
+    seqs = [b''] * len(proms)
+    rows = pd.Series(np.arange(len(proms))).groupby(proms['seqid'].to_numpy())
+    by_chrom = {chrom: r.to_numpy() for chrom, r in rows}
+    starts, ends = proms['start'].to_numpy(), proms['end'].to_numpy()
+    minus = (proms['strand'] == '-').to_numpy()
+    for chrom, chrom_seq in read_genome(genome_path, set(by_chrom)):
+        for i in by_chrom[chrom]:
+            seq = chrom_seq[starts[i] - 1:ends[i]]
+            seqs[i] = reverse_complement(seq) if minus[i] else seq
+    return seqs
+
+
+def write_fasta(names, seqs, path):
+    """Writes one-line records >name\\nseq."""
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for name, seq in zip(names, seqs):
+            f.write(b'>' + name.encode() + b'\n' + seq + b'\n')
+    os.replace(tmp_path, path)
+
+
+def extract_promoter_windows(genes: pd.DataFrame, genome_path, windows):
+    """
+    Sequences of several promoter windows from one pass over the genome: the
+    widest window is extracted once, and every window is a view into it.
+
+    Args:
+        genes: gene rows, e.g. of read_gff_genes; only the first row of a GeneID is kept.
+        windows: (upstream, downstream) windows.
+
+    Returns:
+        3-tuple of the widest-window promoters (GFF columns + GeneID), their
+        sequences, and the window views (see window_views).
+    """
+    genes = dedup_genes(genes).reset_index(drop=True)
+    proms = promoter_windows(genes, *widest_window(windows))
+    seqs = extract_sequences(genome_path, proms)
+    views = window_views(genes, windows, [len(s) for s in seqs])
+    return proms, seqs, views
+
+
+def extract_promoters(gff_path, genome_path, upstream: int, downstream: int = 0, chromosomes=None,
+                      genes_gff_path=None, proms_gff_path=None, genes_json_path=None, proms_seq_path=None):
+    """
+    Promoter extraction in one pass over the GFF and the genome.
+
+    Args:
+        upstream, downstream: promoter window around gene starts.
+        chromosomes: seqids to keep. if None: all.
+        *_path: outputs to write (skipped if None): gene rows GFF, promoter
+            GFF, genes.json, and promoter FASTA with <GeneID>(<strand>) headers.
+
+    Returns:
+        DataFrame of promoters (GFF columns + GeneID), one per gene id.
+    """
+    genes = read_gff_genes(gff_path, chromosomes)
+    if genes_gff_path is not None:
+        write_gff(genes, genes_gff_path)
+
+    proms = dedup_genes(promoter_windows(genes, upstream, downstream)).reset_index(drop=True)
+    if proms_gff_path is not None:
+        write_gff(proms, proms_gff_path, type_col='GeneID')
+    if genes_json_path is not None:
+        with open(genes_json_path, 'w+') as f:
+            json.dump(genes_json(proms), f)
+    if proms_seq_path is not None:
+        names = proms['GeneID'] + '(' + proms['strand'] + ')'
+        write_fasta(names, extract_sequences(genome_path, proms), proms_seq_path)
+    return proms
@@ -0,0 +1,144 @@
+"""
+Persistent case/file index of TCGA projects.
+
+Constructing a Project scans both sample directories and parses the GDC
+metadata files. The index stores the resulting case -> file mapping of all
+projects in one SQLite database, so listing cases and resolving case files
+needs no directory scan. A project's entries are rebuilt when the mtime of
+its sample directories or metadata files changes.
+
+The database is kept on a local disk (dirs.index of basicConfig.json), one
+per projects directory: SQLite locking is unreliable on the NFS tree the
+projects live on.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+
+from m2e.project import Project, PROJECTS_DIR, data_paths, metadata_paths
+
+
+INDEX_NAME = "m2e_index_%s.sqlite"  # % digest of the projects directory
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "basicConfig.json")
+
+
+def default_index_path(projects_dir) -> str:
+    """Local index file of a projects directory, under dirs.index of basicConfig.json."""
+    with open(CONFIG_PATH, 'r') as f:
+        index_dir = os.path.expanduser(json.load(f)['dirs']['index'])
+    digest = hashlib.sha256(os.path.abspath(projects_dir).encode()).hexdigest()[:12]
+    return os.path.join(index_dir, INDEX_NAME % digest)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    project TEXT PRIMARY KEY,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cases (
+    project TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    case_id TEXT NOT NULL,
+    meth_file_id TEXT NOT NULL,
+    meth_file_name TEXT NOT NULL,
+    expr_file_id TEXT NOT NULL,
+    expr_file_name TEXT NOT NULL,
+    PRIMARY KEY (project, pos)
+);
+CREATE INDEX IF NOT EXISTS cases_case_id ON cases (case_id);
+"""
+
+
+class CaseIndex(object):
+    """
+    SQLite index of project cases and their methylation / expression files.
+
+    Connections are opened per call, so an index can be shared by threads
+    and pickled to worker processes.
+
+    :public:
+        cases()
+        case_projects()
+        is_valid()
+        refresh()
+    """
+
+    def __init__(self, path=None, projects_dir=PROJECTS_DIR):
+        '''
+        :params
+            path -- sqlite file, on a local disk. if None: default_index_path(projects_dir)
+            projects_dir -- dir of TCGA projects
+        '''
+        self.projects_dir = projects_dir
+        self.path = str(path) if path is not None else default_index_path(projects_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connect_() as con:
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def connect_(self):
+        """Connection committing on success and closed on exit."""
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def signature_(self, project: str) -> str:
+        """mtimes of the project's sample dirs and metadata files."""
+        project_dir = self.projects_dir + project
+        paths = (list(data_paths(project_dir, project).values())
+                 + list(metadata_paths(project_dir, project).values()))
+        return json.dumps([os.stat(path).st_mtime_ns for path in paths])
+
+    def is_valid(self, project: str) -> bool:
+        """Whether the project is indexed and unchanged on disk since."""
+        with self.connect_() as con:
+            row = con.execute("SELECT signature FROM projects WHERE project = ?", (project,)).fetchone()
+        return row is not None and row[0] == self.signature_(project)
+
+    def refresh(self, project: str, force: bool = False):
+        """(Re)indexes a project by a full Project scan, if stale or forced."""
+        if not force and self.is_valid(project):
+            return
+        signature = self.signature_(project)
+        p = Project(project, self.projects_dir)
+        rows = [(project, pos, case,
+                 d['methylation']['file_id'], d['methylation']['file_name'],
+                 d['expression']['file_id'], d['expression']['file_name'])
+                for pos, (case, d) in enumerate(p.cases.items())]
+        with self.connect_() as con:
+            con.execute("DELETE FROM cases WHERE project = ?", (project,))
+            con.executemany("INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            con.execute("INSERT OR REPLACE INTO projects VALUES (?, ?)", (project, signature))
+
+    def cases(self, project: str) -> dict:
+        """
+        Project cases in the form of Project.cases:
+            { case -> {methylation -> {file_id, file_name}; expression -> {file_id, file_name}} }
+        """
+        self.refresh(project)
+        with self.connect_() as con:
+            rows = con.execute("SELECT case_id, meth_file_id, meth_file_name, expr_file_id, expr_file_name "
+                               "FROM cases WHERE project = ? ORDER BY pos", (project,)).fetchall()
+        return {case: {'methylation': {'file_id': m_id, 'file_name': m_name},
+                       'expression': {'file_id': e_id, 'file_name': e_name}}
+                for case, m_id, m_name, e_id, e_name in rows}
+
+    def case_projects(self, projects: list) -> pd.DataFrame:
+        """
+        Returns: dataframe of cases (index) -> project (column 0) of the selected projects.
+        """
+        for project in projects:
+            self.refresh(project)
+        with self.connect_() as con:
+            rows = con.execute("SELECT case_id, project FROM cases WHERE project IN (%s) ORDER BY project, pos"
+                               % ",".join("?" * len(projects)), list(projects)).fetchall()
+        order = {p: i for i, p in enumerate(projects)}
+        rows.sort(key=lambda r: order[r[1]])  # stable: keeps case order within projects
+        return pd.DataFrame([r[1] for r in rows], index=[r[0] for r in rows])
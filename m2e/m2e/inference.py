@@ -0,0 +1,253 @@
+"""
+Persisted expression models and batch prediction over cohorts.
+
+A model artifact is a directory holding everything prediction needs:
+
+    <artifact_dir>/model.txt   LightGBM booster
+    <artifact_dir>/cpgs.txt    CpG ids, in feature order
+    <artifact_dir>/genes.txt   expression feature ids predicted
+    <artifact_dir>/meta.json   parameters, training cohort and preprocessing
+
+The experiment's features are the case's CpG betas broadcast over genes,
+so a model's prediction depends on the case only: predict_cases() runs the
+booster once per case on a (cases x CpGs) block and broadcasts the result
+over the artifact's genes, instead of scoring cases x genes identical rows.
+
+Predictions are written in the layout of the matrix store (m2e.store) as the
+'expression' modality of the output directory, so MatrixStore(out_dir)
+reads them back like measured expression. Methylation is read in chunks of
+cases, from the store or from GDC methylation files on a worker pool, while
+the booster scores the previous chunk on all cores.
+
+    artifact = ModelArtifact.load(artifact_dir)
+    predict_store(artifact, store_dir, projects, out_dir)
+"""
+
+import os
+import re
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from m2e.store import MatrixStore, read_case_file, _read_index, _write_index, DTYPE
+from m2e.parallel import ordered_map, prefetch, Progress
+
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 256  # cases per prediction chunk
+# name -> (forward, inverse) of expression transforms a model may be trained on
+EXPR_TRANSFORMS = {None: (None, None), 'log1p': (np.log1p, np.expm1)}
+# TCGA sample barcode (Project-TSS-Participant-SampleVial), as Project prunes case ids
+BARCODE = re.compile(r'TCGA-[A-Z0-9]{2}-[A-Z0-9]{4}-[0-9]{2}[A-Z]?')
+
+
+class ModelArtifact(object):
+    """
+    Booster with the CpG and gene lists and preprocessing it was trained with.
+
+    :public:
+        save()
+        load()
+        predict_cases()
+    """
+
+    def __init__(self, booster: lgb.Booster, cpgs, genes, meta: dict = None):
+        '''
+        :params
+            booster -- trained on rows of cpgs' betas (m2e.training.build_lgb_dataset)
+            cpgs -- CpG ids in the booster's feature order
+            genes -- expression feature ids predictions are made for
+            meta -- json-serializable training metadata, e.g. params and projects.
+                    'expr_transform' names the transform of the training labels
+                    (see EXPR_TRANSFORMS); predictions are mapped back through its inverse.
+        '''
+        self.booster = booster
+        self.cpgs = pd.Index(cpgs)
+        self.genes = pd.Index(genes)
+        self.meta = dict({'format': FORMAT_VERSION, 'expr_transform': None,
+                          'lightgbm': lgb.__version__}, **(meta or {}))
+        assert self.meta['expr_transform'] in EXPR_TRANSFORMS, self.meta['expr_transform']
+        assert booster.num_feature() == len(self.cpgs), "Booster features differ from the CpG list."
+
+    def save(self, artifact_dir) -> Path:
+        """Writes the artifact, replacing an existing one only once complete."""
+        artifact_dir = Path(artifact_dir)
+        tmp_dir = artifact_dir.with_name(artifact_dir.name + '.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        self.booster.save_model(str(tmp_dir / 'model.txt'))
+        _write_index(tmp_dir / 'cpgs.txt', self.cpgs)
+        _write_index(tmp_dir / 'genes.txt', self.genes)
+        with open(tmp_dir / 'meta.json', 'w') as f:
+            json.dump(self.meta, f, indent=2, sort_keys=True)
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+        os.replace(tmp_dir, artifact_dir)
+        return artifact_dir
+
+    @classmethod
+    def load(cls, artifact_dir):
+        artifact_dir = Path(artifact_dir)
+        with open(artifact_dir / 'meta.json', 'r') as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT_VERSION:
+            raise ValueError("Unsupported artifact format: " + str(meta.get('format')))
+        booster = lgb.Booster(model_file=str(artifact_dir / 'model.txt'))
+        return cls(booster, _read_index(artifact_dir / 'cpgs.txt'),
+                   _read_index(artifact_dir / 'genes.txt'), meta)
+
+    def predict_cases(self, meth: np.ndarray, num_threads: int = 0) -> np.ndarray:
+        """
+        Expression of the artifact's genes for cases.
+
+        Args:
+            meth: (cases x CpGs) betas in the order of cpgs; NaN for missing
+                  probes, which LightGBM treats as missing values.
+            num_threads: LightGBM threads, 0 for its default (all cores).
+
+        Returns:
+            float32 array (cases x genes).
+        """
+        pred = self.booster.predict(np.asarray(meth, dtype=np.float32), num_threads=num_threads)
+        inverse = EXPR_TRANSFORMS[self.meta['expr_transform']][1]
+        if inverse is not None:
+            pred = inverse(pred)
+        return np.broadcast_to(pred.astype(DTYPE)[:, None], (len(pred), len(self.genes)))
+
+
+def store_chunks(store_dir, project: str, cpgs, cases=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields (case ids, (cases x CpGs) float32 betas) chunks of a project in the
+    store, read in row order.
+    """
+    store = MatrixStore(store_dir)
+    m = store.matrix(project, 'methylation')
+    cols = store.feature_positions('methylation', cpgs)
+    all_cases = store.cases(project, 'methylation')
+    rows = np.arange(len(all_cases)) if cases is None else np.sort(
+        store.case_positions(project, 'methylation', cases))
+    for start in range(0, len(rows), chunk_size):
+        sel = rows[start:start + chunk_size]
+        yield all_cases[sel].to_list(), store.decode('methylation', m[np.ix_(sel, cols)])
+
+
+def read_file_betas_(path, cpgs: pd.Index) -> np.ndarray:
+    """Betas of cpgs in a GDC methylation file, NaN for probes it lacks."""
+    values = read_case_file(path, 'methylation')
+    if values.index.equals(cpgs):
+        return values.to_numpy(dtype=DTYPE)
+    positions = values.index.get_indexer(cpgs)
+    out = np.full(len(cpgs), np.nan, dtype=DTYPE)
+    found = positions >= 0
+    out[found] = values.to_numpy(dtype=DTYPE)[positions[found]]
+    return out
+
+
+class FileReader(object):
+    """Picklable reader of one file's betas for a process pool."""
+
+    def __init__(self, cpgs):
+        self.cpgs = pd.Index(cpgs)
+
+    def __call__(self, path) -> np.ndarray:
+        return read_file_betas_(path, self.cpgs)
+
+
+def file_chunks(files: dict, cpgs, chunk_size: int = CHUNK_SIZE, n_jobs: int = -1,
+                backend: str = 'process'):
+    """
+    Yields (case ids, (cases x CpGs) betas) chunks of GDC methylation files,
+    parsed on a pool of n_jobs workers.
+
+    Args:
+        files: case id -> methylation file path.
+    """
+    cases = list(files)
+    rows = ordered_map(FileReader(cpgs), [files[c] for c in cases], n_jobs=n_jobs,
+                       backend=backend, max_in_flight=2 * chunk_size)
+    for start in range(0, len(cases), chunk_size):
+        chunk = cases[start:start + chunk_size]
+        yield chunk, np.stack([next(rows) for _ in chunk])
+
+
+def write_predictions(artifact: ModelArtifact, chunks, n_cases: int, out_dir, project: str,
+                      num_threads: int = 0) -> Path:
+    """
+    Predicts chunks of (case ids, betas) into the 'expression' matrix of
+    project in the store at out_dir. The next chunk is read in the
+    background while the current one is scored.
+
+    Returns:
+        path of the written matrix.
+    """
+    out = MatrixStore(out_dir)
+    if out.features_path_('expression').is_file():
+        if not out.features('expression').equals(artifact.genes):
+            raise ValueError("Output store holds predictions of other genes.")
+    else:
+        out.dir.mkdir(parents=True, exist_ok=True)
+        _write_index(out.features_path_('expression'), artifact.genes)
+    out.project_dir_(project).mkdir(parents=True, exist_ok=True)
+    path = out.matrix_path_(project, 'expression')
+    tmp_path = path.with_suffix('.tmp.npy')
+
+    m = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=DTYPE, shape=(n_cases, len(artifact.genes)))
+    progress = Progress(project + " predictions", n_cases, every=CHUNK_SIZE * 8)
+    case_ids, row = [], 0
+    # the next chunk is read on a thread; the chunk source may itself use a pool
+    for cases, betas in prefetch(chunks):
+        m[row:row + len(cases)] = artifact.predict_cases(betas, num_threads=num_threads)
+        case_ids.extend(cases)
+        row += len(cases)
+        progress.update(len(cases))
+    assert row == n_cases, "Chunks held %d of %d cases." % (row, n_cases)
+    m.flush()
+    del m
+
+    os.replace(tmp_path, path)
+    _write_index(out.cases_path_(project, 'expression'), case_ids)
+    return path
+
+
+def predict_store(artifact: ModelArtifact, store_dir, projects, out_dir, chunk_size: int = CHUNK_SIZE,
+                  num_threads: int = 0) -> list:
+    """
+    Predicts expression of every case of store projects into out_dir.
+
+    Returns:
+        paths of the written matrices, one per project.
+    """
+    store = MatrixStore(store_dir)
+    return [write_predictions(artifact, store_chunks(store_dir, project, artifact.cpgs, chunk_size=chunk_size),
+                              len(store.cases(project, 'methylation')), out_dir, project, num_threads)
+            for project in projects]
+
+
+def file_case_ids(paths) -> dict:
+    """
+    Case id -> path of methylation files: the TCGA sample barcode in the file
+    name (e.g. jhu-usc.edu_BRCA.HumanMethylation450.4.lvl-3.TCGA-A1-A0SB-01A-11D-A141-05.txt),
+    or else the file name without its extension. Raises ValueError on duplicated ids.
+    """
+    files = {}
+    for path in paths:
+        name = Path(path).name
+        match = BARCODE.search(name)
+        case = match.group(0) if match is not None else Path(name).stem
+        if case in files:
+            raise ValueError("Case " + case + " of " + str(path) + " is also the case of " + str(files[case]))
+        files[case] = path
+    return files
+
+
+def predict_files(artifact: ModelArtifact, files: dict, out_dir, project: str, chunk_size: int = CHUNK_SIZE,
+                  n_jobs: int = -1, num_threads: int = 0) -> Path:
+    """
+    Predicts expression of cases' GDC methylation files (case id -> path)
+    into project of out_dir.
+    """
+    chunks = file_chunks(files, artifact.cpgs, chunk_size=chunk_size, n_jobs=n_jobs)
+    return write_predictions(artifact, chunks, len(files), out_dir, project, num_threads)
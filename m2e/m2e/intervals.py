@@ -0,0 +1,182 @@
+"""
+Interval index for assigning chip CpGs to promoters.
+
+CpG positions are sorted once by (chromosome, strand, position) into a
+single array of composite keys, so the CpGs of N promoters are found with
+two vectorized binary searches instead of a table scan per gene.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+
+CHIP_HEADER = 37  # commented preamble lines of GPL13534-11288.txt
+CHIP_COLS = ['ID', 'RANGE_GB', 'MAPINFO', 'Strand']  # essential info for finding location
+GENE_TO_CHIP_STRAND = {'+': 'F', '-': 'R'}
+
+# composite key = key code * POS_SPAN + position; chromosome positions are < 2^32
+POS_SPAN = np.int64(1) << 32
+
+
+def load_genes(path) -> pd.DataFrame:
+    """
+    Loads genes.json of scripts/01_collect_genomics.py once.
+
+    Returns:
+        DataFrame indexed by GeneID with columns chr, start, end (int), strand.
+    """
+    with open(path, 'r') as f:
+        genes = json.load(f)
+    df = pd.DataFrame.from_dict(genes, orient='index')
+    df = df.astype({'start': np.int64, 'end': np.int64})
+    df.index.name = 'GeneID'
+    return df[['chr', 'start', 'end', 'strand']]
+
+
+def load_chip(path) -> pd.DataFrame:
+    """
+    Loads location columns of the GPL13534 chip annotation, dropping unmapped probes.
+    """
+    df = pd.read_csv(path, sep='\t', header=CHIP_HEADER, usecols=CHIP_COLS,
+                     dtype={'ID': str, 'RANGE_GB': str, 'Strand': str})
+    df = df.dropna(subset=['RANGE_GB', 'MAPINFO'])
+    df['MAPINFO'] = df['MAPINFO'].astype(np.int64)
+    return df.reset_index(drop=True)
+
+
+class IntervalIndex(object):
+    """
+    Sorted point index over (chromosome[, strand], position) for batched range queries.
+    """
+
+    def __init__(self, chroms, positions, strands=None):
+        '''
+        :params
+            chroms -- chromosome of each point
+            positions -- integer position of each point
+            strands -- optional strand of each point; queries then match strand too
+        '''
+        self.stranded = strands is not None
+        keys = self.keys_(chroms, strands)
+        self.codes = {k: i for i, k in enumerate(pd.unique(keys))}
+        composite = self.composite_(keys, positions)
+        self.order = np.argsort(composite, kind='stable')
+        self.sorted = composite[self.order]
+
+    def keys_(self, chroms, strands=None) -> np.ndarray:
+        chroms = np.asarray(chroms, dtype=object)
+        if strands is None:
+            return chroms
+        return chroms + ':' + np.asarray(strands, dtype=object)
+
+    def composite_(self, keys, positions) -> np.ndarray:
+        # keys unknown to the index get code -1, which matches no point
+        codes = pd.Series(keys).map(self.codes).fillna(-1).to_numpy(dtype=np.int64)
+        return codes * POS_SPAN + np.asarray(positions, dtype=np.int64)
+
+    def query(self, chroms, starts, ends, strands=None):
+        """
+        Points within each closed interval [start, end].
+
+        Returns:
+            2-tuple (indptr, hits) in CSR form: the points of interval i are
+            hits[indptr[i]:indptr[i + 1]], as indices into the indexed arrays,
+            ordered by position.
+        """
+        assert (strands is not None) == self.stranded
+        keys = self.keys_(chroms, strands)
+        lo = np.searchsorted(self.sorted, self.composite_(keys, starts), side='left')
+        hi = np.searchsorted(self.sorted, self.composite_(keys, ends), side='right')
+        hi = np.maximum(hi, lo)  # empty for end < start and for unknown keys
+
+        counts = hi - lo
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # positions lo..hi-1 of every interval, concatenated
+        within = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - lo, counts)
+        return indptr, self.order[within]
+
+
+class PromoterCpgs(object):
+    """
+    CpGs of each promoter in CSR form, with strand-aware local offsets:
+    offset 0 is the first base of the promoter sequence as extracted with s=True,
+    i.e. start on '+' and end on '-' (reverse complemented) strands.
+    """
+
+    def __init__(self, gene_ids, indptr, cpg_ids, positions, offsets):
+        self.gene_ids = pd.Index(gene_ids)
+        self.indptr = indptr
+        self.cpg_ids = cpg_ids
+        self.positions = positions
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def counts(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def gene(self, gene_id: str) -> pd.DataFrame:
+        """CpGs of one promoter: ID, MAPINFO, offset."""
+        i = self.gene_ids.get_loc(gene_id)
+        rows = slice(self.indptr[i], self.indptr[i + 1])
+        return pd.DataFrame({'ID': self.cpg_ids[rows], 'MAPINFO': self.positions[rows],
+                             'offset': self.offsets[rows]})
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long table of GeneID, ID, MAPINFO, offset."""
+        return pd.DataFrame({'GeneID': np.repeat(self.gene_ids.to_numpy(), self.counts()),
+                             'ID': self.cpg_ids, 'MAPINFO': self.positions, 'offset': self.offsets})
+
+    def padded(self, genes=None, max_cpgs: int = None):
+        """
+        Dense (genes x max_cpgs) arrays of offsets and CpG ids, padded with -1 and ''.
+
+        Args:
+            genes: gene ids selecting and ordering rows. if None: all genes.
+            max_cpgs: width; CpGs beyond it are dropped. if None: the largest count.
+        """
+        rows = np.arange(len(self)) if genes is None else self.gene_ids.get_indexer(pd.Index(genes))
+        assert (rows >= 0).all(), "Genes without promoter in the map."
+        counts = self.counts()[rows]
+        width = int(counts.max()) if max_cpgs is None else max_cpgs
+        counts = np.minimum(counts, width)
+
+        offsets = np.full((len(rows), width), -1, dtype=np.int64)
+        ids = np.full((len(rows), width), '', dtype=object)
+        r = np.repeat(np.arange(len(rows)), counts)
+        c = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        src = np.repeat(self.indptr[rows], counts) + c
+        offsets[r, c] = self.offsets[src]
+        ids[r, c] = self.cpg_ids[src]
+        return offsets, ids
+
+
+def map_promoter_cpgs(genes: pd.DataFrame, chip: pd.DataFrame, match_strand: bool = True) -> PromoterCpgs:
+    """
+    Assigns chip CpGs to the promoters of genes in one batched query.
+
+    Args:
+        genes: promoters as returned by load_genes (chr, start, end, strand).
+        chip: chip table as returned by load_chip (ID, RANGE_GB, MAPINFO, Strand).
+        match_strand: only take CpGs whose chip strand (F/R) matches the gene
+                      strand (+/-), as Gene.get_cpgs of the DataLoaders notebook.
+    """
+    if match_strand:
+        index = IntervalIndex(chip['RANGE_GB'], chip['MAPINFO'], chip['Strand'])
+        gene_strands = genes['strand'].map(GENE_TO_CHIP_STRAND)
+        indptr, hits = index.query(genes['chr'], genes['start'], genes['end'], gene_strands)
+    else:
+        index = IntervalIndex(chip['RANGE_GB'], chip['MAPINFO'])
+        indptr, hits = index.query(genes['chr'], genes['start'], genes['end'])
+
+    positions = chip['MAPINFO'].to_numpy()[hits]
+    counts = np.diff(indptr)
+    minus = np.repeat(genes['strand'].to_numpy() == '-', counts)
+    offsets = np.where(minus,
+                       np.repeat(genes['end'].to_numpy(), counts) - positions,
+                       positions - np.repeat(genes['start'].to_numpy(), counts))
+    return PromoterCpgs(genes.index, indptr, chip['ID'].to_numpy()[hits], positions, offsets)
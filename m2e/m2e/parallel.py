@@ -0,0 +1,123 @@
+"""
+Order-preserving, bounded parallel map for I/O-bound loading.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+BACKENDS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+PUT_TIMEOUT = 0.1  # seconds between checks of a prefetch producer for a stopped consumer
+
+
+def ordered_map(func, items, n_jobs: int = 1, backend: str = 'thread', max_in_flight: int = None):
+    """
+    Maps func over items on a thread or process pool, yielding results in input order.
+
+    Args:
+        func: callable of one argument; must be picklable for the process backend.
+        items: iterable of arguments, consumed lazily.
+        n_jobs: pool size. n_jobs <= 1 runs inline; n_jobs < 0 uses all cores.
+        backend: 'thread' or 'process'.
+        max_in_flight: upper bound on submitted, not yet consumed calls. Bounds
+            memory held by finished results waiting on a slow predecessor.
+            Defaults to 2 * n_jobs.
+
+    Yields:
+        func(item) for each item, in the order of items.
+    """
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count()
+    if not n_jobs or n_jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend: " + str(backend))
+    max_in_flight = max_in_flight or 2 * n_jobs
+    assert max_in_flight >= 1
+
+    with BACKENDS[backend](max_workers=n_jobs) as pool:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(pool.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch(items, depth: int = 1):
+    """
+    Iterates items on a background thread, up to depth items ahead of the
+    consumer, so producing the next item (e.g. reading a chunk) overlaps
+    with processing the current one. Exceptions of the producer are raised
+    in the consumer. If the consumer stops early (break, exception, close),
+    the producer stops too and the buffered items are released.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        while True:
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                break
+
+
+class Progress(object):
+    """Logs progress and throughput of a counted task every `every` items."""
+
+    def __init__(self, name: str, total: int, every: int = 100, log=logging.info):
+        self.name = name
+        self.total = total
+        self.every = every
+        self.log = log
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else float('inf')
+
+    def update(self, n: int = 1):
+        self.done += n
+        if self.done == self.total or self.done % self.every == 0:
+            self.log("%s: %d/%d (%.1f/s)" % (self.name, self.done, self.total, self.rate()))
@@ -0,0 +1,177 @@
+"""
+Opt-in timing and counter instrumentation of the loading, dataset building
+and training stages.
+
+Stages are named context managers; each records its number of calls,
+seconds (total and slowest call), the peak RSS of the process when it last
+exited, and counters added to it, e.g. rows parsed or bytes of files read:
+
+    with profiling.stage('read.methylation') as s:
+        ...
+        s.add(rows=len(values), file_bytes=size)
+
+Disabled (the default), stage() returns a shared no-op NULL_STAGE, so the hooks
+stay in the hot paths at the cost of one function call. Profiling is enabled
+by enable() or by the environment variable M2E_PROFILE=<report.json>, in
+which case the report of the run is written to that path at exit:
+
+    M2E_PROFILE=run.json python expr_meth_pred.py
+
+Stages are aggregated across threads. Work done in process-pool workers is
+not recorded; it counts towards the stage of the parent waiting on it.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from functools import wraps
+
+
+ENV_VAR = "M2E_PROFILE"
+ENV_PID = "M2E_PROFILE_PID"  # process that owns the report; its workers stay silent
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class Stage(object):
+    """One timed call of a stage; add() accumulates counters of the call."""
+
+    def __init__(self, recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+        self.counters = {}
+
+    def add(self, **counters):
+        for name, n in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.name, time.perf_counter() - self.start, self.counters)
+        return False
+
+
+class NullStage(object):
+    """Stage of disabled profiling."""
+
+    def add(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Recorder(object):
+    """
+    Thread-safe aggregate of stage calls.
+
+    :public:
+        record()
+        report()
+        write()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = time.time()
+        self.start = time.perf_counter()
+
+    def record(self, name: str, seconds: float, counters: dict):
+        rss = peak_rss_mb()
+        with self.lock:
+            stats = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['peak_rss_mb'] = rss
+            for counter, n in counters.items():
+                stats[counter] = stats.get(counter, 0) + n
+
+    def report(self) -> dict:
+        """Run report: wall time, peak RSS and stages by decreasing total seconds."""
+        with self.lock:
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+        return {'command': ' '.join(sys.argv),
+                'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'wall_seconds': time.perf_counter() - self.start,
+                'peak_rss_mb': peak_rss_mb(),
+                'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+                'stages': dict(sorted(stages.items(), key=lambda kv: -kv[1]['seconds']))}
+
+    def write(self, path):
+        tmp_path = str(path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+NULL_STAGE = NullStage()
+_recorder = None
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def enable(report_path=None) -> Recorder:
+    """
+    Starts recording stages (anew).
+
+    Args:
+        report_path: if set, the report is written there at exit.
+    """
+    global _recorder
+    _recorder = Recorder()
+    if report_path is not None:
+        atexit.register(write_report, report_path)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def stage(name: str):
+    """Context manager timing a call of stage name; a no-op unless enabled."""
+    recorder = _recorder
+    return NULL_STAGE if recorder is None else Stage(recorder, name)
+
+
+def profiled(name: str):
+    """Decorator timing every call of a function as stage name."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def report() -> dict:
+    return _recorder.report() if _recorder is not None else None
+
+
+def write_report(path):
+    if _recorder is not None:
+        _recorder.write(path)
+
+
+if os.environ.get(ENV_VAR) and os.environ.setdefault(ENV_PID, str(os.getpid())) == str(os.getpid()):
+    enable(os.environ[ENV_VAR])
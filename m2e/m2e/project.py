@@ -8,18 +8,41 @@ import numpy as np
 from pathlib import Path
 import pandas as pd
 
+from m2e.store import MatrixStore, MODALITIES
+from m2e.readers import read_methylation, read_expression
+from m2e.profiling import stage
+
 
 PROJECTS_DIR = "/data/eugen/tcga/projects/"
 
 
+def data_paths(project_dir, name: str) -> dict:
+    """Directories of a project's methylation and expression samples."""
+    return {'methylation': Path(project_dir) / 'data/methylation' / name / 'harmonized/DNA_Methylation/Methylation_Beta_Value',
+            'expression': Path(project_dir) / 'data/expression' / name / 'harmonized/Transcriptome_Profiling/Gene_Expression_Quantification'}
+
+
+def metadata_paths(project_dir, name: str) -> dict:
+    """GDC metadata files of a project's methylation and expression samples."""
+    return {f: Path(project_dir) / (name + "_" + f + ".csv") for f in ['methylation', 'expression']}
+
+
 class Project(object):
     """
     Project data loader and descriptor.
     
+    With lazy=True nothing is read on construction: samples, metadata and cases are
+    computed on first access, per modality, and cached. Single-modality callers
+    (get_case_data with get_meth or get_expr off, modality_case_ids) then never touch
+    the other modality's files.
+    
     :attributes:
+        samples, sample_ids, sample_paths, meta, cases, case_ids -- computed on first access in lazy mode
     
     :public:
         get_case_data()
+        get_cases_data()
+        modality_case_ids()
     
     :private:
         _collect_samples()
@@ -27,128 +50,195 @@ class Project(object):
         _get_case_datapaths()
     """
     
-    def __init__(self, name, projects_dir=PROJECTS_DIR):
+    # lazily computed attributes -> method computing them
+    LAZY_ATTRS = {'samples': 'collect_samples_',
+                  'sample_ids': 'collect_samples_',
+                  'sample_paths': 'collect_samples_',
+                  'meta': 'collect_metadata_',
+                  'cases': 'collect_metadata_',
+                  'case_ids': 'collect_metadata_',
+                  'old_cases': 'collect_metadata_'}
+    
+    def __init__(self, name, projects_dir=PROJECTS_DIR, store_dir=None, index=None, lazy=False):
         '''
         :params
             name -- project name
             path -- project dir
+            store_dir -- columnar store dir (see m2e.store). if set, ingested modalities
+                         are served from the store instead of parsing per-case files.
+            index -- m2e.index.CaseIndex. if set, cases are read from the persisted index
+                     (refreshed when stale) instead of scanning the project directory;
+                     samples and meta are then computed lazily.
+            lazy -- defer loading of samples, metadata and cases to first access.
         '''
         self.name = name
         self.dir = projects_dir + name
+        self.store = MatrixStore(store_dir) if store_dir is not None else None
         
         self.meth_path = None
         self.meth_fpath = None
+        self.data_paths_()
         
-        self.samples = {}
-        self.sample_ids = []
-        self.sample_paths = {}
-        self.cases = {}
-        self.case_ids = []
-        self.meta = {}
+        # per-modality cache of samples, metadata and cases
+        self.modalities_ = {m: {} for m in MODALITIES}
         
         # Get samples ids and paths
-        self.collect_samples_()
-        self.collect_metadata_()
+        if index is not None:
+            self.cases = index.cases(self.name)
+            self.case_ids = list(self.cases.keys())
+        elif not lazy:
+            self.collect_samples_()
+            self.collect_metadata_()
         
         
-    def collect_samples_(self):
+    def __getattr__(self, attr):
+        # only called for missing attributes, i.e. not yet computed lazy ones
+        if attr in Project.LAZY_ATTRS and 'modalities_' in self.__dict__:
+            getattr(self, Project.LAZY_ATTRS[attr])()
+            return self.__dict__[attr]
+        raise AttributeError(attr)
+        
+        
+    def data_paths_(self) -> dict:
         """
-        Extracts samples' ids and paths from project directory.
+        Directories of methylation and expression samples.
         """
         
-        self.sample_paths = {"methylation": {},
-                              "expression": {}}
+        paths = data_paths(self.dir, self.name)
+        self.meth_path = paths['methylation']
+        self.expr_path = paths['expression']
+        return paths
+    
+    
+    def modality_sample_paths_(self, modality: str) -> dict:
+        """
+        Sample (file) ids -> paths of a modality, from its project directory.
+        """
         
-        # Extract methylation
-        self.meth_path = Path(self.dir) / 'data/methylation' / self.name / 'harmonized/DNA_Methylation/Methylation_Beta_Value'
-        self.expr_path = Path(self.dir) / 'data/expression' / self.name / 'harmonized/Transcriptome_Profiling/Gene_Expression_Quantification'
-        self.sample_paths = {datatype: {str(f).split("/")[-1]: str(f) 
-                                        for f in path.iterdir()}
-                             for datatype, path in [('methylation', self.meth_path), ('expression', self.expr_path)]}
+        cache = self.modalities_[modality]
+        if 'sample_paths' not in cache:
+            with stage('project.discover') as s:
+                path = data_paths(self.dir, self.name)[modality]
+                cache['sample_paths'] = {f.name: str(f) for f in path.iterdir()}
+                s.add(files=len(cache['sample_paths']))
+        return cache['sample_paths']
+    
+    
+    def modality_meta_(self, modality: str) -> pd.DataFrame:
+        """
+        Metadata of a modality's samples, indexed by file id.
+        """
         
-        # In path there is an experiment ID, not sample id
-        self.samples = {f: list(self.sample_paths[f].keys()) for f in ['methylation', 'expression']}
-        self.sample_ids = list(self.samples.keys())
+        cache = self.modalities_[modality]
+        if 'meta' not in cache:
+            with stage('project.metadata') as s:
+                ### Access metadata file
+                cols = ['file_id', 'file_name', 'cases']
+                meta = pd.read_csv(metadata_paths(self.dir, self.name)[modality], sep='\t', usecols=cols)
+                
+                ### Prune the TCGA barcode of case ids up to sample level, resulting in Project-TSS-ParticipantID-<SampleID><vial>
+                meta['cases'] = meta['cases'].str.split('-').str[:4].str.join('-')
+                meta = meta.set_index("file_id", drop=False)
+                s.add(rows=len(meta))
+            
+            # Assert equivalency of ids in metadata file and available files
+            assert set(meta.index) == set(self.modality_sample_paths_(modality))
+            cache['meta'] = meta
+        return cache['meta']
     
     
-    def collect_metadata_(self):
+    def modality_cases_(self, modality: str) -> dict:
         """
-        Gets all necessary metadata of project.
-        Includes ids and case ids: necessary to match expression and methylation measurements.
+        Cases of a modality: { case -> {file_id, file_name} }, without duplicated cases.
         """
         
-        metadata_paths = [(Path(self.dir) / (self.name + "_" + f + ".csv"))
-                              for f in ['methylation', 'expression'] ]
+        cache = self.modalities_[modality]
+        if 'cases' not in cache:
+            meta = self.modality_meta_(modality)
+            
+            # There may be case duplicates, will drop
+            dup = meta.duplicated(['cases'], keep=False)
+            if dup.any():
+                warnings.warn("Droping duplicated cases entries.", UserWarning)
+            cache['dup'] = set(meta['cases'][dup])
+            cache['cases'] = meta.loc[~dup].set_index("cases").to_dict(orient='index')
+        return cache['cases']
+    
+    
+    def modality_case_ids(self, modality: str) -> list:
+        """
+        Case ids with data of one modality, loading only that modality's metadata.
+        """
         
-        ### Access metadata files
-        cols = ['file_id', 'file_name', 'cases']
-        meth, expr = list(map(lambda p: pd.read_csv(p, sep='\t', usecols=cols), metadata_paths))
+        return list(self.modality_cases_(modality).keys())
         
         
-        ### Prune the TCGA barcode of case ids up to sample level, resulting in Project-TSS-ParticipantID-<SampleID><vial>
-        barcode_splitter = lambda x: "-".join(x.split('-')[:4])
-        meth['cases'] = meth['cases'].apply(barcode_splitter)
-        expr['cases'] = expr['cases'].apply(barcode_splitter)
-
-                          
-        meth = meth.set_index("file_id", drop=False)
-        expr = expr.set_index("file_id", drop=False)
+    def collect_samples_(self):
+        """
+        Extracts samples' ids and paths from project directory.
+        """
         
-        meta = {'methylation': meth.to_dict(orient='index'),
-                'expression': expr.to_dict(orient='index') }
+        self.sample_paths = {f: self.modality_sample_paths_(f) for f in MODALITIES}
         
-        # Assert equivalency of ids in metadata files and available files
-        assert set(meta['methylation'].keys()) == set(self.samples['methylation'])
-        assert set(meta['expression'].keys()) == set(self.samples['expression'])
+        # In path there is an experiment ID, not sample id
+        self.samples = {f: list(self.sample_paths[f].keys()) for f in MODALITIES}
+        self.sample_ids = list(self.samples.keys())
+    
+    
+    def collect_metadata_(self):
+        """
+        Gets all necessary metadata of project.
+        Includes ids and case ids: necessary to match expression and methylation measurements.
+        """
         
-        self.meta = meta
+        self.meta = {f: self.modality_meta_(f).to_dict(orient='index') for f in MODALITIES}
         
+        if 'cases' in self.__dict__:
+            # cases read from an index are kept: a rescan must not change them mid-run
+            self.old_cases = {f: {c: files[f] for c, files in self.cases.items()} for f in MODALITIES}
+            return
         
         ### Collect metadata for cases
+        cases = {f: self.modality_cases_(f) for f in MODALITIES}
         
-        # There may be case duplicates, will drop
-        meth_dup = meth['cases'][meth.duplicated(['cases'], keep=False)]
-        expr_dup = expr['cases'][expr.duplicated(['cases'], keep=False)]
-        dup = set(meth_dup).union(set(expr_dup))  # set of duplicated cases in meth or expr
-        if (len(dup) > 0):
-            warnings.warn("Droping duplicated cases entries.", UserWarning)
-        meth = meth.loc[~(meth['cases'].isin(dup))]
-        expr = expr.loc[~(expr['cases'].isin(dup))]
-        
-        meth = meth.set_index("cases")
-        expr = expr.set_index("cases")
+        # a case duplicated in one modality is dropped from both
+        dup = self.modalities_['methylation']['dup'].union(self.modalities_['expression']['dup'])
+        meth = [c for c in cases['methylation'] if c not in dup]
+        expr = set(c for c in cases['expression'] if c not in dup)
         
         # recheck equivalency of cases for methylation and expression (should be true by constraint of download script)
-        if (set(meth.index) != set(expr.index)):
+        if set(meth) != expr:
             warnings.warn("There is non-equivalence of cases in methylation and expression.")
-            common_cases = set(meth.index).intersection(set(expr.index))
-            meth = meth.loc[common_cases]
-            expr = expr.loc[common_cases]
-            
+        common_cases = [c for c in meth if c in expr]
         
-        cases = {'methylation': meth.to_dict(orient='index'),
-                 'expression': expr.to_dict(orient='index') }
-        self.old_cases = cases
-            
-            
-        # make cases as keys { case -> {methylation -> {}; expression  -> {}} }
-        new_dict = {case: {'methylation': cases['methylation'][case],
-                           'expression': cases['expression'][case]}
-                    for case in cases['methylation'].keys() }
+        self.old_cases = {f: {c: cases[f][c] for c in common_cases} for f in MODALITIES}
         
-        self.cases = new_dict
+        # make cases as keys { case -> {methylation -> {}; expression  -> {}} }
+        self.cases = {case: {'methylation': cases['methylation'][case],
+                             'expression': cases['expression'][case]}
+                      for case in common_cases}
         self.case_ids = list(self.cases.keys())
         
         
-    def get_case_datapaths_(self, case: str):
+    def get_case_datapaths_(self, case: str, modalities=MODALITIES):
         '''Getter method for meth, expr or both types data.'''
         
-        assert case in self.cases.keys()
-        
-        self.meth_fpath = Path(self.meth_path) / self.cases[case]['methylation']['file_id'] / self.cases[case]['methylation']['file_name']
-        self.expr_fpath = Path(self.expr_path) / self.cases[case]['expression']['file_id'] / self.cases[case]['expression']['file_name']
-        
-        return {'methylation': self.meth_fpath, 'expression': self.expr_fpath}
+        if 'cases' in self.__dict__ or set(modalities) == set(MODALITIES):
+            assert case in self.cases.keys()
+            files = self.cases[case]
+        else:
+            # single modality of a lazy project: avoid loading the other one
+            files = {}
+            for f in modalities:
+                assert case in self.modality_cases_(f).keys()
+                files[f] = self.modality_cases_(f)[case]
+        
+        paths = data_paths(self.dir, self.name)
+        paths = {f: paths[f] / files[f]['file_id'] / files[f]['file_name'] for f in modalities}
+        self.meth_fpath = paths.get('methylation')
+        self.expr_fpath = paths.get('expression')
+        
+        return paths
     
     
     def get_case_data(self, case: str, genes = None, cpgs = None, get_expr=True, get_meth=True) -> dict:
@@ -161,36 +251,54 @@ class Project(object):
             cpgs -- list of cpgs to get data for. if None: gets data for all cpgs;
         """
         
-#         get_expr, get_meth = True, True
-        paths = self.get_case_datapaths_(case)
+        if self.store is not None:
+            return self.get_case_data_from_store_(case, genes, cpgs, get_expr, get_meth)
         
-        # We ignore rest columns, since terribly redundant. They describe CpG features, which are assumed to be constant for every
-        # experiment (to be tested). That's the reason for the inefficient data storage. After testing invariance,
-        # methylation data files have to cleared (i.e. remove redundant columns).
-        meth_cols = ['Beta_value']  # 'Composite Element REF' becomes index
+        paths = self.get_case_datapaths_(case, [f for f, flag in [('methylation', get_meth), ('expression', get_expr)] if flag])
         
-        # load both meth and expr for now
-        # if dtype == 'methylation':
-        #     get_expr = False
-        # elif dtype == 'expression':
-        #     get_meth = False
+        # Only the id and value columns are parsed: the rest describe CpG features and are the same
+        # in every file of a platform (see m2e.readers).
+        expr = read_expression(paths['expression'], genes) if get_expr else None
+        meth = read_methylation(paths['methylation'], cpgs) if get_meth else None
         
-        if get_expr:
-            if genes is not None:
-                expr = pd.read_csv(paths['expression'], sep='\t', index_col=0, header=None)
-                expr.index = list(map(lambda x: x.split(".")[0], expr.index))  # cut off version of ids e.g. ENS0000.1 -> ENS0000
-                expr = expr.loc[genes]
-            else:
-                expr = pd.read_csv(paths['expression'], sep='\t', index_col=0, header=None)
-        else:
-            expr = None
+        return {'methylation': meth, 'expression': expr}
+    
+    
+    def get_case_data_from_store_(self, case: str, genes=None, cpgs=None, get_expr=True, get_meth=True) -> dict:
+        """
+        Same as get_case_data, served by column slicing of the columnar store.
+        Expression ids in the store are unversioned, and values are float32,
+        decoded from the store's encodings (up to their precision, see m2e.quantize).
+        """
         
-        if get_meth:
-            if cpgs is not None:
-                meth = pd.read_csv(paths['methylation'], sep='\t', index_col=0, header=0)[meth_cols].loc[cpgs]
-            else:
-                meth = pd.read_csv(paths['methylation'], sep='\t', index_col=0, header=0)[meth_cols]
-        else:
-            meth = None
+        data = {'methylation': None, 'expression': None}
+        for modality, features, col, flag in [('methylation', cpgs, 'Beta_value', get_meth),
+                                              ('expression', genes, 1, get_expr)]:
+            if not flag:
+                continue
+            if not self.store.has(self.name, modality):
+                raise FileNotFoundError("No " + modality + " matrix of " + self.name + " in store " + str(self.store.dir))
+            values = self.store.get(self.name, modality, cases=[case], features=features)[0]
+            index = self.store.features(modality) if features is None else list(features)
+            data[modality] = pd.DataFrame({col: values}, index=index)
+        
+        return data
+    
+    
+    def get_cases_data(self, cases: list, genes=None, cpgs=None, get_expr=True, get_meth=True, decode=True) -> dict:
+        """
+        Get methylation and expression matrices of many cases at once.
+        Requires the project to be ingested in the columnar store.
+        
+        :params
+            cases -- list of case ids (matrix rows);
+            genes -- list of genes (expression columns). if None: all genes;
+            cpgs -- list of cpgs (methylation columns). if None: all cpgs;
+            decode -- if False, matrices are the codes of the store's encodings (see m2e.quantize);
+        :returns
+            {'methylation': float32 array (cases x cpgs), 'expression': float32 array (cases x genes)}
+        """
         
-        return {'methylation': meth, 'expression': expr}
\ No newline at end of file
+        assert self.store is not None, "Batched case loading requires a store_dir."
+        return {'methylation': self.store.get(self.name, 'methylation', cases, cpgs, decode) if get_meth else None,
+                'expression': self.store.get(self.name, 'expression', cases, genes, decode) if get_expr else None}
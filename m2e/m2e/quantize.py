@@ -0,0 +1,108 @@
+"""
+Compact encodings of store matrices.
+
+Beta values are bounded in [0, 1] and need far less than float32 precision,
+and expression values span orders of magnitude that a logarithm compresses.
+A store modality is ingested with one of the codecs below, and its matrices
+then hold codes instead of float32 values:
+
+    codec    dtype    values            precision
+    float32  float32  any               exact (the default)
+    beta8    uint8    betas in [0, 1]   absolute error <= 1/508 (~2.0e-3)
+    beta16   uint16   betas in [0, 1]   absolute error < 7.7e-6 (1/131068 plus
+                                        float32 rounding of the decoded value)
+    log16    float16  values > -1       log1p(x) rounded to float16: relative
+                                        error of 1 + x <= 4.9e-4 * log1p(x),
+                                        e.g. <= 0.5% for x up to 2.7e4
+
+The beta codecs store round(beta * (2^bits - 2)), clip betas outside [0, 1]
+and reserve the largest code for NaN; log16 keeps NaN as float16 NaN.
+beta8 matrices take a quarter of the memory of float32 ones and an eighth
+of float64 frames, and scans over them read as many fewer bytes.
+
+Decoding is a table lookup of the code (or of the float16 bit pattern) into
+float32, so decoded values are bit-identical across calls and processes.
+"""
+
+import numpy as np
+
+
+class Codec(object):
+    """
+    Encoding of float values as codes of a compact dtype.
+
+    :public:
+        encode()
+        decode()
+    """
+
+    def __init__(self, name: str, dtype, table: np.ndarray = None, bits: int = None, log: bool = False):
+        '''
+        :params
+            name -- codec name stored with the matrices
+            dtype -- dtype of the codes
+            table -- float32 value of every code (bit pattern for float16). if None: codes are values.
+            bits -- bits of a fixed-point beta code, the largest code being NaN
+            log -- codes are log1p of the values
+        '''
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.table = table
+        self.bits = bits
+        self.log = log
+
+    @property
+    def itemsize(self) -> int:
+        return self.dtype.itemsize
+
+    def encode(self, values) -> np.ndarray:
+        """Codes of float values (NaN for missing)."""
+        values = np.asarray(values, dtype=np.float64)
+        if self.bits is not None:
+            nan_code = (1 << self.bits) - 1
+            codes = np.rint(np.clip(values, 0.0, 1.0) * (nan_code - 1))
+            codes[np.isnan(values)] = nan_code
+            return codes.astype(self.dtype)
+        if self.log:
+            with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                return np.log1p(values).astype(self.dtype)
+        return values.astype(self.dtype)
+
+    def decode(self, codes, out: np.ndarray = None) -> np.ndarray:
+        """float32 values of codes, into out if given."""
+        codes = np.asarray(codes)
+        if self.table is None:
+            if out is None:
+                return codes.astype(np.float32, copy=False)
+            out[...] = codes
+            return out
+        if self.log:
+            codes = codes.view(np.uint16)
+        return np.take(self.table, codes, out=out)
+
+
+def beta_table(bits: int) -> np.ndarray:
+    nan_code = (1 << bits) - 1
+    table = np.arange(nan_code + 1, dtype=np.float64) / (nan_code - 1)
+    table[nan_code] = np.nan
+    return table.astype(np.float32)
+
+
+def log16_table() -> np.ndarray:
+    half = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16).view(np.float16)
+    with np.errstate(invalid='ignore', over='ignore'):
+        return np.expm1(half.astype(np.float64)).astype(np.float32)
+
+
+FLOAT32 = Codec('float32', np.float32)
+CODECS = {c.name: c for c in [FLOAT32,
+                              Codec('beta8', np.uint8, beta_table(8), bits=8),
+                              Codec('beta16', np.uint16, beta_table(16), bits=16),
+                              Codec('log16', np.float16, log16_table(), log=True)]}
+BETA_CODECS = ('beta8', 'beta16')  # for methylation only
+
+
+def get_codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError("Unknown encoding: " + str(name) + ". Encodings: " + ", ".join(CODECS))
+    return CODECS[name]
@@ -0,0 +1,243 @@
+"""
+Fast readers of GDC methylation beta value and expression files.
+
+A 450k methylation file repeats the probe annotation (chromosome, position,
+gene symbols, ...) on each of its ~485k lines, and both file types list the
+same feature ids in the same order in every file of a platform or release.
+So the feature ids of a file layout are parsed once per process, and every
+file with that layout is read as its value column alone (fixed dtype), cut
+to the requested features by precomputed row positions and read no further
+than the last requested row.
+
+Files are matched to a known layout by their first and last feature id,
+and every read checks the ids of the rows it returns: full reads parse the
+id column, partial reads compare the raw id bytes of the selected lines. A
+file ordered differently (or shorter) than its layout has its layout
+replaced instead of returning the values of other features.
+
+A methylation file compacted by m2e.compaction is replaced by <path>.betas.npz
+holding only its betas; its ids come from the shared probe annotation table
+the npz refers to, and it is read at the original path transparently.
+
+read_methylation and read_expression return the same frames as parsing the
+whole file with pandas and selecting rows with .loc.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from m2e.gene_ids import unversioned
+from m2e.profiling import stage, NULL_STAGE
+
+
+METH_INDEX = 'Composite Element REF'
+METH_COL = 'Beta_value'
+TAIL_BYTES = 4096  # read from the end of a file to find its last line
+HEAD_BYTES = 1 << 20  # read at once when checking the ids of the first lines
+COMPACT_SUFFIX = '.betas.npz'
+
+
+def edge_ids(path, header: bool) -> tuple:
+    """First and last feature id of a tab-separated file, read without parsing it."""
+    with open(path, 'rb') as f:
+        if header:
+            f.readline()
+        first = f.readline().split(b'\t', 1)[0]
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - TAIL_BYTES))
+        last = f.read().rstrip(b'\r\n').rsplit(b'\n', 1)[-1].split(b'\t', 1)[0]
+    return first.decode(), last.decode()
+
+
+class FileLayout(object):
+    """
+    Feature ids of the rows of files sharing one layout, with the row
+    positions of the last requested feature list cached.
+
+    :public:
+        positions()
+    """
+
+    def __init__(self, ids: pd.Index, keys: pd.Index = None):
+        '''
+        :params
+            ids -- feature ids in row order, as in the files
+            keys -- ids features are requested by (e.g. unversioned ids). if None: ids.
+        '''
+        self.ids = ids
+        self.keys = ids if keys is None else keys
+        self.last_ = (None, None)
+
+    def positions(self, features) -> np.ndarray:
+        """
+        Row positions of features, all rows of a duplicated key in row order
+        as .loc gives them; raises KeyError on unknown features.
+        """
+        features = pd.Index(features)
+        cached, positions = self.last_
+        if cached is None or not features.equals(cached):
+            positions = self.keys.get_indexer_for(features)
+            if (positions < 0).any():
+                missing = [f for f in features if f not in self.keys]
+                raise KeyError("Features not in file: " + str(missing[:10]))
+            self.last_ = (features, positions)  # one assignment: safe across threads
+        return positions
+
+
+# (modality, first id, last id) or ('compact', annotation digest) -> FileLayout of files read in this process
+_LAYOUTS = {}
+
+
+def read_column_(path, modality: str, column: int, nrows: int = None, dtype=None) -> np.ndarray:
+    """One column of a file; methylation files have a header line."""
+    header = 0 if modality == 'methylation' else None
+    df = pd.read_csv(path, sep='\t', header=header, usecols=[column], nrows=nrows, dtype=dtype)
+    return df.iloc[:, 0].to_numpy()
+
+
+def read_pairs_(path, modality: str):
+    """Id and value columns of a file, as str and value arrays."""
+    header = 0 if modality == 'methylation' else None
+    df = pd.read_csv(path, sep='\t', header=header, usecols=[0, 1])
+    values = df.iloc[:, 1].to_numpy()
+    if modality == 'methylation':
+        values = values.astype(np.float64)
+    return df.iloc[:, 0].to_numpy(dtype=str), values
+
+
+def ids_match_(path, positions: np.ndarray, expected, header: bool) -> bool:
+    """Whether the rows at positions of a file have the expected ids, read as raw bytes."""
+    n_lines = int(header) + (int(positions.max()) + 1 if len(positions) else 0)
+    chunks, n = [], 0
+    with open(path, 'rb') as f:
+        while n < n_lines:
+            chunk = f.read(HEAD_BYTES)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            n += chunk.count(b'\n')
+    data = b''.join(chunks)
+    starts = np.r_[0, np.flatnonzero(np.frombuffer(data, np.uint8) == ord('\n')) + 1]
+    if len(starts) < n_lines:
+        return False
+    for start, feature in zip(starts[positions + int(header)], expected):
+        if data[start:data.find(b'\t', start)].decode() != feature:
+            return False
+    return True
+
+
+def file_layout(path, modality: str, refresh: bool = False, ids=None) -> FileLayout:
+    """
+    Layout of a methylation or expression file, parsed once per layout.
+    With refresh, it is replaced by the ids given or else parsed again.
+    """
+    key = (modality,) + edge_ids(path, modality == 'methylation')
+    if refresh or key not in _LAYOUTS:
+        with stage('read.layout') as s:
+            if ids is None:
+                ids = read_column_(path, modality, 0, dtype=str)
+                s.add(rows=len(ids), file_bytes=os.path.getsize(path))
+            ids = pd.Index(ids)
+            if modality == 'methylation':
+                _LAYOUTS[key] = FileLayout(ids.rename(METH_INDEX))
+            else:
+                # as index_col=0 of a header-less file names it
+                _LAYOUTS[key] = FileLayout(ids.rename(0), unversioned(ids))
+    return _LAYOUTS[key]
+
+
+def compact_path(path) -> Path:
+    """Path of the compacted (beta-only) form of a methylation file."""
+    return Path(str(path) + COMPACT_SUFFIX)
+
+
+def read_compact_(path):
+    """Layout (of its annotation table) and betas of a compacted methylation file."""
+    with np.load(compact_path(path)) as z:
+        betas, digest, table = z['betas'], str(z['digest']), str(z['table'])
+    key = ('compact', digest)
+    if key not in _LAYOUTS:
+        table_path = compact_path(path).parent / table
+        ids = pd.read_csv(table_path, sep='\t', header=0, usecols=[0], dtype=str).iloc[:, 0]
+        _LAYOUTS[key] = FileLayout(pd.Index(ids.to_numpy(), name=METH_INDEX))
+    assert len(betas) == len(_LAYOUTS[key].ids), "Betas of " + str(path) + " do not match their annotation."
+    return _LAYOUTS[key], betas
+
+
+def read_rows_(path, modality: str, features=None, refresh: bool = False, s=NULL_STAGE):
+    """
+    Feature index and values of a file's rows, of features if given.
+    Expression features are unversioned gene ids. Rows parsed are added to stage s.
+    """
+    if modality == 'methylation' and not os.path.isfile(path) and compact_path(path).is_file():
+        layout, values = read_compact_(path)
+        s.add(rows=len(values), file_bytes=compact_path(path).stat().st_size)
+        if features is None:
+            return layout.ids, values
+        positions = layout.positions(features)
+        return layout.keys[positions], values[positions]
+
+    layout = file_layout(path, modality, refresh)
+    s.add(file_bytes=os.path.getsize(path))
+    if features is None:
+        ids, values = read_pairs_(path, modality)
+        s.add(rows=len(values))
+        if not np.array_equal(ids, layout.ids.to_numpy()):
+            layout = file_layout(path, modality, refresh=True, ids=ids)
+        return layout.ids, values
+
+    try:
+        positions = layout.positions(features)
+    except KeyError:
+        if refresh:
+            raise
+        return read_rows_(path, modality, features, refresh=True, s=s)
+    nrows = int(positions.max()) + 1 if len(positions) else 0
+    dtype = np.float64 if modality == 'methylation' else None
+    values = read_column_(path, modality, 1, nrows=nrows, dtype=dtype)
+    s.add(rows=len(values))
+    if (len(values) < nrows
+            or not ids_match_(path, positions, layout.ids[positions], modality == 'methylation')):
+        if refresh:
+            raise ValueError(str(path) + " changed while being read.")
+        return read_rows_(path, modality, features, refresh=True, s=s)
+    return layout.keys[positions], values[positions]
+
+
+def read_profiled_(path, modality: str, features=None):
+    """read_rows_ recorded as stage read.<modality>."""
+    with stage('read.' + modality) as s:
+        index, values = read_rows_(path, modality, features, s=s)
+        s.add(files=1, selected=len(index))
+    return index, values
+
+
+def read_methylation(path, cpgs=None) -> pd.DataFrame:
+    """
+    Beta values of a GDC methylation file.
+
+    Args:
+        cpgs: probe ids to read. if None: all probes.
+
+    Returns:
+        float64 DataFrame with column Beta_value, indexed by probe id.
+    """
+    index, values = read_profiled_(path, 'methylation', cpgs)
+    return pd.DataFrame({METH_COL: values}, index=index)
+
+
+def read_expression(path, genes=None) -> pd.DataFrame:
+    """
+    Values of a GDC (HTSeq counts / FPKM) expression file.
+
+    Args:
+        genes: unversioned Ensembl ids to read. if None: all rows, with versioned ids.
+
+    Returns:
+        DataFrame with column 1, indexed by gene id.
+    """
+    index, values = read_profiled_(path, 'expression', genes)
+    return pd.DataFrame({1: values}, index=index)
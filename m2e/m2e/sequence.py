@@ -0,0 +1,314 @@
+"""
+Packed promoter sequence store and vectorized sequence encoding.
+
+All promoter sequences of proms.fna are packed into one contiguous uint8
+array of base codes with an offset index, memory-mapped on load. Batches
+of promoters are one-hot encoded by lookup-table indexing instead of a
+Python loop per base. Encodings are numpy arrays; torch.from_numpy wraps
+them without copying.
+
+Store layout:
+
+    <store_dir>/codes.npy    uint8 base codes of all sequences, concatenated
+    <store_dir>/offsets.npy  int64 (n + 1) start of each sequence in codes
+    <store_dir>/names.txt    FASTA header of each sequence, e.g. 7133(+)
+    <store_dir>/windows/<upstream>_<downstream>.npy
+                             optional int64 (n x 2) start and length of a narrower
+                             promoter window within each sequence (see write_windows)
+
+Sequences packed from the widest of several promoter windows serve every
+narrower window as a view: PromoterStore(store_dir, window=(500, 0)) reads
+the same codes with shifted starts and lengths, without a copy.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+VOCAB = ['A', 'C', 'T', 'G', 'N']
+BASE2IDX = {"A": 0, "C": 1, "T": 2, "G": 3, "N": 4}
+PAD = len(VOCAB)  # code of positions past the end of a sequence; encodes to all zeros
+
+# byte -> base code; lowercase (soft-masked) bases as uppercase, anything else as N
+CODES = np.full(256, BASE2IDX['N'], dtype=np.uint8)
+for base, idx in BASE2IDX.items():
+    CODES[ord(base)] = idx
+    CODES[ord(base.lower())] = idx
+
+# base code -> one-hot row; the PAD row is zeros
+ONE_HOT = np.vstack([np.eye(len(VOCAB), dtype=np.float32),
+                     np.zeros((1, len(VOCAB)), dtype=np.float32)])
+
+
+def header_gene_id(name: str) -> str:
+    """Gene id of a bedtools FASTA header: 7133(+) or 7133::NC_000001.10:10-20(+) -> 7133"""
+    return name.split('::')[0].split('(')[0]
+
+
+def read_fasta(path):
+    """Yields (header, sequence bytes) of a FASTA file, line by line."""
+    name, chunks = None, []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(chunks)
+                name, chunks = line[1:].split()[0].decode(), []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        yield name, b''.join(chunks)
+
+
+def encode_bases(seq) -> np.ndarray:
+    """Base codes of a sequence (str or bytes)."""
+    if isinstance(seq, str):
+        seq = seq.encode()
+    return CODES[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def pack_fasta(fasta_path, store_dir) -> Path:
+    """
+    Packs the sequences of a FASTA file into a promoter store.
+    Duplicated headers keep their first sequence.
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    names, seen, seqs = [], set(), []
+    for name, seq in read_fasta(fasta_path):
+        if name in seen:
+            continue
+        seen.add(name)
+        names.append(name)
+        seqs.append(encode_bases(seq))
+
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum([len(seq) for seq in seqs], out=offsets[1:])
+    codes = np.concatenate(seqs) if seqs else np.zeros(0, dtype=np.uint8)
+    np.save(store_dir / 'codes.tmp.npy', codes)
+    np.save(store_dir / 'offsets.tmp.npy', offsets)
+    with open(store_dir / 'names.txt.tmp', 'w') as f:
+        f.writelines(n + '\n' for n in names)
+
+    os.replace(store_dir / 'codes.tmp.npy', store_dir / 'codes.npy')
+    os.replace(store_dir / 'offsets.tmp.npy', store_dir / 'offsets.npy')
+    os.replace(store_dir / 'names.txt.tmp', store_dir / 'names.txt')
+    return store_dir
+
+
+def write_windows(store_dir, views: dict):
+    """
+    Adds promoter window views to a store packed from the widest window.
+
+    Args:
+        views: {(upstream, downstream) -> (starts, lengths)} within the packed
+               sequences, in store row order (see m2e.gff.window_views).
+    """
+    window_dir = Path(store_dir) / 'windows'
+    window_dir.mkdir(parents=True, exist_ok=True)
+    for (u, d), (starts, lengths) in views.items():
+        tmp_path = window_dir / ('%d_%d.tmp.npy' % (u, d))
+        np.save(tmp_path, np.stack([starts, lengths], axis=1).astype(np.int64))
+        os.replace(tmp_path, window_dir / ('%d_%d.npy' % (u, d)))
+    return window_dir
+
+
+def store_windows(store_dir) -> list:
+    """(upstream, downstream) windows available in a store."""
+    window_dir = Path(store_dir) / 'windows'
+    if not window_dir.is_dir():
+        return []
+    return sorted(tuple(int(x) for x in p.name[:-len('.npy')].split('_'))
+                  for p in window_dir.glob('*.npy') if not p.name.endswith('.tmp.npy'))
+
+
+class PromoterStore(object):
+    """
+    Memory-mapped packed promoter sequences.
+
+    :public:
+        codes()
+        seq()
+        window_starts()
+        batch_codes()
+        encode()
+    """
+
+    def __init__(self, store_dir, window=None):
+        '''
+        :params
+            store_dir -- store written by pack_fasta
+            window -- (upstream, downstream) view written by write_windows.
+                      if None: the packed sequences.
+        '''
+        self.dir = Path(store_dir)
+        self.window = window
+        self.codes_ = np.load(self.dir / 'codes.npy', mmap_mode='r')
+        self.offsets = np.load(self.dir / 'offsets.npy')
+        with open(self.dir / 'names.txt', 'r') as f:
+            self.names = pd.Index([line.rstrip('\n') for line in f])
+        self.gene_ids = pd.Index([header_gene_id(n) for n in self.names])
+        # start of each sequence in codes_ and its length
+        self.starts, self.lengths = self.offsets[:-1], np.diff(self.offsets)
+        if window is not None:
+            view = np.load(self.dir / 'windows' / ('%d_%d.npy' % tuple(window)))
+            assert len(view) == len(self.names), "Window view does not match the store."
+            self.window_starts_ = view[:, 0]
+            self.starts, self.lengths = self.starts + view[:, 0], view[:, 1]
+        # gene id -> first row with that id
+        self.gene_rows = pd.Series(np.arange(len(self.names)), index=self.gene_ids)
+        self.gene_rows = self.gene_rows[~self.gene_rows.index.duplicated()]
+
+    def __len__(self):
+        return len(self.names)
+
+    def rows(self, genes) -> np.ndarray:
+        """Rows of gene ids (or full headers); raises KeyError on unknown genes."""
+        genes = pd.Index(genes).astype(str)
+        pos = self.gene_rows.index.get_indexer(genes)
+        rows = np.where(pos >= 0, self.gene_rows.to_numpy()[pos], -1)
+        missing = rows < 0
+        if missing.any():
+            rows[missing] = self.names.get_indexer(genes[missing])
+        if (rows < 0).any():
+            raise KeyError("Genes not in promoter store: " + str(list(genes[rows < 0][:10])))
+        return rows
+
+    def codes(self, gene: str) -> np.ndarray:
+        """Base codes of one promoter."""
+        row = self.rows([gene])[0]
+        return np.asarray(self.codes_[self.starts[row]:self.starts[row] + self.lengths[row]])
+
+    def window_starts(self, genes) -> np.ndarray:
+        """
+        Start of the window within the packed (widest) sequences of genes;
+        subtract from CpG offsets computed on the widest window's genes.json.
+        """
+        rows = self.rows(genes)
+        return np.zeros(len(rows), dtype=np.int64) if self.window is None else self.window_starts_[rows]
+
+    def seq(self, gene: str) -> str:
+        """Promoter sequence as an uppercase string."""
+        return ''.join(np.array(VOCAB)[self.codes(gene)])
+
+    def batch_codes(self, genes, length: int = None) -> np.ndarray:
+        """
+        (genes x length) base codes of a batch of promoters, gathered in one
+        indexing operation; shorter promoters are right-padded with PAD.
+
+        Args:
+            length: width of the batch. if None: the longest promoter of the batch.
+        """
+        rows = self.rows(genes)
+        lengths = self.lengths[rows]
+        length = int(lengths.max()) if length is None else length
+        pos = np.arange(length)
+        idx = self.starts[rows][:, None] + pos
+        valid = pos < lengths[:, None]
+        batch = np.full(idx.shape, PAD, dtype=np.uint8)
+        batch[valid] = self.codes_[idx[valid]]
+        return batch
+
+    def encode(self, genes, length: int = None) -> np.ndarray:
+        """
+        One-hot encoding of a batch of promoters.
+
+        Returns:
+            float32 array (genes x length x len(VOCAB)); padding positions are all zero.
+        """
+        return ONE_HOT[self.batch_codes(genes, length)]
+
+
+def methylation_channel(offsets: np.ndarray, betas: np.ndarray, length: int) -> np.ndarray:
+    """
+    Scatters CpG beta values of many cases into per-position methylation tracks.
+
+    Args:
+        offsets: (genes x K) CpG offsets within promoters, padded with -1
+                 (see m2e.intervals.PromoterCpgs.padded).
+        betas: (cases x genes x K) beta values at those offsets; NaN betas are skipped.
+        length: promoter length of the tracks.
+
+    Returns:
+        float32 array (cases x genes x length), NaN where there is no measured CpG.
+    """
+    n_cases, n_genes, _ = betas.shape
+    assert offsets.shape == betas.shape[1:]
+    track = np.full((n_cases, n_genes, length), np.nan, dtype=np.float32)
+    c, g, k = np.nonzero((offsets >= 0) & (offsets < length) & ~np.isnan(betas))
+    track[c, g, offsets[g, k]] = betas[c, g, k]
+    return track
+
+
+class MethylatedBatch(object):
+    """
+    Promoter encodings of a batch of genes overlaid with methylation of many cases.
+
+    The one-hot encoding (genes x length x vocab) is stored once and shared by all
+    cases, and per case only the (genes x K) CpG betas are kept, so memory grows
+    with cases x CpGs rather than cases x length. Beta values are scattered into
+    the cytosine channel at CpG positions (as methylate_seq of the DataLoaders
+    notebook) or into a methylation track only when a batch is consumed.
+    """
+
+    def __init__(self, onehot: np.ndarray, offsets: np.ndarray, betas: np.ndarray,
+                 meth_idx: int = BASE2IDX['C'], mask_idx: int = BASE2IDX['N'], check: bool = True):
+        '''
+        :params
+            onehot -- (genes x length x vocab) encoding, e.g. PromoterStore.encode()
+            offsets -- (genes x K) CpG offsets, padded with -1
+            betas -- (cases x genes x K) beta values; NaN betas are skipped
+            meth_idx -- channel receiving beta values
+            mask_idx -- channel of unknown bases, which may carry a CpG as well
+            check -- assert that every CpG offset is at a C or N base
+        '''
+        assert offsets.shape == betas.shape[1:]
+        self.onehot = onehot
+        self.offsets = offsets
+        self.betas = np.asarray(betas, dtype=np.float32)
+        self.meth_idx = meth_idx
+        self.valid = (offsets >= 0) & (offsets < onehot.shape[1])
+
+        if check:
+            g, k = np.nonzero(self.valid & ~np.isnan(self.betas).all(axis=0))
+            pos = offsets[g, k]
+            methylable = (onehot[g, pos, meth_idx] > 0) | (onehot[g, pos, mask_idx] > 0)
+            if not methylable.all():
+                raise ValueError("CpG offsets not at C/N bases of genes at batch rows "
+                                 + str(sorted(set(g[~methylable]))[:10]))
+
+    def __len__(self):
+        return self.betas.shape[0]
+
+    def scatter_(self, out: np.ndarray, cases: np.ndarray) -> np.ndarray:
+        """Writes betas of cases into the meth channel of out (cases x genes x length x vocab)."""
+        betas = self.betas[cases]
+        c, g, k = np.nonzero(self.valid & ~np.isnan(betas))
+        out[c, g, self.offsets[g, k], self.meth_idx] = betas[c, g, k]
+        return out
+
+    def channels(self, cases=None):
+        """
+        Returns: 2-tuple of a zero-copy (cases x genes x length x vocab) broadcast
+                 view of the shared encoding and the (cases x genes x length)
+                 methylation track of the selected cases (default: all), for
+                 models taking sequence and methylation as separate inputs.
+        """
+        cases = np.arange(len(self)) if cases is None else np.asarray(cases)
+        shape = (len(cases),) + self.onehot.shape
+        return (np.broadcast_to(self.onehot, shape),
+                methylation_channel(self.offsets, self.betas[cases], self.onehot.shape[1]))
+
+    def case(self, i: int) -> np.ndarray:
+        """(genes x length x vocab) encoding of case i with beta values in the meth channel."""
+        return self.scatter_(self.onehot.copy()[None], np.array([i]))[0]
+
+    def compose(self, cases=None) -> np.ndarray:
+        """(cases x genes x length x vocab) encodings of the selected cases (default: all)."""
+        cases = np.arange(len(self)) if cases is None else np.asarray(cases)
+        return self.scatter_(np.repeat(self.onehot[None], len(cases), axis=0), cases)
@@ -0,0 +1,77 @@
+"""
+Case-level train / test splits computed from the case index.
+
+Splits are lists of case ids, decided from the case -> project table of
+m2e.index.CaseIndex.case_projects alone, and passed to the dataset builders
+(cases=...) so that only the rows of a split are ever loaded. Samples of the
+same participant (e.g. tumor and normal of one patient) always fall on the
+same side.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def participants(cases) -> pd.Index:
+    """Participant of TCGA sample barcodes: TCGA-XX-0001-01A -> TCGA-XX-0001"""
+    return pd.Index(pd.Index(cases).astype(str).str.split('-').str[:3].str.join('-'))
+
+
+def smallest_projects_split(case_projects: pd.DataFrame, n_test_projects: int = 17):
+    """
+    Holds out the n_test_projects projects with the fewest cases.
+
+    Args:
+        case_projects: cases (index) -> project (column 0).
+
+    Returns: 2-tuple of train and test case lists.
+    """
+    counts = case_projects[0].value_counts()
+    test = case_projects[0].isin(counts.index[-n_test_projects:]).to_numpy()
+    return case_projects.index[~test].to_list(), case_projects.index[test].to_list()
+
+
+def leave_project_out(case_projects: pd.DataFrame) -> list:
+    """
+    Returns: (project, train cases, test cases) for every project held out.
+    """
+    projects = case_projects[0].to_numpy()
+    return [(p, case_projects.index[projects != p].to_list(), case_projects.index[projects == p].to_list())
+            for p in pd.unique(projects)]
+
+
+def grouped_kfold(case_projects: pd.DataFrame, k: int = 5, seed: int = 0) -> list:
+    """
+    k folds of cases with every participant in exactly one test fold.
+    Participants are shuffled, then dealt to the currently smallest fold,
+    so folds hold close to len / k cases each.
+
+    Returns: list of k (train cases, test cases) 2-tuples.
+    """
+    codes, groups = pd.factorize(participants(case_projects.index))
+    sizes = np.bincount(codes, minlength=len(groups))
+    order = np.random.RandomState(seed).permutation(len(groups))
+    # largest groups first keeps the greedy assignment balanced
+    order = order[np.argsort(-sizes[order], kind='stable')]
+
+    group_fold = np.empty(len(groups), dtype=np.int64)
+    fold_sizes = np.zeros(k, dtype=np.int64)
+    for g in order:
+        fold = np.argmin(fold_sizes)
+        group_fold[g] = fold
+        fold_sizes[fold] += sizes[g]
+
+    case_fold = group_fold[codes]
+    return [(case_projects.index[case_fold != f].to_list(), case_projects.index[case_fold == f].to_list())
+            for f in range(k)]
+
+
+def grouped_holdout(cases, fraction: float = 0.2, seed: int = 0):
+    """
+    Holds out about fraction of cases, whole participants at a time, e.g. a
+    validation set taken from the training cases of a split.
+
+    Returns: 2-tuple of kept and held-out case lists.
+    """
+    k = max(2, int(round(1 / fraction)))
+    return grouped_kfold(pd.DataFrame(index=pd.Index(cases)), k, seed)[0]
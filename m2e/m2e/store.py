@@ -0,0 +1,248 @@
+"""
+Columnar store of per-project methylation and expression matrices.
+
+Parsing a 450k methylation TSV per case is what dominates dataset building,
+so every project is ingested once into dense (cases x features) matrices
+that are memory-mapped on load and sliced by column afterwards.
+
+Store layout:
+
+    <store_dir>/<modality>_features.txt         shared feature index (probes / genes)
+    <store_dir>/<modality>_encoding.txt         codec of the matrices (m2e.quantize), float32 if absent
+    <store_dir>/<project>/<modality>.npy        matrix of codes (cases x features)
+    <store_dir>/<project>/<modality>_cases.txt  row index (case ids)
+
+Features are shared by all projects of a store, so a CpG or gene subset maps
+to the same columns in every project. So is the encoding: methylation may be
+ingested as uint8 / uint16 betas and expression as float16 log values, and
+get() decodes the slices it returns to float32.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from m2e.gene_ids import unversioned
+from m2e.readers import read_methylation, read_expression
+from m2e.profiling import profiled
+from m2e.quantize import Codec, FLOAT32, BETA_CODECS, get_codec
+
+
+MODALITIES = ('methylation', 'expression')
+DTYPE = np.float32
+
+
+def _read_index(path) -> pd.Index:
+    with open(path, 'r') as f:
+        return pd.Index([line.rstrip('\n') for line in f])
+
+
+def _write_index(path, ids):
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for i in ids:
+            f.write(str(i) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_case_file(path, modality: str) -> pd.Series:
+    """Reads a single GDC methylation or expression file into a feature-indexed series."""
+    if modality == 'methylation':
+        return read_methylation(path).iloc[:, 0]
+    elif modality == 'expression':
+        s = read_expression(path).iloc[:, 0]
+        s.index = unversioned(s.index)
+        return s
+    raise ValueError("Unknown modality: " + str(modality))
+
+
+class MatrixStore(object):
+    """
+    Reader and writer of the columnar matrix store.
+
+    :public:
+        has()
+        features()
+        cases()
+        matrix()
+        encoding()
+        decode()
+        get()
+        ingest()
+    """
+
+    def __init__(self, store_dir):
+        self.dir = Path(store_dir)
+        self._features = {}
+        self._encodings = {}
+        self._cases = {}
+        self._matrices = {}
+
+    def project_dir_(self, project: str) -> Path:
+        return self.dir / project
+
+    def matrix_path_(self, project: str, modality: str) -> Path:
+        return self.project_dir_(project) / (modality + '.npy')
+
+    def cases_path_(self, project: str, modality: str) -> Path:
+        return self.project_dir_(project) / (modality + '_cases.txt')
+
+    def features_path_(self, modality: str) -> Path:
+        return self.dir / (modality + '_features.txt')
+
+    def encoding_path_(self, modality: str) -> Path:
+        return self.dir / (modality + '_encoding.txt')
+
+    def has(self, project: str, modality: str) -> bool:
+        """Whether the project's modality has been ingested."""
+        return (self.matrix_path_(project, modality).is_file()
+                and self.cases_path_(project, modality).is_file()
+                and self.features_path_(modality).is_file())
+
+    def features(self, modality: str) -> pd.Index:
+        """Shared feature index of a modality."""
+        if modality not in self._features:
+            self._features[modality] = _read_index(self.features_path_(modality))
+        return self._features[modality]
+
+    def cases(self, project: str, modality: str) -> pd.Index:
+        """Case index (matrix rows) of a project's modality."""
+        key = (project, modality)
+        if key not in self._cases:
+            self._cases[key] = _read_index(self.cases_path_(project, modality))
+        return self._cases[key]
+
+    def encoding(self, modality: str) -> Codec:
+        """Codec of a modality's matrices; float32 for stores ingested without one."""
+        if modality not in self._encodings:
+            path = self.encoding_path_(modality)
+            self._encodings[modality] = get_codec(path.read_text().strip()) if path.is_file() else FLOAT32
+        return self._encodings[modality]
+
+    def decode(self, modality: str, codes) -> np.ndarray:
+        """float32 values of a block of a modality's matrix."""
+        return self.encoding(modality).decode(codes)
+
+    def matrix(self, project: str, modality: str) -> np.ndarray:
+        """Read-only memory map of the (cases x features) matrix, of codes (see encoding())."""
+        key = (project, modality)
+        if key not in self._matrices:
+            self._matrices[key] = np.load(self.matrix_path_(project, modality), mmap_mode='r')
+        return self._matrices[key]
+
+    def feature_positions(self, modality: str, ids) -> np.ndarray:
+        """Column positions of feature ids; raises KeyError on unknown ids."""
+        positions = self.features(modality).get_indexer(pd.Index(ids))
+        if (positions < 0).any():
+            missing = [i for i, p in zip(ids, positions) if p < 0]
+            raise KeyError("Features not in store: " + str(missing[:10]))
+        return positions
+
+    def case_positions(self, project: str, modality: str, cases) -> np.ndarray:
+        """Row positions of case ids; raises KeyError on unknown cases."""
+        positions = self.cases(project, modality).get_indexer(pd.Index(cases))
+        if (positions < 0).any():
+            missing = [c for c, p in zip(cases, positions) if p < 0]
+            raise KeyError("Cases not in store: " + str(missing[:10]))
+        return positions
+
+    def get(self, project: str, modality: str, cases=None, features=None, decode: bool = True) -> np.ndarray:
+        """
+        Slices a (cases x features) block out of a project's matrix.
+
+        Args:
+            cases: case ids to get rows for. if None: all cases.
+            features: probe / gene ids to get columns for. if None: all features.
+            decode: if False, the codes of the store's encoding are returned.
+
+        Returns:
+            float32 (or codes) array of shape (len(cases), len(features)).
+        """
+        m = self.matrix(project, modality)
+        rows = slice(None) if cases is None else self.case_positions(project, modality, cases)
+        cols = slice(None) if features is None else self.feature_positions(modality, features)
+        if cases is None:
+            block = np.asarray(m[:, cols])
+        else:
+            # sorted row reads keep the access pattern sequential on disk; both axes are
+            # indexed at once, so only the selected columns of the rows are read
+            order = np.argsort(rows, kind='stable')
+            sorted_block = np.asarray(m[rows[order]] if features is None else m[np.ix_(rows[order], cols)])
+            block = np.empty_like(sorted_block)
+            block[order] = sorted_block
+        return self.decode(modality, block) if decode else block
+
+    @profiled('store.ingest')
+    def ingest(self, project, modality: str, features=None, encoding: str = None) -> Path:
+        """
+        Converts a project's per-case files of one modality into a store matrix.
+
+        Args:
+            project: m2e.project.Project to ingest.
+            modality: 'methylation' or 'expression'.
+            features: feature ids defining the columns. if None: the store's
+                existing feature index, or else the features of the first case.
+            encoding: codec of the matrix (m2e.quantize.CODECS), fixed for the
+                modality by its first ingest. if None: the store's, or float32.
+
+        Returns:
+            path of the written matrix.
+        """
+        assert modality in MODALITIES
+        case_ids = list(project.case_ids)
+        assert len(case_ids) > 0, "Project has no cases to ingest."
+
+        if self.features_path_(modality).is_file():
+            codec = self.encoding(modality)
+            if encoding is not None and encoding != codec.name:
+                raise ValueError("Encoding " + encoding + " differs from the store's " + modality
+                                 + " encoding " + codec.name + ".")
+        else:
+            codec = get_codec(encoding or FLOAT32.name)
+        if codec.name in BETA_CODECS and modality != 'methylation':
+            raise ValueError(codec.name + " encodes beta values, not " + modality + ".")
+
+        if self.features_path_(modality).is_file():
+            if features is not None and not pd.Index(features).equals(self.features(modality)):
+                raise ValueError("Features differ from the store's shared " + modality + " index.")
+            features = self.features(modality)
+        elif features is not None:
+            features = pd.Index(features)
+
+        self.project_dir_(project.name).mkdir(parents=True, exist_ok=True)
+        path = self.matrix_path_(project.name, modality)
+        tmp_path = path.with_suffix('.tmp.npy')
+
+        m = None
+        for row, case in enumerate(case_ids):
+            values = read_case_file(project.get_case_datapaths_(case)[modality], modality)
+            if features is None:
+                features = pd.Index(values.index)
+            if m is None:
+                m = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=codec.dtype,
+                                              shape=(len(case_ids), len(features)))
+            if values.index.equals(features):
+                m[row] = codec.encode(values.to_numpy(dtype=np.float64))
+            else:
+                positions = values.index.get_indexer(features)
+                row_values = np.full(len(features), np.nan)
+                found = positions >= 0
+                row_values[found] = values.to_numpy(dtype=np.float64)[positions[found]]
+                m[row] = codec.encode(row_values)
+        m.flush()
+        del m
+
+        if not self.features_path_(modality).is_file():
+            self.dir.mkdir(parents=True, exist_ok=True)
+            _write_index(self.features_path_(modality), features)
+            _write_index(self.encoding_path_(modality), [codec.name])
+            self._features[modality] = features
+            self._encodings[modality] = codec
+        os.replace(tmp_path, path)
+        _write_index(self.cases_path_(project.name, modality), case_ids)
+
+        self._matrices.pop((project.name, modality), None)
+        self._cases.pop((project.name, modality), None)
+        return path
@@ -0,0 +1,117 @@
+"""
+Synthetic TCGA-shaped cohorts for tests and benchmarks.
+
+Projects are written in the GDC layout Project reads (see m2e.project):
+
+    <projects_dir>/<project>/<project>_methylation.csv     metadata: file_id, file_name, cases
+    <projects_dir>/<project>/<project>_expression.csv
+    <projects_dir>/<project>/data/methylation/<project>/harmonized/DNA_Methylation/
+        Methylation_Beta_Value/<file_id>/<file_name>          450k-style beta value TSV
+    <projects_dir>/<project>/data/expression/<project>/harmonized/Transcriptome_Profiling/
+        Gene_Expression_Quantification/<file_id>/<file_name>  HTSeq-style counts
+
+Expression of every gene follows the methylation of one driver probe, so
+correlation ranking has signal to find. Everything is seeded.
+"""
+
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from m2e.project import data_paths, metadata_paths
+
+
+# trailing HTSeq counters, as in GDC expression files
+HTSEQ_COUNTERS = ['__no_feature', '__ambiguous', '__too_low_aQual', '__not_aligned', '__alignment_not_unique']
+METH_HEADER = 'Composite Element REF\tBeta_value\tChromosome\tStart\tEnd\tGene_Symbol\n'
+
+
+def probe_ids(n: int) -> list:
+    return ['cg%08d' % i for i in range(n)]
+
+
+def gene_ids(n: int) -> list:
+    """Versioned Ensembl ids."""
+    return ['ENSG%011d.%d' % (i, i % 5 + 1) for i in range(n)]
+
+
+def driver_probes(n_genes: int, n_probes: int) -> np.ndarray:
+    """Probe position whose methylation drives each gene's expression."""
+    return (np.arange(n_genes) * 7919) % n_probes
+
+
+def write_project(projects_dir, name: str, n_cases: int, probes: list, genes: list,
+                  seed: int = 0, missing: float = 0.02) -> list:
+    """
+    Writes a project of n_cases cases with methylation of probes and
+    expression of genes.
+
+    Args:
+        genes: versioned Ensembl ids.
+        missing: fraction of beta values written as NA.
+
+    Returns:
+        case ids (sample-level barcodes, as Project reports them).
+    """
+    rng = np.random.default_rng(seed)
+    project_dir = Path(projects_dir) / name
+    dirs = data_paths(project_dir, name)
+    # per-probe annotation columns are the same in every file
+    suffixes = ['\tchr%d\t%d\t%d\tG%d\n' % (i % 22 + 1, i * 100, i * 100 + 1, i) for i in range(len(probes))]
+    drivers = driver_probes(len(genes), len(probes))
+    htseq = ''.join('%s\t%d\n' % (c, rng.integers(1000)) for c in HTSEQ_COUNTERS)
+
+    cases, meta = [], {'methylation': [], 'expression': []}
+    for c in range(n_cases):
+        case = 'TCGA-%s-%04d-01A' % (name[-2:], c)
+        cases.append(case)
+        barcode = case + '-11R-A32Z-07'
+
+        betas = rng.random(len(probes))
+        counts = np.round(1000 * (1 - betas[drivers]) + rng.normal(0, 50, len(genes))).clip(0).astype(np.int64)
+        betas[rng.random(len(probes)) < missing] = np.nan
+        files = {'methylation': ''.join([METH_HEADER] + [
+                     p + ('\tNA' if np.isnan(b) else '\t%.6f' % b) + s for p, b, s in zip(probes, betas, suffixes)]),
+                 'expression': ''.join('%s\t%d\n' % gc for gc in zip(genes, counts)) + htseq}
+
+        for modality, text in files.items():
+            file_id = str(uuid.UUID(int=int(rng.integers(1 << 62))))
+            file_name = file_id[:8] + ('.methylation.txt' if modality == 'methylation' else '.htseq.counts')
+            (dirs[modality] / file_id).mkdir(parents=True)
+            with open(dirs[modality] / file_id / file_name, 'w') as f:
+                f.write(text)
+            meta[modality].append('%s\t%s\t%s\n' % (file_id, file_name, barcode))
+
+    for modality, path in metadata_paths(project_dir, name).items():
+        with open(path, 'w') as f:
+            f.write('file_id\tfile_name\tcases\n')
+            f.writelines(meta[modality])
+    return cases
+
+
+def write_cohort(projects_dir, n_projects: int = 2, n_cases: int = 10, n_probes: int = 2000,
+                 n_genes: int = 500, seed: int = 0):
+    """
+    Writes n_projects projects TCGA-S00, TCGA-S01, ... sharing probes and genes.
+
+    Returns:
+        3-tuple of project names, probe ids and unversioned gene ids.
+    """
+    probes, genes = probe_ids(n_probes), gene_ids(n_genes)
+    projects = ['TCGA-S%02d' % i for i in range(n_projects)]
+    for i, name in enumerate(projects):
+        write_project(projects_dir, name, n_cases, probes, genes, seed=seed + i)
+    return projects, probes, [g.split('.')[0] for g in genes]
+
+
+def write_promoters(path, names: list, length: int = 1000, seed: int = 0) -> Path:
+    """Writes a FASTA of random promoters of length bases, headers as bedtools'."""
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+    with open(path, 'w') as f:
+        for name in names:
+            seq = bases[rng.integers(4, size=length)].tobytes().decode()
+            f.write('>%s(+)\n' % name)
+            f.writelines(seq[i:i + 60] + '\n' for i in range(0, length, 60))
+    return Path(path)
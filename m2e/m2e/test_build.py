@@ -0,0 +1,72 @@
+import os
+import unittest
+import tempfile
+
+from m2e.build import Stage, BuildGraph
+
+
+class TestBuildGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.link_dir = self.tmp.name + '/out/'
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def graph(self, width):
+        def source(out_dir, inputs, text):
+            self.calls.append('source')
+            (out_dir / 'source.txt').write_text(text)
+
+        def derived(out_dir, inputs, width):
+            self.calls.append('derived')
+            text = inputs['source']['source.txt'].read_text()
+            (out_dir / 'derived.txt').write_text(text[:width])
+
+        graph = BuildGraph(self.tmp.name + '/cache', link_dir=self.link_dir)
+        graph.add(Stage('source', source, ['source.txt'], params={'text': 'ACGTACGT'}, adopt=True))
+        graph.add(Stage('derived', derived, ['derived.txt'], inputs=['source'], params={'width': width}))
+        return graph
+
+    def read(self, name):
+        with open(self.link_dir + name) as f:
+            return f.read()
+
+    def test_rebuilds_only_downstream_of_change(self):
+        self.assertEqual(self.graph(4).run(), {'source': 'built', 'derived': 'built'})
+        self.assertEqual(self.read('derived.txt'), 'ACGT')
+        self.assertEqual(self.graph(4).run(), {'source': 'cached', 'derived': 'cached'})
+        self.assertEqual(self.graph(2).run(), {'source': 'cached', 'derived': 'built'})
+        self.assertEqual(self.read('derived.txt'), 'AC')
+        # switching back relinks the cached artifact
+        self.assertEqual(self.graph(4).run(), {'source': 'cached', 'derived': 'cached'})
+        self.assertEqual(self.read('derived.txt'), 'ACGT')
+        self.assertEqual(self.calls, ['source', 'derived', 'derived'])
+
+    def test_adopts_existing_outputs(self):
+        os.makedirs(self.link_dir)
+        with open(self.link_dir + 'source.txt', 'w') as f:
+            f.write('TTTT')
+        self.assertEqual(self.graph(4).run(), {'source': 'adopted', 'derived': 'built'})
+        self.assertTrue(os.path.islink(self.link_dir + 'source.txt'))
+        self.assertEqual(self.read('derived.txt'), 'TTTT')
+        self.assertEqual(self.calls, ['derived'])
+
+    def test_keeps_real_outputs(self):
+        os.makedirs(self.link_dir + 'derived.txt')
+        with open(self.link_dir + 'derived.txt/notes', 'w') as f:
+            f.write('hand-built')
+        with self.assertRaises(FileExistsError):
+            self.graph(4).run()
+        with open(self.link_dir + 'derived.txt/notes') as f:
+            self.assertEqual(f.read(), 'hand-built')
+
+    def test_targets(self):
+        self.assertEqual(self.graph(4).run(targets=['source']), {'source': 'built'})
+        self.assertFalse(os.path.exists(self.link_dir + 'derived.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
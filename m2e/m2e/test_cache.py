@@ -0,0 +1,72 @@
+import os
+import unittest
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.cache import CohortCache, REGISTRY_NAME, LOCK_NAME
+from m2e.test_store import make_project, PROJECT, CPGS
+
+
+def cached_sum(args):
+    cache_dir, store_dir = args
+    return float(CohortCache(cache_dir).get(store_dir, PROJECT, 'methylation', CPGS[1:]).sum())
+
+
+class TestCohortCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        self.cache_dir = self.tmp.name + '/cache/'
+        make_project(projects_dir)
+        self.store = MatrixStore(self.store_dir)
+        project = Project(PROJECT, projects_dir=projects_dir)
+        self.store.ingest(project, 'methylation')
+        self.store.ingest(project, 'expression')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_is_shared_view(self):
+        cache = CohortCache(self.cache_dir)
+        block = cache.get(self.store_dir, PROJECT, 'methylation', CPGS[1:])
+        np.testing.assert_array_equal(block, self.store.get(PROJECT, 'methylation', features=CPGS[1:]))
+        self.assertFalse(block.flags.writeable)
+        again = CohortCache(self.cache_dir).get(self.store_dir, PROJECT, 'methylation', CPGS[1:])
+        self.assertEqual(again.filename, block.filename)
+        self.assertEqual(len(cache.blocks()), 1)
+
+    def test_concurrent_processes_load_once(self):
+        with ProcessPoolExecutor(max_workers=3) as pool:
+            sums = list(pool.map(cached_sum, [(self.cache_dir, self.store_dir)] * 6))
+        self.assertEqual(len(set(sums)), 1)
+        self.assertEqual(len(CohortCache(self.cache_dir).blocks()), 1)
+
+    def test_lru_eviction_and_invalidation(self):
+        one_block = 2 * 2 * 4  # 2 cases x 2 features of float32
+        cache = CohortCache(self.cache_dir, capacity=one_block)
+        cache.get(self.store_dir, PROJECT, 'methylation', CPGS[:2])
+        expr = cache.get(self.store_dir, PROJECT, 'expression')
+        blocks = cache.blocks()
+        self.assertEqual(blocks['modality'].to_list(), ['expression'])
+        self.assertEqual(len([f for f in os.listdir(self.cache_dir) if f.endswith('.npy')]), 1)
+
+        # a re-ingested matrix is not served from the old block
+        path = self.store.matrix_path_(PROJECT, 'expression')
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+        cache.get(self.store_dir, PROJECT, 'expression')
+        self.assertEqual(len(cache.blocks()), 1)
+        self.assertNotEqual(cache.blocks().index[0], blocks.index[0])
+        np.testing.assert_array_equal(expr, self.store.get(PROJECT, 'expression'))
+        # evicted blocks leave no files behind
+        self.assertEqual(sorted(f for f in os.listdir(self.cache_dir) if not f.startswith(REGISTRY_NAME)),
+                         sorted([cache.blocks().index[0] + '.npy', LOCK_NAME]))
+
+
+if __name__ == '__main__':
+    unittest.main()
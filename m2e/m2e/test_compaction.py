@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from m2e.project import Project
+from m2e.compaction import compact_project, strip_values
+from m2e.readers import compact_path
+from m2e.test_store import make_project, PROJECT, CPGS
+
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        self.annotation_dir = Path(self.tmp.name) / 'annotation'
+        make_project(self.projects_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_strip_values(self):
+        path = Path(self.tmp.name) / 'm.txt'
+        path.write_bytes(b'ref\tBeta_value\tchr\nA\t0.1\tchr1\nB\tNA\tchr2')
+        digest, n_lines = strip_values(path)
+        same, _ = strip_values(path)
+        self.assertEqual(n_lines, 3)
+        self.assertEqual(digest, same)
+        path.write_bytes(b'ref\tBeta_value\tchr\nA\t0.5\tchr1\nB\t0.2\tchr2\n')
+        self.assertEqual(strip_values(path)[0], digest)
+        path.write_bytes(b'ref\tBeta_value\tchr\nA\t0.5\tchr1\nB\t0.2\tchr3\n')
+        self.assertNotEqual(strip_values(path)[0], digest)
+
+    def test_project_reads_compacted(self):
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        before = {case: project.get_case_data(case, get_expr=False)['methylation'] for case in project.case_ids}
+        paths = [project.get_case_datapaths_(case)['methylation'] for case in project.case_ids]
+
+        files = compact_project(project, self.annotation_dir, n_jobs=1)
+        self.assertEqual(files['digest'].nunique(), 1)
+        self.assertEqual(len(list(self.annotation_dir.iterdir())), 1)
+        for path in paths:
+            self.assertFalse(path.exists())
+            self.assertTrue(compact_path(path).is_file())
+
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        for case in project.case_ids:
+            pd.testing.assert_frame_equal(project.get_case_data(case, get_expr=False)['methylation'], before[case])
+            pd.testing.assert_frame_equal(project.get_case_data(case, cpgs=CPGS[::-1], get_expr=False)['methylation'],
+                                          before[case].loc[CPGS[::-1]])
+        self.assertEqual(len(compact_project(project, self.annotation_dir, n_jobs=1)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from m2e.correlation import standardize, top_k_correlations
+
+
+class TestCorrelation(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.meth = rng.random((50, 300)).astype(np.float32)
+        self.expr = rng.random((50, 20)).astype(np.float32)
+        self.expr[:, 5] = 3 * self.meth[:, 123]
+
+    def blocks(self, size=64):
+        return ((s, self.meth[:, s:s + size]) for s in range(0, self.meth.shape[1], size))
+
+    def test_standardize(self):
+        z = standardize(self.meth[:, :4])
+        np.testing.assert_allclose(z.T @ z, np.corrcoef(self.meth[:, :4].T), atol=1e-5)
+
+    def test_pearson_top_k(self):
+        idx, corr = top_k_correlations(self.blocks(), self.expr, k=5, gene_block=8, n_jobs=2)
+        full = np.corrcoef(self.expr.T, self.meth.T)[:20, 20:]
+        np.testing.assert_array_equal(idx, np.argsort(-np.abs(full), axis=1)[:, :5])
+        np.testing.assert_allclose(corr, np.take_along_axis(full, idx, axis=1), atol=1e-5)
+        self.assertEqual(idx[5, 0], 123)
+
+    def test_spearman_top_k(self):
+        idx, corr = top_k_correlations(self.blocks(), self.expr, k=5, method='spearman')
+        full = pd.DataFrame(np.hstack([self.expr, self.meth])).corr('spearman').to_numpy()[:20, 20:]
+        np.testing.assert_allclose(np.abs(corr), -np.sort(-np.abs(full), axis=1)[:, :5], atol=1e-5)
+        np.testing.assert_allclose(corr, np.take_along_axis(full, idx, axis=1), atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import pickle
+import unittest
+import tempfile
+
+import numpy as np
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.sequence import pack_fasta, BASE2IDX
+from m2e.intervals import PromoterCpgs
+from m2e.dataset import MethExprDataset
+from m2e.test_store import make_project, PROJECT
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+FASTA = """>1(+)
+ACGCGTACGA
+>2(-)
+CGTTCG
+"""
+C = BASE2IDX['C']
+
+
+class TestMethExprDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        make_project(projects_dir)
+        store = MatrixStore(self.store_dir)
+        project = Project(PROJECT, projects_dir=projects_dir)
+        store.ingest(project, 'methylation')
+        store.ingest(project, 'expression')
+        with open(self.tmp.name + '/proms.fna', 'w') as f:
+            f.write(FASTA)
+        self.proms_dir = pack_fasta(self.tmp.name + '/proms.fna', self.tmp.name + '/proms_store')
+        # cg0001, cg0003 in promoter 1 at C offsets 1, 7; cg0002 in promoter 2 at 0
+        self.cpgs = PromoterCpgs(['1', '2'], np.array([0, 2, 3]),
+                                 np.array(['cg0001', 'cg0003', 'cg0002'], dtype=object),
+                                 np.array([101, 107, 200]), np.array([1, 7, 0]))
+        self.ds = MethExprDataset(self.store_dir, self.proms_dir, [PROJECT], ['ENSG01', 'ENSG02'],
+                                  self.cpgs, promoter_ids=['1', '2'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_item(self):
+        self.assertEqual(len(self.ds), 4)
+        self.assertEqual(self.ds.sample_ids([2]).iloc[0].to_list(), [PROJECT, 'TCGA-XX-0002-01A', 'ENSG01'])
+        x, y = self.ds[2]  # case 1, gene ENSG01
+        self.assertEqual(x.shape, (10, 5))
+        self.assertEqual(y, 10)
+        self.assertAlmostEqual(x[1, C], 0.1, places=6)
+        self.assertAlmostEqual(x[7, C], 0.3, places=6)
+        self.assertEqual(x[3, C], 1)  # C without CpG keeps the base
+        x, y = self.ds[1]  # case 0, gene ENSG02
+        self.assertEqual(y, 10)
+        self.assertAlmostEqual(x[0, C], 0.1, places=6)
+        self.assertEqual(x[6:].sum(), 0)  # padding
+
+    def test_getitems_matches_getitem(self):
+        indices = [3, 0, 2, 2]
+        for i, (x, y) in zip(indices, self.ds.__getitems__(indices)):
+            x1, y1 = self.ds[i]
+            np.testing.assert_array_equal(x, x1)
+            self.assertEqual(y, y1)
+
+    def test_channels_and_pickle(self):
+        ds = MethExprDataset(self.store_dir, self.proms_dir, [PROJECT], ['ENSG01', 'ENSG02'],
+                             self.cpgs, promoter_ids=['1', '2'], compose=False,
+                             cases=['TCGA-XX-0002-01A'])
+        self.assertEqual(len(ds), 2)
+        ds.store()
+        ds = pickle.loads(pickle.dumps(ds))
+        self.assertIsNone(ds.store_)
+        (seq, track), y = ds[0]
+        self.assertEqual(seq[1, C], 1)
+        self.assertAlmostEqual(track[7], 0.3, places=6)
+        self.assertTrue(np.isnan(track[0]))
+
+    def test_quantized_store(self):
+        store_dir = self.tmp.name + '/quantized/'
+        project = Project(PROJECT, projects_dir=self.tmp.name + '/projects/')
+        MatrixStore(store_dir).ingest(project, 'methylation', encoding='beta8')
+        MatrixStore(store_dir).ingest(project, 'expression', encoding='log16')
+        ds = MethExprDataset(store_dir, self.proms_dir, [PROJECT], ['ENSG01', 'ENSG02'],
+                             self.cpgs, promoter_ids=['1', '2'])
+        x, y = ds[2]  # case 1, gene ENSG01
+        self.assertAlmostEqual(y, 10, delta=0.05)
+        self.assertAlmostEqual(x[1, C], 0.1, delta=1 / 508)
+        self.assertAlmostEqual(x[7, C], 0.3, delta=1 / 508)
+
+    @unittest.skipIf(torch is None, "torch not installed")
+    def test_dataloader_workers(self):
+        from torch.utils.data import DataLoader
+        loader = DataLoader(self.ds, batch_size=3, num_workers=2)
+        xs, ys = zip(*loader)
+        self.assertEqual(torch.cat(ys).tolist(), [0, 10, 10, 20])
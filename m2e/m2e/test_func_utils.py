@@ -1,5 +1,11 @@
 import unittest
 import os
+import gzip
+import hashlib
+import tempfile
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
 
 from func_utils import *
 
@@ -36,5 +42,83 @@ class TestDataCollection(unittest.TestCase):
         self.assertTrue(os.path.isfile(path))
 
 
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler honouring 'Range: bytes=<start>-' requests."""
+
+    def send_head(self):
+        rng = self.headers.get('Range')
+        if rng is None:
+            return super().send_head()
+        path = self.translate_path(self.path)
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        start = int(rng.split('=')[1].split('-')[0])
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size))
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        return f
+
+    def log_message(self, *args):
+        pass
+
+
+FASTA = b">NC_000001.10 Homo sapiens chromosome 1, GRCh37.p13\n" + b"ACGTN" * 40 + b"\nacgt\n>NC_000002.11 chr 2\nGGGG\n"
+
+
+class TestStreamDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.served = os.path.join(self.tmp.name, 'served')
+        self.dir = os.path.join(self.tmp.name, 'out') + '/'
+        os.mkdir(self.served)
+        os.mkdir(self.dir)
+        self.gz = gzip.compress(FASTA)
+        with open(os.path.join(self.served, 'genome.fna.gz'), 'wb') as f:
+            f.write(self.gz)
+        handler = partial(RangeRequestHandler, directory=self.served)
+        self.server = HTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/genome.fna.gz' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def expected(self):
+        return b">NC_000001.10\n" + b"ACGTN" * 40 + b"\nacgt\n>NC_000002.11\nGGGG\n"
+
+    def test_get_genome(self):
+        path = get_genome(self.url, self.dir)
+        self.assertEqual(path, self.dir + 'genome_edited.fna')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.expected())
+        self.assertEqual(sorted(os.listdir(self.dir)), ['genome_edited.fna'])
+
+    def test_resume(self):
+        path = self.dir + 'genome.fna'
+        with open(path + '.part', 'wb') as f:
+            f.write(self.gz[:17])
+        checksum = 'sha256:' + hashlib.sha256(self.gz).hexdigest()
+        stream_download(self.url, path, gunzip=True, fasta_headers=True, checksum=checksum)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.expected())
+
+    def test_checksum_mismatch(self):
+        path = self.dir + 'genome.fna.gz'
+        with self.assertRaises(ValueError):
+            stream_download(self.url, path, checksum='md5:0')
+        self.assertFalse(os.path.exists(path))
+
+    def test_fasta_header_stream_chunking(self):
+        for size in [1, 2, 3, 7, 64]:
+            stream = FastaHeaderStream()
+            out = b''.join(stream.feed(FASTA[i:i + size]) for i in range(0, len(FASTA), size))
+            self.assertEqual(out + stream.close(), self.expected())
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
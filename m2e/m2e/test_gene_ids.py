@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from m2e.gene_ids import GeneIdMap, unversioned, ENSEMBL_COL, ENTREZ_COL
+
+
+class TestGeneIdMap(unittest.TestCase):
+
+    def setUp(self):
+        lookup = pd.DataFrame({ENSEMBL_COL: ['ENSG01', 'ENSG02', 'ENSG02', 'ENSG03'],
+                               ENTREZ_COL: [10, 20, 21, 20]})
+        self.ids = GeneIdMap(lookup)
+
+    def test_to_entrez(self):
+        np.testing.assert_array_equal(self.ids.to_entrez(['ENSG02.5', 'ENSG01']), [20, 10])
+        self.assertEqual(list(self.ids.to_entrez(['ENSG03', 'ENSG09'], errors='ignore', as_str=True)), ['20', ''])
+        with self.assertRaises(KeyError):
+            self.ids.to_entrez(['ENSG09'])
+
+    def test_to_ensembl(self):
+        self.assertEqual(list(self.ids.to_ensembl([20, 21, 10])), ['ENSG02', 'ENSG02', 'ENSG01'])
+        self.assertEqual(list(self.ids.to_ensembl(['21', '99'], errors='ignore')), ['ENSG02', ''])
+
+    def test_unversioned(self):
+        self.assertEqual(unversioned(['ENSG01.2', 'ENSG03']).to_list(), ['ENSG01', 'ENSG03'])
+        self.assertEqual(unversioned(['ENSG01.2', 'ENSG03']).to_list(), ['ENSG01', 'ENSG03'])
+        self.assertEqual(unversioned(['ENSG04.1']).to_list(), ['ENSG04'])
+
+
+if __name__ == '__main__':
+    unittest.main()
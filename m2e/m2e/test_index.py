@@ -0,0 +1,62 @@
+import os
+import unittest
+import tempfile
+
+from m2e.project import Project
+from m2e.index import CaseIndex, default_index_path
+from m2e.test_store import make_project, PROJECT
+
+
+class TestCaseIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        make_project(self.projects_dir)
+        self.index = CaseIndex(self.tmp.name + '/index.sqlite', projects_dir=self.projects_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cases_match_project_scan(self):
+        scanned = Project(PROJECT, projects_dir=self.projects_dir)
+        indexed = Project(PROJECT, projects_dir=self.projects_dir, index=self.index)
+        self.assertEqual(scanned.cases, indexed.cases)
+        self.assertEqual(scanned.case_ids, indexed.case_ids)
+        for case in scanned.case_ids:
+            self.assertEqual(scanned.get_case_datapaths_(case), indexed.get_case_datapaths_(case))
+
+    def test_metadata_keeps_indexed_cases(self):
+        indexed = Project(PROJECT, projects_dir=self.projects_dir, index=self.index)
+        cases = indexed.cases
+        # the directory changes after construction: a rescan would drop both cases as duplicates
+        path = os.path.join(self.projects_dir, PROJECT, PROJECT + '_methylation.csv')
+        with open(path, 'r') as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('TCGA-XX-0002', 'TCGA-XX-0001'))
+        self.assertEqual(len(indexed.meta['methylation']), 2)
+        self.assertIs(indexed.cases, cases)
+        self.assertEqual(indexed.case_ids, ['TCGA-XX-0001-01A', 'TCGA-XX-0002-01A'])
+        self.assertEqual(list(indexed.old_cases['expression']), indexed.case_ids)
+
+    def test_invalidated_by_mtime(self):
+        self.index.refresh(PROJECT)
+        self.assertTrue(self.index.is_valid(PROJECT))
+        path = os.path.join(self.projects_dir, PROJECT, PROJECT + '_expression.csv')
+        os.utime(path, ns=(0, 0))
+        self.assertFalse(self.index.is_valid(PROJECT))
+
+    def test_default_path_is_local(self):
+        path = default_index_path(self.projects_dir)
+        self.assertFalse(path.startswith(self.projects_dir))
+        self.assertNotEqual(path, default_index_path(self.tmp.name + '/other/'))
+
+    def test_case_projects(self):
+        df = self.index.case_projects([PROJECT])
+        self.assertEqual(df.index.to_list(), ['TCGA-XX-0001-01A', 'TCGA-XX-0002-01A'])
+        self.assertEqual(set(df[0]), {PROJECT})
+
+
+if __name__ == '__main__':
+    unittest.main()
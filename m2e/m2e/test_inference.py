@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import lightgbm as lgb
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.training import build_lgb_dataset
+from m2e.inference import ModelArtifact, predict_store, predict_files, file_case_ids
+from m2e.test_store import make_project, PROJECT, CPGS
+
+
+GENES = ['ENSG01', 'ENSG02']
+
+
+class TestInference(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        make_project(self.projects_dir)
+        self.store = MatrixStore(self.store_dir)
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        self.store.ingest(project, 'methylation')
+        self.store.ingest(project, 'expression')
+        params = {'min_data_in_bin': 1, 'min_data_in_leaf': 1}
+        train, _ = build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, params=params)
+        booster = lgb.train(dict(params, objective='regression', verbosity=-1), train, num_boost_round=5)
+        self.artifact = ModelArtifact(booster, CPGS, GENES, meta={'projects': [PROJECT]})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip_matches_booster(self):
+        path = self.artifact.save(self.tmp.name + '/model')
+        loaded = ModelArtifact.load(path)
+        self.assertEqual(loaded.cpgs.to_list(), CPGS)
+        self.assertEqual(loaded.genes.to_list(), GENES)
+        self.assertEqual(loaded.meta['projects'], [PROJECT])
+
+        meth = self.store.get(PROJECT, 'methylation', features=CPGS)
+        expected = self.artifact.booster.predict(np.repeat(meth, len(GENES), axis=0))
+        np.testing.assert_allclose(loaded.predict_cases(meth).reshape(-1), expected, rtol=1e-6)
+
+    def test_store_and_files_agree(self):
+        out_dir = self.tmp.name + '/pred/'
+        predict_store(self.artifact, self.store_dir, [PROJECT], out_dir, chunk_size=1)
+        out = MatrixStore(out_dir)
+        self.assertEqual(out.features('expression').to_list(), GENES)
+        self.assertEqual(out.cases(PROJECT, 'expression').to_list(), ['TCGA-XX-0001-01A', 'TCGA-XX-0002-01A'])
+
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        files = {case: project.get_case_datapaths_(case)['methylation'] for case in project.case_ids}
+        predict_files(self.artifact, files, out_dir, 'files', n_jobs=1)
+        np.testing.assert_array_equal(out.get('files', 'expression', cases=list(files)),
+                                      out.get(PROJECT, 'expression', cases=list(files)))
+        self.assertFalse(Path(out_dir, 'files', 'expression.tmp.npy').exists())
+
+
+class TestFileCaseIds(unittest.TestCase):
+
+    def test_barcodes(self):
+        paths = ['/d/jhu-usc.edu_BRCA.HumanMethylation450.4.lvl-3.TCGA-A1-A0SB-01A-11D-A141-05.txt',
+                 '/d/jhu-usc.edu_BRCA.HumanMethylation450.4.lvl-3.TCGA-A1-A0SD-01A-11D-A10P-05.txt',
+                 '/d/sample.v2.txt']
+        self.assertEqual(list(file_case_ids(paths)), ['TCGA-A1-A0SB-01A', 'TCGA-A1-A0SD-01A', 'sample.v2'])
+
+    def test_duplicates(self):
+        with self.assertRaises(ValueError):
+            file_case_ids(['/a/TCGA-A1-A0SB-01A-11D.txt', '/b/TCGA-A1-A0SB-01A-11D.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
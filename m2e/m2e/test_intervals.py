@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from m2e.intervals import IntervalIndex, map_promoter_cpgs, GENE_TO_CHIP_STRAND
+
+
+CHROM_LEN = 1000
+
+
+def brute_force(chroms, positions, strands, q_chroms, q_starts, q_ends, q_strands=None):
+    """Points of every closed interval by a scan, ordered by position then index."""
+    out = []
+    for i in range(len(q_chroms)):
+        hits = [j for j in range(len(positions))
+                if chroms[j] == q_chroms[i] and q_starts[i] <= positions[j] <= q_ends[i]
+                and (q_strands is None or strands[j] == q_strands[i])]
+        out.append(sorted(hits, key=lambda j: (positions[j], j)))
+    return out
+
+
+def as_lists(indptr, hits) -> list:
+    return [hits[indptr[i]:indptr[i + 1]].tolist() for i in range(len(indptr) - 1)]
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = 300
+        self.chroms = rng.choice(['chr1', 'chr2'], n)
+        self.positions = rng.randint(0, CHROM_LEN, n)
+        self.positions[:4] = [0, CHROM_LEN - 1, 0, CHROM_LEN - 1]  # chromosome ends
+        self.positions[4:6] = self.positions[6]  # ties
+        self.strands = rng.choice(['F', 'R'], n)
+
+        starts = rng.randint(-50, CHROM_LEN, 100)
+        ends = starts + rng.randint(0, 200, 100)
+        # touching ([a, b], [b, c]), nested, single point, empty (end < start) and whole chromosome
+        starts = np.r_[starts, 100, 200, 150, 500, 600, -10, 0]
+        ends = np.r_[ends, 200, 300, 160, 500, 590, CHROM_LEN + 10, CHROM_LEN - 1]
+        self.q_chroms = np.r_[rng.choice(['chr1', 'chr2'], 100), ['chr1'] * 7]
+        self.q_starts, self.q_ends = starts, ends
+        self.q_strands = rng.choice(['F', 'R'], len(starts))
+
+    def test_matches_brute_force(self):
+        index = IntervalIndex(self.chroms, self.positions)
+        indptr, hits = index.query(self.q_chroms, self.q_starts, self.q_ends)
+        self.assertEqual(as_lists(indptr, hits),
+                         brute_force(self.chroms, self.positions, None,
+                                     self.q_chroms, self.q_starts, self.q_ends))
+
+    def test_stranded_matches_brute_force(self):
+        index = IntervalIndex(self.chroms, self.positions, self.strands)
+        indptr, hits = index.query(self.q_chroms, self.q_starts, self.q_ends, self.q_strands)
+        self.assertEqual(as_lists(indptr, hits),
+                         brute_force(self.chroms, self.positions, self.strands,
+                                     self.q_chroms, self.q_starts, self.q_ends, self.q_strands))
+
+    def test_empty_queries(self):
+        index = IntervalIndex(self.chroms, self.positions)
+        indptr, hits = index.query([], np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        self.assertEqual(indptr.tolist(), [0])
+        self.assertEqual(len(hits), 0)
+        indptr, hits = index.query(['chrX', 'chr1'], [0, 10], [CHROM_LEN, 5])
+        self.assertEqual(indptr.tolist(), [0, 0, 0])  # unknown chromosome, end < start
+
+
+class TestMapPromoterCpgs(unittest.TestCase):
+
+    def setUp(self):
+        self.chip = pd.DataFrame({'ID': ['cg%d' % i for i in range(8)],
+                                  'RANGE_GB': ['chr1'] * 6 + ['chr2'] * 2,
+                                  'MAPINFO': [1, 10, 15, 20, 30, 999, 10, 12],
+                                  'Strand': ['F', 'R', 'F', 'R', 'F', 'F', 'R', 'F']})
+        # touching promoters of both strands, one at the chromosome start and one at its end
+        self.genes = pd.DataFrame({'chr': ['chr1', 'chr1', 'chr1', 'chr1', 'chr2'],
+                                   'start': [1, 10, 20, 990, 5],
+                                   'end': [10, 20, 30, 999, 15],
+                                   'strand': ['+', '-', '+', '+', '-']},
+                                  index=pd.Index(['1', '2', '3', '4', '5'], name='GeneID'))
+
+    def brute_force_(self, match_strand: bool) -> pd.DataFrame:
+        rows = []
+        for gene, g in self.genes.iterrows():
+            for _, c in self.chip.iterrows():
+                if (c['RANGE_GB'] == g['chr'] and g['start'] <= c['MAPINFO'] <= g['end']
+                        and (not match_strand or c['Strand'] == GENE_TO_CHIP_STRAND[g['strand']])):
+                    offset = g['end'] - c['MAPINFO'] if g['strand'] == '-' else c['MAPINFO'] - g['start']
+                    rows.append((gene, c['ID'], c['MAPINFO'], offset))
+        df = pd.DataFrame(rows, columns=['GeneID', 'ID', 'MAPINFO', 'offset'])
+        return df.sort_values(['GeneID', 'MAPINFO'], kind='stable').reset_index(drop=True)
+
+    def test_matches_brute_force(self):
+        for match_strand in [True, False]:
+            cpgs = map_promoter_cpgs(self.genes, self.chip, match_strand=match_strand)
+            df = cpgs.to_frame()
+            df['MAPINFO'] = df['MAPINFO'].astype(np.int64)
+            df['offset'] = df['offset'].astype(np.int64)
+            expected = self.brute_force_(match_strand)
+            pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_minus_strand_offsets_and_padding(self):
+        cpgs = map_promoter_cpgs(self.genes, self.chip, match_strand=False)
+        # gene 2 (-) spans 10..20: offset 0 is its end
+        self.assertEqual(cpgs.gene('2')['offset'].tolist(), [10, 5, 0])
+        offsets, ids = cpgs.padded(['5', '4'], max_cpgs=2)
+        self.assertEqual(offsets.tolist(), [[5, 3], [9, -1]])
+        self.assertEqual(ids.tolist(), [['cg6', 'cg7'], ['cg5', '']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import time
+import random
+import threading
+import unittest
+
+from m2e.parallel import ordered_map, prefetch
+
+
+def square(x):
+    time.sleep(random.random() * 0.01)
+    return x * x
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("item 3")
+    return x
+
+
+class TestOrderedMap(unittest.TestCase):
+
+    def test_order(self):
+        items = list(range(40))
+        expected = [x * x for x in items]
+        self.assertEqual(list(ordered_map(square, items)), expected)
+        for backend in ['thread', 'process']:
+            self.assertEqual(list(ordered_map(square, iter(items), n_jobs=4, backend=backend)), expected)
+
+    def test_bounded_in_flight(self):
+        lock, started = threading.Lock(), [0]
+
+        def work(x):
+            with lock:
+                started[0] += 1
+            time.sleep(0.002)
+            return x
+
+        for i, x in enumerate(ordered_map(work, range(30), n_jobs=4, max_in_flight=3)):
+            self.assertEqual(x, i)
+            time.sleep(0.005)  # slow consumer
+            self.assertLessEqual(started[0], i + 3)
+
+    def test_exceptions_propagate(self):
+        for backend in ['thread', 'process']:
+            results = []
+            with self.assertRaises(ValueError):
+                for x in ordered_map(fail_on_three, range(10), n_jobs=2, backend=backend):
+                    results.append(x)
+            self.assertEqual(results, [0, 1, 2])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            list(ordered_map(square, range(3), n_jobs=2, backend='gpu'))
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def test_order_and_depth(self):
+        produced = [0]
+
+        def items():
+            for i in range(20):
+                produced[0] += 1
+                yield i
+
+        for i, x in enumerate(prefetch(items(), depth=2)):
+            self.assertEqual(x, i)
+            time.sleep(0.005)  # lets the producer run ahead as far as it may
+            # depth queued, plus one produced item waiting for a free slot
+            self.assertLessEqual(produced[0], i + 1 + 2 + 1)
+
+    def test_exceptions_propagate(self):
+        def items():
+            yield 0
+            raise ValueError("producer failed")
+
+        results = []
+        with self.assertRaises(ValueError):
+            for x in prefetch(items()):
+                results.append(x)
+        self.assertEqual(results, [0])
+
+    def test_early_stop_ends_producer(self):
+        produced = [0]
+
+        def items():
+            for i in range(1000):
+                produced[0] += 1
+                yield i
+
+        before = set(threading.enumerate())
+        chunks = prefetch(items(), depth=2)
+        for x in chunks:
+            break
+        chunks.close()
+        for thread in set(threading.enumerate()) - before:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+        self.assertLessEqual(produced[0], 1 + 2 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
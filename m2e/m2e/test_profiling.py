@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import unittest
+import tempfile
+import subprocess
+
+from m2e import profiling
+from m2e.project import Project
+from m2e.test_store import make_project, PROJECT, CPGS
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        make_project(self.projects_dir)
+
+    def tearDown(self):
+        profiling.disable()
+        self.tmp.cleanup()
+
+    def test_disabled_is_noop(self):
+        profiling.disable()
+        self.assertIs(profiling.stage('x'), profiling.NULL_STAGE)
+        self.assertIsNone(profiling.report())
+
+    def test_project_stages(self):
+        profiling.enable()
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        for case in project.case_ids:
+            project.get_case_data(case, cpgs=CPGS[:2])
+        stages = profiling.report()['stages']
+        self.assertEqual(stages['project.discover']['files'], 4)
+        self.assertEqual(stages['project.metadata']['rows'], 4)
+        self.assertEqual(stages['read.methylation']['calls'], 2)
+        self.assertEqual(stages['read.methylation']['selected'], 4)
+        self.assertEqual(stages['read.expression']['rows'], 4)
+        self.assertGreater(stages['read.methylation']['file_bytes'], 0)
+
+    def test_report_from_environment(self):
+        path = os.path.join(self.tmp.name, 'run.json')
+        code = ("from m2e.profiling import stage\n"
+                "with stage('work') as s:\n"
+                "    s.add(rows=3)\n")
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(profiling.__file__)))
+        env = dict(os.environ, M2E_PROFILE=path,
+                   PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+        env.pop(profiling.ENV_PID, None)
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['stages']['work']['rows'], 3)
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
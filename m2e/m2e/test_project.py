@@ -0,0 +1,36 @@
+import unittest
+import tempfile
+
+from m2e.project import Project
+from m2e.test_store import make_project, PROJECT
+
+
+class TestLazyProject(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        make_project(self.projects_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lazy_matches_eager(self):
+        eager = Project(PROJECT, projects_dir=self.projects_dir)
+        lazy = Project(PROJECT, projects_dir=self.projects_dir, lazy=True)
+        self.assertNotIn('cases', lazy.__dict__)
+        for attr in ['samples', 'sample_paths', 'meta', 'cases', 'case_ids', 'old_cases']:
+            self.assertEqual(getattr(eager, attr), getattr(lazy, attr))
+
+    def test_single_modality(self):
+        lazy = Project(PROJECT, projects_dir=self.projects_dir, lazy=True)
+        case = lazy.modality_case_ids('expression')[0]
+        data = lazy.get_case_data(case, genes=['ENSG02'], get_meth=False)
+        self.assertIsNone(data['methylation'])
+        self.assertEqual(data['expression'].iloc[0, 0], 10)
+        self.assertEqual(lazy.modalities_['methylation'], {})
+        self.assertNotIn('cases', lazy.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from m2e.quantize import CODECS, get_codec
+
+
+class TestCodecs(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.betas = np.concatenate([rng.random(10000), [0.0, 1.0, np.nan]])
+        self.expr = np.concatenate([rng.random(10000) * 27000, [0.0, np.nan]])
+
+    def test_beta_bounds(self):
+        for name, bound in [('beta8', 1 / 508), ('beta16', 7.7e-6)]:
+            codec = CODECS[name]
+            codes = codec.encode(self.betas)
+            self.assertEqual(codes.dtype, codec.dtype)
+            decoded = codec.decode(codes)
+            self.assertEqual(decoded.dtype, np.float32)
+            self.assertLessEqual(np.nanmax(np.abs(decoded - self.betas)), bound)
+            self.assertTrue(np.isnan(decoded[-1]))
+            np.testing.assert_array_equal(decoded[-3:-1], [0.0, 1.0])
+
+    def test_beta_clipped(self):
+        decoded = CODECS['beta8'].decode(CODECS['beta8'].encode([-0.1, 1.2]))
+        np.testing.assert_array_equal(decoded, [0.0, 1.0])
+
+    def test_log16_bound(self):
+        codec = CODECS['log16']
+        decoded = codec.decode(codec.encode(self.expr))
+        relative = np.abs(decoded - self.expr) / (1 + self.expr)
+        self.assertLessEqual(np.nanmax(relative), 0.005)
+        self.assertTrue(np.isnan(decoded[-1]))
+        self.assertEqual(decoded[-2], 0.0)
+
+    def test_float32_exact(self):
+        values = self.expr.astype(np.float32)
+        np.testing.assert_array_equal(CODECS['float32'].decode(CODECS['float32'].encode(values)), values)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_codec('int4')
+
+
+if __name__ == '__main__':
+    unittest.main()
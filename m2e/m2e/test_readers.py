@@ -0,0 +1,65 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from m2e.gene_ids import unversioned
+from m2e.readers import read_methylation, read_expression
+
+
+def write_meth(path, probes, betas):
+    with open(path, 'w') as f:
+        f.write('Composite Element REF\tBeta_value\tChromosome\tStart\n')
+        f.writelines('%s\t%s\tchr1\t%d\n' % (p, b, i) for i, (p, b) in enumerate(zip(probes, betas)))
+
+
+class TestReaders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_methylation_matches_pandas(self):
+        probes = ['cg%04d' % i for i in range(10)]
+        for i in range(2):
+            path = self.dir / ('m%d.txt' % i)
+            write_meth(path, probes, [0.1 * (i + j) if j != 3 else 'NA' for j in range(10)])
+            full = pd.read_csv(path, sep='\t', index_col=0, header=0)[['Beta_value']]
+            pd.testing.assert_frame_equal(read_methylation(path), full)
+            cpgs = ['cg0005', 'cg0003', 'cg0001']
+            pd.testing.assert_frame_equal(read_methylation(path, cpgs), full.loc[cpgs])
+        with self.assertRaises(KeyError):
+            read_methylation(path, ['cg0001', 'cg9999'])
+
+    def test_changed_layout_is_reparsed(self):
+        write_meth(self.dir / 'a.txt', ['cg1', 'cg2', 'cg3'], [0.1, 0.2, 0.3])
+        write_meth(self.dir / 'b.txt', ['cg1', 'cg3'], [0.4, 0.6])  # same first and last probe
+        read_methylation(self.dir / 'a.txt', ['cg3'])
+        self.assertEqual(read_methylation(self.dir / 'b.txt', ['cg3'])['Beta_value'].to_list(), [0.6])
+        self.assertEqual(read_methylation(self.dir / 'b.txt').index.to_list(), ['cg1', 'cg3'])
+
+    def test_reordered_layout_is_reparsed(self):
+        write_meth(self.dir / 'a.txt', ['cg1', 'cg2', 'cg3', 'cg4'], [0.1, 0.2, 0.3, 0.4])
+        write_meth(self.dir / 'b.txt', ['cg1', 'cg3', 'cg2', 'cg4'], [0.5, 0.7, 0.6, 0.8])  # same edges
+        read_methylation(self.dir / 'a.txt', ['cg2'])
+        self.assertEqual(read_methylation(self.dir / 'b.txt', ['cg2', 'cg3'])['Beta_value'].to_list(), [0.6, 0.7])
+        self.assertEqual(read_methylation(self.dir / 'a.txt', ['cg2'])['Beta_value'].to_list(), [0.2])
+        self.assertEqual(read_methylation(self.dir / 'b.txt').index.to_list(), ['cg1', 'cg3', 'cg2', 'cg4'])
+
+    def test_expression_matches_pandas(self):
+        path = self.dir / 'e.counts'
+        with open(path, 'w') as f:
+            f.write('ENSG01.1\t10\nENSG02.3\t20\nENSG02.3_PAR_Y\t0\nENSG03.1\t30\n__no_feature\t5\n')
+        full = pd.read_csv(path, sep='\t', index_col=0, header=None)
+        pd.testing.assert_frame_equal(read_expression(path), full)
+        full.index = unversioned(full.index)
+        genes = ['ENSG03', 'ENSG02']
+        pd.testing.assert_frame_equal(read_expression(path, genes), full.loc[genes])
+
+
+if __name__ == '__main__':
+    unittest.main()
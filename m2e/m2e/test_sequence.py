@@ -0,0 +1,111 @@
+import unittest
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from m2e.sequence import PromoterStore, MethylatedBatch, pack_fasta, write_windows, store_windows, BASE2IDX
+from m2e.gff import extract_promoter_windows, extract_sequences, promoter_windows, write_fasta
+
+
+FASTA = """>7133(+)
+ACGTNACG
+TTCG
+>11215(-)
+cgca
+>7133(+)
+AAAA
+"""
+
+
+class TestPromoterStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(self.tmp.name + '/proms.fna', 'w') as f:
+            f.write(FASTA)
+        pack_fasta(self.tmp.name + '/proms.fna', self.tmp.name + '/store')
+        self.store = PromoterStore(self.tmp.name + '/store')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pack(self):
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.seq('7133'), 'ACGTNACGTTCG')
+        self.assertEqual(self.store.seq('11215(-)'), 'CGCA')
+
+    def test_encode(self):
+        x = self.store.encode(['11215', '7133'])
+        self.assertEqual(x.shape, (2, 12, 5))
+        self.assertEqual(x[0, 0, BASE2IDX['C']], 1)
+        self.assertEqual(x[0, 4:].sum(), 0)  # padding
+        np.testing.assert_array_equal(x[1].sum(axis=1), 1)
+
+    def test_methylated_batch(self):
+        onehot = self.store.encode(['7133', '11215'])
+        offsets = np.array([[1, 6, 10], [0, 2, -1]])
+        betas = np.array([[[0.1, 0.2, np.nan], [0.3, 0.4, 0.0]],
+                          [[0.5, 0.6, 0.7], [0.8, 0.9, 0.0]]])
+        batch = MethylatedBatch(onehot, offsets, betas)
+        seq, track = batch.channels()
+        self.assertEqual(seq.shape, (2, 2, 12, 5))
+        self.assertTrue(np.shares_memory(seq, onehot))
+        composed = batch.compose()
+        c = BASE2IDX['C']
+        self.assertAlmostEqual(composed[1, 0, 10, c], 0.7, places=6)
+        self.assertEqual(composed[0, 0, 10, c], 1)  # NaN beta keeps the base
+        self.assertAlmostEqual(composed[1, 1, 2, c], 0.9, places=6)
+        np.testing.assert_array_equal(composed[1], batch.case(1))
+        np.testing.assert_array_equal(batch.compose([1]), composed[1:])
+        self.assertEqual(batch.betas.shape, (2, 2, 3))  # per case: CpGs only
+        _, track = batch.channels([1])
+        self.assertAlmostEqual(track[0, 1, 2], 0.9, places=6)
+        self.assertTrue(np.isnan(track[0, 0, 0]))
+        with self.assertRaises(ValueError):
+            MethylatedBatch(onehot, np.array([[0, -1, -1], [-1, -1, -1]]), betas)
+
+
+GENOME = """>chr1 test
+ACGTACGTAAACCCGGGTTT
+ACGTTGCA
+>chr2
+GGGGCCCCAT
+"""
+
+
+class TestPromoterWindows(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.genome = self.tmp.name + '/genome.fna'
+        with open(self.genome, 'w') as f:
+            f.write(GENOME)
+        # genes near chromosome starts and ends, on both strands
+        self.genes = pd.DataFrame({'seqid': ['chr1', 'chr1', 'chr2', 'chr1'],
+                                   'start': [12, 3, 5, 20], 'end': [16, 10, 7, 25],
+                                   'strand': ['+', '+', '-', '-'],
+                                   'GeneID': ['1', '2', '3', '4']})
+        self.windows = [(4, 0), (2, 3), (10, 1), (0, 2)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_views_match_separate_extraction(self):
+        proms, seqs, views = extract_promoter_windows(self.genes, self.genome, self.windows)
+        write_fasta(proms['GeneID'] + '(' + proms['strand'] + ')', seqs, self.tmp.name + '/proms.fna')
+        store_dir = pack_fasta(self.tmp.name + '/proms.fna', self.tmp.name + '/store')
+        write_windows(store_dir, views)
+        self.assertEqual(store_windows(store_dir), sorted(self.windows))
+
+        for window in self.windows:
+            store = PromoterStore(store_dir, window=window)
+            expected = extract_sequences(self.genome, promoter_windows(self.genes, *window))
+            for gene, seq in zip(self.genes['GeneID'], expected):
+                self.assertEqual(store.seq(gene), seq.decode(), (window, gene))
+        # the (10, 1) window is the widest: its views start at 0
+        np.testing.assert_array_equal(PromoterStore(store_dir, window=(10, 1)).window_starts(['1', '2']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import pandas as pd
+
+from m2e.splits import participants, smallest_projects_split, leave_project_out, grouped_kfold, grouped_holdout
+
+
+CASES = pd.DataFrame(['A', 'A', 'A', 'B', 'B', 'C'],
+                     index=['TCGA-01-0001-01A', 'TCGA-01-0001-11A', 'TCGA-01-0002-01A',
+                            'TCGA-02-0003-01A', 'TCGA-02-0004-01A', 'TCGA-03-0005-01A'])
+
+
+class TestSplits(unittest.TestCase):
+
+    def test_participants(self):
+        self.assertEqual(participants(CASES.index[:2]).to_list(), ['TCGA-01-0001'] * 2)
+
+    def test_smallest_projects(self):
+        train, test = smallest_projects_split(CASES, n_test_projects=1)
+        self.assertEqual(test, ['TCGA-03-0005-01A'])
+        self.assertEqual(len(train), 5)
+
+    def test_leave_project_out(self):
+        splits = leave_project_out(CASES)
+        self.assertEqual([p for p, _, _ in splits], ['A', 'B', 'C'])
+        self.assertEqual(splits[1][2], ['TCGA-02-0003-01A', 'TCGA-02-0004-01A'])
+
+    def test_grouped_kfold(self):
+        folds = grouped_kfold(CASES, k=3)
+        tests = [case for _, test in folds for case in test]
+        self.assertEqual(sorted(tests), sorted(CASES.index))
+        for train, test in folds:
+            self.assertFalse(set(participants(train)) & set(participants(test)))
+            self.assertEqual(sorted(train + test), sorted(CASES.index))
+        self.assertEqual([len(test) for _, test in folds], [2, 2, 2])
+
+    def test_grouped_holdout(self):
+        kept, held_out = grouped_holdout(CASES.index, fraction=0.5)
+        self.assertEqual(sorted(kept + held_out), sorted(CASES.index))
+        self.assertTrue(len(held_out) > 0 and len(kept) > 0)
+        self.assertFalse(set(participants(kept)) & set(participants(held_out)))
+
+
+if __name__ == '__main__':
+    unittest.main()
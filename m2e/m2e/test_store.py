@@ -0,0 +1,125 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+
+
+PROJECT = 'TCGA-TEST'
+CPGS = ['cg0001', 'cg0002', 'cg0003']
+GENES = ['ENSG01.1', 'ENSG02.4']
+
+
+def make_project(projects_dir):
+    """Writes a two-case project in the GDC directory layout."""
+    root = Path(projects_dir) / PROJECT
+    dirs = {'methylation': root / 'data/methylation' / PROJECT / 'harmonized/DNA_Methylation/Methylation_Beta_Value',
+            'expression': root / 'data/expression' / PROJECT / 'harmonized/Transcriptome_Profiling/Gene_Expression_Quantification'}
+    meta = {'methylation': [], 'expression': []}
+    for i, case in enumerate(['TCGA-XX-0001-01A', 'TCGA-XX-0002-01A']):
+        for modality in meta:
+            file_id = modality[:4] + str(i)
+            file_name = file_id + '.txt'
+            (dirs[modality] / file_id).mkdir(parents=True)
+            with open(dirs[modality] / file_id / file_name, 'w') as f:
+                if modality == 'methylation':
+                    f.write('Composite Element REF\tBeta_value\tChromosome\n')
+                    f.writelines('%s\t%s\tchr1\n' % (c, 0.1 * (i + j)) for j, c in enumerate(CPGS))
+                else:
+                    f.writelines('%s\t%d\n' % (g, 10 * (i + j)) for j, g in enumerate(GENES))
+            meta[modality].append('%s\t%s\t%s-01R\n' % (file_id, file_name, case))
+    for modality, rows in meta.items():
+        with open(root / (PROJECT + '_' + modality + '.csv'), 'w') as f:
+            f.write('file_id\tfile_name\tcases\n')
+            f.writelines(rows)
+
+
+class TestMatrixStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        make_project(self.projects_dir)
+        store = MatrixStore(self.store_dir)
+        project = Project(PROJECT, projects_dir=self.projects_dir)
+        store.ingest(project, 'methylation')
+        store.ingest(project, 'expression')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ingest(self):
+        store = MatrixStore(self.store_dir)
+        self.assertTrue(store.has(PROJECT, 'methylation'))
+        self.assertEqual(store.matrix(PROJECT, 'methylation').dtype, np.float32)
+        self.assertEqual(store.matrix(PROJECT, 'methylation').shape, (2, 3))
+        self.assertEqual(store.features('expression').to_list(), ['ENSG01', 'ENSG02'])
+
+    def test_get_case_data_matches_files(self):
+        from_files = Project(PROJECT, projects_dir=self.projects_dir)
+        from_store = Project(PROJECT, projects_dir=self.projects_dir, store_dir=self.store_dir)
+        for case in from_files.case_ids:
+            a = from_files.get_case_data(case, genes=['ENSG02'], cpgs=['cg0003', 'cg0001'])
+            b = from_store.get_case_data(case, genes=['ENSG02'], cpgs=['cg0003', 'cg0001'])
+            for modality in ['methylation', 'expression']:
+                self.assertEqual(a[modality].index.to_list(), b[modality].index.to_list())
+                np.testing.assert_allclose(a[modality].values, b[modality].values, rtol=1e-6)
+
+    def test_get_cases_data(self):
+        project = Project(PROJECT, projects_dir=self.projects_dir, store_dir=self.store_dir)
+        cases = project.case_ids[::-1]
+        data = project.get_cases_data(cases, genes=['ENSG01'], cpgs=['cg0002'])
+        for row, case in enumerate(cases):
+            single = project.get_case_data(case, genes=['ENSG01'], cpgs=['cg0002'])
+            self.assertEqual(data['methylation'][row, 0], single['methylation'].iloc[0, 0])
+            self.assertEqual(data['expression'][row, 0], single['expression'].iloc[0, 0])
+
+
+class TestQuantizedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        make_project(self.projects_dir)
+        self.project = Project(PROJECT, projects_dir=self.projects_dir)
+        store = MatrixStore(self.store_dir)
+        store.ingest(self.project, 'methylation', encoding='beta8')
+        store.ingest(self.project, 'expression', encoding='log16')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_codes_and_decoded_values(self):
+        store = MatrixStore(self.store_dir)
+        self.assertEqual(store.encoding('methylation').name, 'beta8')
+        self.assertEqual(store.matrix(PROJECT, 'methylation').dtype, np.uint8)
+        self.assertEqual(store.matrix(PROJECT, 'expression').dtype, np.float16)
+        from_store = Project(PROJECT, projects_dir=self.projects_dir, store_dir=self.store_dir)
+        for case in self.project.case_ids:
+            a = self.project.get_case_data(case, genes=['ENSG02'], cpgs=CPGS)
+            b = from_store.get_case_data(case, genes=['ENSG02'], cpgs=CPGS)
+            self.assertEqual(b['methylation'].values.dtype, np.float32)
+            np.testing.assert_allclose(a['methylation'].values, b['methylation'].values, atol=1 / 508)
+            np.testing.assert_allclose(a['expression'].values, b['expression'].values, rtol=5e-3)
+        codes = from_store.get_cases_data(self.project.case_ids, cpgs=CPGS, get_expr=False, decode=False)
+        self.assertEqual(codes['methylation'].dtype, np.uint8)
+
+    def test_encoding_fixed_by_first_ingest(self):
+        store = MatrixStore(self.store_dir)
+        with self.assertRaises(ValueError):
+            store.ingest(self.project, 'methylation', encoding='float32')
+        store.ingest(self.project, 'methylation')
+        self.assertEqual(store.matrix(PROJECT, 'methylation').dtype, np.uint8)
+
+    def test_beta_codec_of_expression(self):
+        with self.assertRaises(ValueError):
+            MatrixStore(self.tmp.name + '/other/').ingest(self.project, 'expression', encoding='beta8')
+
+
+if __name__ == '__main__':
+    unittest.main()
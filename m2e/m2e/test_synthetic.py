@@ -0,0 +1,48 @@
+import unittest
+import tempfile
+
+import numpy as np
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.correlation import rank_cpgs
+from m2e.sequence import pack_fasta, PromoterStore
+from m2e.synthetic import write_cohort, write_promoters, driver_probes
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projects_dir = self.tmp.name + '/projects/'
+        self.projects, self.probes, self.genes = write_cohort(self.projects_dir, n_projects=2, n_cases=6,
+                                                              n_probes=200, n_genes=20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_project_reads_cohort(self):
+        project = Project(self.projects[0], projects_dir=self.projects_dir)
+        self.assertEqual(len(project.case_ids), 6)
+        data = project.get_case_data(project.case_ids[0], genes=self.genes[:3], cpgs=self.probes[:4])
+        self.assertEqual(data['expression'].shape, (3, 1))
+        self.assertEqual(data['methylation'].shape, (4, 1))
+
+    def test_drivers_rank_first(self):
+        store = MatrixStore(self.tmp.name + '/store/')
+        for name in self.projects:
+            project = Project(name, projects_dir=self.projects_dir)
+            store.ingest(project, 'methylation')
+            store.ingest(project, 'expression')
+        ranks = rank_cpgs(store, self.projects, genes=self.genes, k=1, n_jobs=1)
+        expected = np.array(self.probes)[driver_probes(len(self.genes), len(self.probes))]
+        self.assertEqual(ranks['Meth_Probe'].to_list(), expected.tolist())
+
+    def test_promoters_pack(self):
+        path = write_promoters(self.tmp.name + '/proms.fna', ['1', '2'], length=130)
+        store = PromoterStore(pack_fasta(path, self.tmp.name + '/proms'))
+        self.assertEqual(store.encode(['1', '2']).shape, (2, 130, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import tempfile
+
+import numpy as np
+
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.training import build_lgb_dataset, halving_search
+from m2e.test_store import make_project, PROJECT, CPGS
+
+
+GENES = ['ENSG01', 'ENSG02']
+
+
+class TestLgbDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projects_dir = self.tmp.name + '/projects/'
+        self.store_dir = self.tmp.name + '/store/'
+        make_project(projects_dir)
+        self.store = MatrixStore(self.store_dir)
+        project = Project(PROJECT, projects_dir=projects_dir)
+        self.store.ingest(project, 'methylation')
+        self.store.ingest(project, 'expression')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rows_match_broadcast(self):
+        ds, cases = build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, params={'min_data_in_bin': 1})
+        self.assertEqual(ds.num_data(), 4)
+        self.assertEqual(ds.num_feature(), 3)
+        self.assertEqual(cases['case'].to_list(), ['TCGA-XX-0001-01A', 'TCGA-XX-0002-01A'])
+        expr = self.store.get(PROJECT, 'expression', features=GENES)
+        np.testing.assert_array_equal(ds.get_label(), expr.reshape(-1))
+
+    def test_cases_subset(self):
+        params = {'min_data_in_bin': 1, 'min_data_in_leaf': 1}
+        train, _ = build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, params=params)
+        valid, cases = build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, cases=['TCGA-XX-0002-01A'],
+                                         params=params, reference=train)
+        self.assertEqual(valid.num_data(), 2)
+        self.assertEqual(cases['case'].to_list(), ['TCGA-XX-0002-01A'])
+        np.testing.assert_array_equal(valid.get_label(),
+                                      self.store.get(PROJECT, 'expression', ['TCGA-XX-0002-01A'], GENES).reshape(-1))
+
+    def test_quantized_store(self):
+        store_dir = self.tmp.name + '/beta8/'
+        project = Project(PROJECT, projects_dir=self.tmp.name + '/projects/')
+        MatrixStore(store_dir).ingest(project, 'methylation', encoding='beta8')
+        MatrixStore(store_dir).ingest(project, 'expression')
+        ds, _ = build_lgb_dataset(store_dir, [PROJECT], GENES, CPGS, params={'min_data_in_bin': 1})
+        self.assertEqual(ds.num_data(), 4)
+        meth = MatrixStore(store_dir).get(PROJECT, 'methylation', features=CPGS)
+        np.testing.assert_allclose(meth, self.store.get(PROJECT, 'methylation', features=CPGS), atol=1 / 508)
+
+    def test_memory_budget(self):
+        with self.assertRaises(MemoryError):
+            build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, memory_budget=16)
+
+    def test_halving_search_resumes(self):
+        params = {'min_data_in_bin': 1}
+        train_path, valid_path = self.tmp.name + '/train.bin', self.tmp.name + '/valid.bin'
+        checkpoint = self.tmp.name + '/search.jsonl'
+        train, _ = build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, params=params, binary_path=train_path)
+        build_lgb_dataset(self.store_dir, [PROJECT], GENES, CPGS, params=params, reference=train,
+                          binary_path=valid_path)
+        space = {'num_leaves': [2, 3], 'min_child_samples': [1, 2]}
+        kwargs = dict(n_iter=4, min_rounds=2, max_rounds=6, eta=2, n_jobs=2, threads_per_job=1,
+                      dataset_params=params, checkpoint=checkpoint)
+        best, results = halving_search(train_path, valid_path, space, **kwargs)
+        self.assertIn('n_estimators', best)
+        self.assertEqual(set(results['rounds']), {2, 4, 6})
+        with open(checkpoint) as f:
+            n_lines = len(f.readlines())
+
+        resumed, _ = halving_search(train_path, valid_path, space, **kwargs)
+        self.assertEqual(best, resumed)
+        with open(checkpoint) as f:
+            self.assertEqual(len(f.readlines()), n_lines)
@@ -0,0 +1,307 @@
+"""
+Out-of-core LightGBM training data streamed from the matrix store.
+
+The experiment's rows are (case, gene) pairs whose features are the case's
+CpG betas broadcast over genes, so the dense table grows with cases x genes.
+Here it is never materialized: every project is a lightgbm.Sequence that
+produces the broadcast rows of a slice on demand from the case's CpG vector,
+LightGBM bins a row sample and then pushes the rows batch by batch, and only
+the binned Dataset (about one byte per row and CpG) and the labels stay in
+memory. The constructed Dataset is reused by every model of a search.
+
+halving_search evaluates candidates by successive halving on a process
+pool whose workers load the binned Datasets once from binary files, and
+checkpoints every evaluation so an interrupted search resumes.
+
+Reads and batches are sized by a memory budget in bytes; a cohort whose
+binned Dataset alone would not fit is rejected before anything is read.
+CpG vectors stay in the store's encoding (e.g. uint8 betas, m2e.quantize)
+and only pushed batches are decoded to float32.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import numbers
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from m2e.store import MatrixStore
+from m2e.quantize import Codec, FLOAT32
+from m2e.profiling import profiled, stage
+
+
+MEMORY_BUDGET = 4 << 30  # bytes
+BIN_BYTES = 1  # binned bytes per row and feature (max_bin <= 255)
+# parameters fixing the binning of a constructed Dataset; not searchable
+DATASET_PARAMS = ('max_bin', 'min_data_in_bin', 'bin_construct_sample_cnt', 'feature_pre_filter')
+
+
+def read_rows(store: MatrixStore, project: str, modality: str, rows: np.ndarray, cols: np.ndarray,
+              memory_budget: int = MEMORY_BUDGET) -> np.ndarray:
+    """
+    (rows x cols) block of a project's matrix, of codes of the store's
+    encoding, read in row chunks of only cols that fit in memory_budget / 4.
+    """
+    m = store.matrix(project, modality)
+    chunk = max(1, memory_budget // 4 // (max(1, len(cols)) * m.itemsize))
+    out = np.empty((len(rows), len(cols)), dtype=m.dtype)
+    order = np.argsort(rows, kind='stable')  # sequential reads
+    for start in range(0, len(rows), chunk):
+        sel = order[start:start + chunk]
+        out[sel] = m[np.ix_(rows[sel], cols)]
+    return out
+
+
+class CohortSequence(lgb.Sequence):
+    """
+    Broadcast (case, gene) x CpG rows of one project, case-major: row i is
+    gene i % n_genes of case i // n_genes, with the case's CpG betas.
+    """
+
+    def __init__(self, meth: np.ndarray, n_genes: int, batch_size: int = lgb.Sequence.batch_size,
+                 codec: Codec = FLOAT32):
+        '''
+        :params
+            meth -- (cases x CpGs) betas, as codes of codec
+            n_genes -- genes per case
+            batch_size -- rows pushed to LightGBM at once
+            codec -- encoding of meth, decoded to float32 per batch
+        '''
+        self.meth = meth
+        self.n_genes = n_genes
+        self.batch_size = batch_size
+        self.codec = codec
+
+    def __len__(self):
+        return self.meth.shape[0] * self.n_genes
+
+    def __getitem__(self, idx):
+        if isinstance(idx, numbers.Integral):
+            # single rows are LightGBM's bin sample, which it takes as float64
+            return self.codec.decode(self.meth[idx // self.n_genes]).astype(np.float64)
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(len(self)))
+        return self.codec.decode(self.meth[np.asarray(idx) // self.n_genes])
+
+
+def dataset_bytes(n_rows: int, n_features: int) -> int:
+    """Approximate memory of a constructed Dataset: bins and float32 labels."""
+    return n_rows * (n_features * BIN_BYTES + 4)
+
+
+@profiled('training.build_dataset')
+def build_lgb_dataset(store_dir, projects, genes, cpgs, cases=None, memory_budget: int = MEMORY_BUDGET,
+                      params: dict = None, reference: lgb.Dataset = None, binary_path=None):
+    """
+    Streams the (case, gene) x CpG cohort of ingested projects into a
+    constructed LightGBM Dataset.
+
+    Args:
+        store_dir: matrix store with methylation and expression of projects.
+        genes: expression feature ids (labels).
+        cpgs: CpG ids (features).
+        cases: case ids to include (e.g. a train split). if None: all cases.
+        memory_budget: bytes for the Dataset plus reading buffers.
+        params: LightGBM dataset parameters, e.g. {'max_bin': 63}. Features are
+                not pre-filtered by default, so min_data_in_leaf stays searchable.
+        reference: training Dataset whose bins a validation Dataset reuses.
+        binary_path: if set, the binned Dataset is also saved here
+                     (lgb.Dataset(binary_path) reloads it without the store).
+
+    Returns:
+        2-tuple of the constructed Dataset and a DataFrame of its cases
+        (project, case), in row order.
+    """
+    store = MatrixStore(store_dir)
+    expr_cols = store.feature_positions('expression', genes)
+    cpg_cols = store.feature_positions('methylation', cpgs)
+    codec = store.encoding('methylation')
+
+    frames = []
+    for project in projects:
+        project_cases = store.cases(project, 'methylation')
+        project_cases = project_cases[project_cases.isin(store.cases(project, 'expression'))]
+        if cases is not None:
+            project_cases = project_cases[project_cases.isin(cases)]
+        frames.append(pd.DataFrame({'project': project, 'case': project_cases}))
+    row_cases = pd.concat(frames, ignore_index=True)
+
+    n_rows = len(row_cases) * len(genes)
+    needed = dataset_bytes(n_rows, len(cpgs)) + len(row_cases) * len(cpgs) * codec.itemsize
+    if needed > memory_budget:
+        raise MemoryError("Dataset of %d rows x %d CpGs needs ~%d MB, over the budget of %d MB."
+                          % (n_rows, len(cpgs), needed >> 20, memory_budget >> 20))
+    # what is left of the budget goes to reading buffers and pushed batches
+    spare = memory_budget - needed
+    batch_size = int(max(len(genes), min(1 << 20, spare // 4 // (len(cpgs) * 4 + 1))))
+
+    labels = np.empty(n_rows, dtype=np.float32)
+    seqs, row = [], 0
+    for project, df in row_cases.groupby('project', sort=False):
+        with stage('training.read_store') as s:
+            expr = read_rows(store, project, 'expression',
+                             store.case_positions(project, 'expression', df['case']), expr_cols, spare)
+            meth = read_rows(store, project, 'methylation',
+                             store.case_positions(project, 'methylation', df['case']), cpg_cols, spare)
+            s.add(rows=len(df), bytes=expr.nbytes + meth.nbytes)
+        labels[row:row + expr.size] = store.decode('expression', expr).reshape(-1)
+        row += expr.size
+        seqs.append(CohortSequence(meth, len(genes), batch_size, codec))
+        logging.info("%s: %d cases streamed" % (project, len(df)))
+
+    params = dict({'feature_pre_filter': False, 'verbosity': -1}, **(params or {}))
+    ds = lgb.Dataset(seqs, label=labels, feature_name=list(cpgs), params=params,
+                     reference=reference, free_raw_data=True)
+    with stage('training.bin') as s:
+        ds.construct()
+        s.add(rows=n_rows)
+    if binary_path is not None:
+        # LightGBM does not overwrite binary files
+        tmp_path = str(binary_path) + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        ds.save_binary(tmp_path)
+        os.replace(tmp_path, binary_path)
+    return ds, row_cases
+
+
+def random_params(space: dict, n_iter: int, seed: int = 0) -> list:
+    """
+    n_iter parameter sets drawn from space: name -> list of values or a
+    scipy.stats distribution (anything with rvs()).
+    """
+    rng = np.random.RandomState(seed)
+    draws = []
+    for _ in range(n_iter):
+        params = {}
+        for name, values in space.items():
+            assert name not in DATASET_PARAMS, name + " is fixed by the constructed Dataset"
+            if hasattr(values, 'rvs'):
+                value = values.rvs(random_state=rng)
+            else:
+                value = values[rng.randint(len(values))]
+            params[name] = value.item() if isinstance(value, np.generic) else value
+        draws.append(params)
+    return draws
+
+
+# binned Datasets of a search worker process, loaded once by init_search_worker_
+_SEARCH_DATA = {}
+
+
+def init_search_worker_(train_path, valid_path, dataset_params=None):
+    params = dict({'feature_pre_filter': False, 'verbosity': -1}, **(dataset_params or {}))
+    train = lgb.Dataset(str(train_path), params=params).construct()
+    valid = lgb.Dataset(str(valid_path), reference=train, params=params).construct()
+    _SEARCH_DATA['train'], _SEARCH_DATA['valid'] = train, valid
+
+
+def fit_candidate_(params: dict, rounds: int, early_stopping_rounds: int) -> dict:
+    """Trains one candidate for up to rounds on the worker's Datasets."""
+    evals = {}
+    booster = lgb.train(params, _SEARCH_DATA['train'], num_boost_round=rounds,
+                        valid_sets=[_SEARCH_DATA['valid']], valid_names=['valid'],
+                        callbacks=[lgb.record_evaluation(evals),
+                                   lgb.early_stopping(early_stopping_rounds, verbose=False)])
+    best_iteration = booster.best_iteration or rounds
+    return {'l2': float(evals['valid']['l2'][best_iteration - 1]), 'best_iteration': int(best_iteration)}
+
+
+def data_digest(*paths) -> str:
+    """Digest of the binary Datasets a search evaluates on."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                digest.update(data)
+    return digest.hexdigest()[:16]
+
+
+def read_checkpoint(path, data: str) -> dict:
+    """
+    (params json, rounds) -> record of a search checkpoint, for records of
+    the Datasets with digest data; torn last lines are skipped.
+    """
+    done = {}
+    if path is None or not os.path.isfile(path):
+        return done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('data') != data:
+                continue
+            done[(json.dumps(record['params'], sort_keys=True), record['rounds'])] = record
+    return done
+
+
+@profiled('training.search')
+def halving_search(train_path, valid_path, space: dict, n_iter: int = 27, min_rounds: int = 50,
+                   max_rounds: int = 1350, eta: int = 3, early_stopping_rounds: int = 20,
+                   n_jobs: int = None, threads_per_job: int = 2, base_params: dict = None,
+                   dataset_params: dict = None, checkpoint=None, seed: int = 0):
+    """
+    Successive-halving search over LGBMRegressor parameters.
+
+    All n_iter candidates are trained for min_rounds boosting rounds (with
+    early stopping on the validation Dataset), the best 1/eta are trained
+    for eta times more rounds, and so on up to max_rounds. Candidates run
+    concurrently on n_jobs processes of threads_per_job LightGBM threads
+    each; every process loads the binned Datasets saved by build_lgb_dataset
+    (binary_path) once, so nothing is rebinned.
+
+    Args:
+        train_path, valid_path: binary Datasets, the validation one built
+            with the training Dataset as reference.
+        space: parameter name -> values or distribution (see random_params).
+        dataset_params: params the Datasets were built with (build_lgb_dataset).
+        checkpoint: JSONL file recording every evaluation; evaluations found
+            in it for the same Datasets are not repeated.
+
+    Returns:
+        2-tuple of the best parameters, with n_estimators set to the best
+        iteration, and a DataFrame of all evaluations.
+    """
+    if n_jobs is None:
+        n_jobs = max(1, (os.cpu_count() or 1) // threads_per_job)
+    base_params = dict({'objective': 'regression', 'metric': 'l2', 'verbosity': -1}, **(base_params or {}))
+    base_params['num_threads'] = threads_per_job
+    candidates = random_params(space, n_iter, seed)
+    keys = [json.dumps(params, sort_keys=True) for params in candidates]
+    data = data_digest(train_path, valid_path)
+    done = read_checkpoint(checkpoint, data)
+
+    survivors, rounds = list(range(n_iter)), min_rounds
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_search_worker_,
+                             initargs=(train_path, valid_path, dataset_params)) as pool:
+        while True:
+            futures = {pool.submit(fit_candidate_, dict(base_params, **candidates[c]), rounds,
+                                   early_stopping_rounds): c
+                       for c in survivors if (keys[c], rounds) not in done}
+            for future in as_completed(futures):
+                c = futures[future]
+                record = dict(future.result(), params=candidates[c], rounds=rounds, data=data)
+                done[(keys[c], rounds)] = record
+                if checkpoint is not None:
+                    with open(checkpoint, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+            logging.info("halving: %d candidates at %d rounds" % (len(survivors), rounds))
+
+            survivors = sorted(survivors, key=lambda c: done[(keys[c], rounds)]['l2'])
+            if rounds >= max_rounds or len(survivors) == 1:
+                break
+            survivors = survivors[:max(1, len(survivors) // eta)]
+            rounds = min(rounds * eta, max_rounds)
+
+    best = done[(keys[survivors[0]], rounds)]
+    results = pd.DataFrame([dict(r['params'], l2=r['l2'], rounds=r['rounds'],
+                                 best_iteration=r['best_iteration'])
+                            for key, r in done.items() if key[0] in keys])
+    return dict(best['params'], n_estimators=best['best_iteration']), results
@@ -1,12 +1,12 @@
 import os
-import logging
 import json
-
-from pybedtools import BedTool
-from pybedtools.featurefuncs import five_prime
-from pybedtools.cbedtools import create_interval_from_list
+import logging
 
 from m2e.func_utils import get_cpgs, get_genome, get_gff
+from m2e.sequence import pack_fasta, write_windows
+from m2e.gff import (read_gff_genes, promoter_windows, widest_window, dedup_genes,
+                     write_gff, genes_json, extract_promoter_windows, write_fasta)
+from m2e.build import Stage, BuildGraph
 from m2e.config import configs
 
 
@@ -20,12 +20,20 @@ GENOME_SEQ_PATH = os.path.join(GENOMICS_DIR, configs["names"]["genome_seq"])
 CPG_PATH = os.path.join(GENOMICS_DIR, configs['names']['cpgs'])
 
 UPSTREAM_LENGTH = configs['params']['upstream_len']
+DOWNSTREAM_LENGTH = configs['params'].get('downstream_len', 0)
 CHROMOSOMES = configs['params']['chromosomes']
+# (upstream, downstream) promoter windows, all served from one extraction of the widest:
+# the upstream_len/downstream_len window plus any extra 'windows' of the config
+WINDOWS = sorted({(UPSTREAM_LENGTH, DOWNSTREAM_LENGTH)} | {tuple(w) for w in configs['params'].get('windows', [])})
+N_JOBS = 3  # concurrent stages, e.g. the three downloads
 
 ### outputs
 GENES_GFF_PATH = os.path.join(GENOMICS_DIR, configs['names']['genome_genes_gff'])
 PROMS_GFF_PATH = os.path.join(GENOMICS_DIR, configs['names']['proms_gff'])
 PROMS_SEQ_PATH = os.path.join(GENOMICS_DIR, configs['names']['proms_seq'])
+PROMS_STORE_DIR = os.path.join(GENOMICS_DIR, configs['names']['proms_store'])
+GENES_JSON_PATH = os.path.join(GENOMICS_DIR, "genes.json")
+BUILD_DIR = os.path.join(GENOMICS_DIR, ".build")  # content-addressed artifacts, linked into GENOMICS_DIR
 
 # log
 
@@ -39,77 +47,66 @@ logging.basicConfig(filename=logfile,
                     datefmt='%m/%d/%Y %I:%M:%S %p')
 
 
-def add_geneIDs(bed):
-    """ Add gene features to name field of gff for rendering fasta/tab sequence files with gene ids in headers."""
-    new_intervals = []
-    genes_data = {}
-    for interval in bed:
-        new_fields = interval.fields[:]
-        #new_fields[2] = interval.name.split(":")[1] + "_promoter"
-        
-        gene_id = interval.attrs['Dbxref'].split(",")[0].split(":")[-1]
-        
-        if gene_id in genes_data.keys():
-            continue
-            
-        new_fields[2] = gene_id
-        new_interval = create_interval_from_list(new_fields)
-        new_intervals.append(new_interval)
-        
-        # Record gene_data
-        gene_chr = interval[0]
-        gene_start = interval[3]
-        gene_end = interval[4]
-        gene_strand = interval[6]
-        genes_data[gene_id] = {'GeneID': gene_id,
-                               'chr': gene_chr,
-                               'start': gene_start,
-                               'end': gene_end,
-                               'strand': gene_strand}
-    
-    return BedTool(new_intervals), genes_data
+def build_genome(out_dir, inputs, url):
+    get_genome(url, str(out_dir) + "/")
 
 
-if __name__ == "__main__":
-    
+def build_gff(out_dir, inputs, url):
+    get_gff(url, str(out_dir) + "/")
 
-    # check availability of genome sequence and genome annotations(gff)
-    if not os.path.isfile(GENOME_SEQ_PATH):
-        logging.info("Downloading genome sequence at " + GENOME_SEQ_PATH)
-        get_genome(GENOME_URL, GENOMICS_DIR)
-
-    if not os.path.isfile(GENOME_GFF_PATH):
-        logging.info("Downloading genome gff at " + GENOME_GFF_PATH)
-        get_gff(GFF_URL, GENOMICS_DIR)
-
-    if not os.path.isfile(CPG_PATH):
-        logging.info("Downloading CpG metadata at " + CPG_PATH)
-        get_cpgs(CPG_URL, GENOMICS_DIR)
-
-    # derive promoter gff and extract sequences from genome
-    if os.path.isfile(PROMS_GFF_PATH):
-        proms_bed = BedTool(PROMS_GFF_PATH)
-        logging.info("Found proms gff at " + PROMS_GFF_PATH)
-    else:
-        # point to genome gff3
-        genome_bed = BedTool(GENOME_GFF_PATH)
-    
-        # filter for genes
-        genes_bed = ( genome_bed.filter(lambda x: (x[2] == 'gene') and (x.chrom in CHROMOSOMES))
-                      .saveas(GENES_GFF_PATH) )
-        logging.info("Extracted # genes = " + str(len(genes_bed)) + ", saved at " + GENES_GFF_PATH)
-    
-        # extract promoters from genes features
-        proms_bed = genes_bed.each(func=five_prime, upstream=UPSTREAM_LENGTH, downstream=0)
-        proms_bed, genes_data = add_geneIDs(proms_bed)
-        
-        with open(GENOMICS_DIR + "genes.json", 'w+') as f:
-            json.dump(genes_data, f)
-        proms_bed.saveas(PROMS_GFF_PATH)
-        
-        logging.info("Extracted # promoters = " + str(len(proms_bed)) + ", saved at " + PROMS_GFF_PATH)
+
+def build_cpgs(out_dir, inputs, url):
+    get_cpgs(url, str(out_dir) + "/")
+
+
+def build_genes(out_dir, inputs, chromosomes):
+    genes = read_gff_genes(inputs['gff'][configs['names']['genome_complete_gff']], chromosomes)
+    write_gff(genes, out_dir / configs['names']['genome_genes_gff'])
+    logging.info("Extracted # genes = " + str(len(genes)))
+
+
+def build_promoters(out_dir, inputs, windows):
+    genes = read_gff_genes(inputs['genes'][configs['names']['genome_genes_gff']])
+    proms = dedup_genes(promoter_windows(genes, *widest_window(windows))).reset_index(drop=True)
+    write_gff(proms, out_dir / configs['names']['proms_gff'], type_col='GeneID')
+    with open(out_dir / "genes.json", 'w+') as f:
+        json.dump(genes_json(proms), f)
+    logging.info("Extracted # promoters = " + str(len(proms)))
+
+
+def build_promoter_seqs(out_dir, inputs, windows):
+    genes = read_gff_genes(inputs['genes'][configs['names']['genome_genes_gff']])
+    proms, seqs, views = extract_promoter_windows(genes, inputs['genome'][configs['names']['genome_seq']], windows)
+    seq_path = out_dir / configs['names']['proms_seq']
+    write_fasta(proms['GeneID'] + '(' + proms['strand'] + ')', seqs, seq_path)
     
-    # extract sequences defined by promoter features
-    proms_seqs = proms_bed.sequence(fi=GENOME_SEQ_PATH, fo=PROMS_SEQ_PATH, s=True, fullHeader=False, name=True)
+    # pack sequences for memory-mapped batched encoding (m2e.sequence.PromoterStore),
+    # narrower windows as views: PromoterStore(proms_store, window=(upstream, downstream))
+    store_dir = pack_fasta(seq_path, out_dir / configs['names']['proms_store'])
+    write_windows(store_dir, views)
+
+
+def genomics_graph() -> BuildGraph:
+    """
+    Genomics artifacts and their dependencies. Each stage is keyed by its
+    parameters and inputs, so e.g. new promoter windows rebuild only the
+    promoter stages. proms.gff, genes.json and proms.fna hold the widest window.
+    """
+    names = configs['names']
+    graph = BuildGraph(BUILD_DIR, link_dir=GENOMICS_DIR)
+    graph.add(Stage("genome", build_genome, [names['genome_seq']], params={'url': GENOME_URL}, adopt=True))
+    graph.add(Stage("gff", build_gff, [names['genome_complete_gff']], params={'url': GFF_URL}, adopt=True))
+    graph.add(Stage("cpgs", build_cpgs, [names['cpgs']], params={'url': CPG_URL}, adopt=True))
+    graph.add(Stage("genes", build_genes, [names['genome_genes_gff']], inputs=["gff"],
+                    params={'chromosomes': CHROMOSOMES}))
+    graph.add(Stage("promoters", build_promoters, [names['proms_gff'], "genes.json"], inputs=["genes"],
+                    params={'windows': WINDOWS}))
+    graph.add(Stage("promoter_seqs", build_promoter_seqs, [names['proms_seq'], names['proms_store']],
+                    inputs=["genes", "genome"], params={'windows': WINDOWS}))
+    return graph
+
+
+if __name__ == "__main__":
     
-    logging.info("Extracted prom seqs. Saved at " + PROMS_SEQ_PATH)
\ No newline at end of file
+    status = genomics_graph().run(n_jobs=N_JOBS)
+    logging.info("Genomics build: " + json.dumps(status))
@@ -0,0 +1,44 @@
+"""
+One-time ingest of TCGA projects' methylation and expression files
+ into the columnar matrix store (see m2e.store).
+ Projects already present in the store are skipped.
+ ENCODINGS sets the codecs a new store is ingested with (see m2e.quantize),
+ e.g. 'beta8' for betas at a quarter of the float32 size (error <= 2e-3)
+ and 'log16' for expression at half of it (relative error <= 0.5% below 2.7e4).
+"""
+
+import os
+import sys
+import logging
+from pathlib import Path
+
+from m2e.config import configs
+from m2e.project import Project, PROJECTS_DIR
+from m2e.store import MatrixStore, MODALITIES
+
+
+STORE_DIR = configs["dirs"]["store"]
+ENCODINGS = {'methylation': 'float32', 'expression': 'float32'}
+
+logfile = os.path.join(configs['dirs']['log'], 'store_ingest.log')
+logging.basicConfig(filename=logfile,
+                    filemode = 'a',
+                    level=logging.INFO, 
+                    format='%(asctime)s %(message)s', 
+                    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+
+if __name__ == "__main__":
+    
+    projects = sys.argv[1:] or sorted(p.name for p in Path(PROJECTS_DIR).iterdir() if p.is_dir())
+    store = MatrixStore(STORE_DIR)
+    
+    for name in projects:
+        project = None
+        for modality in MODALITIES:
+            if store.has(name, modality):
+                logging.info("Found " + modality + " of " + name + " in store, skipping")
+                continue
+            project = project or Project(name)
+            path = store.ingest(project, modality, encoding=ENCODINGS[modality])
+            logging.info("Ingested " + modality + " of " + name + " (" + str(len(project.case_ids)) + " cases) at " + str(path))
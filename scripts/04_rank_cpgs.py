@@ -0,0 +1,46 @@
+"""
+Ranks CpGs by correlation with each gene's expression across the cases
+ of the selected projects (all projects of the store by default), keeping
+ the top TOP_K probes per gene. Requires the columnar store (03_ingest_store.py).
+
+Usage: python 04_rank_cpgs.py [pearson|spearman] [project ...]
+"""
+
+import os
+import sys
+import logging
+from pathlib import Path
+
+from m2e.config import configs
+from m2e.store import MatrixStore
+from m2e.correlation import rank_cpgs, METHODS
+
+
+TOP_K = 50
+STORE_DIR = configs["dirs"]["store"]
+OUT_DIR = os.path.join(configs["dirs"]["data"], "analysis")
+
+logfile = os.path.join(configs['dirs']['log'], 'cpg_ranking.log')
+logging.basicConfig(filename=logfile,
+                    filemode = 'a',
+                    level=logging.INFO, 
+                    format='%(asctime)s %(message)s', 
+                    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+
+if __name__ == "__main__":
+    
+    method = sys.argv[1] if len(sys.argv) > 1 else "pearson"
+    assert method in METHODS
+    store = MatrixStore(STORE_DIR)
+    projects = sys.argv[2:] or sorted(p.name for p in Path(STORE_DIR).iterdir()
+                                      if p.is_dir() and store.has(p.name, 'methylation')
+                                      and store.has(p.name, 'expression'))
+    
+    logging.info("Ranking CpGs (" + method + ") over " + str(len(projects)) + " projects")
+    df = rank_cpgs(store, projects, k=TOP_K, method=method)
+    
+    os.makedirs(OUT_DIR, exist_ok=True)
+    out_path = os.path.join(OUT_DIR, "cpg_gene_corr_" + method + ".tsv")
+    df.to_csv(out_path, sep='\t', index=False)
+    logging.info("Saved top " + str(TOP_K) + " CpGs of " + str(df['Gene'].nunique()) + " genes at " + out_path)
@@ -0,0 +1,37 @@
+"""
+Verifies that the probe annotation columns of TCGA methylation files are
+ identical across samples and compacts the files to their betas plus one
+ shared annotation table per distinct annotation (see m2e.compaction).
+ Project and the store ingest read compacted files transparently.
+
+Usage: python 05_compact_methylation.py [project ...]
+"""
+
+import os
+import sys
+import logging
+from pathlib import Path
+
+from m2e.config import configs
+from m2e.project import Project, PROJECTS_DIR
+from m2e.compaction import compact_project
+
+
+ANNOTATION_DIR = os.path.join(configs["dirs"]["genomics"], "probe_annotation")
+N_JOBS = -1  # hashing and rewriting workers, -1 for all cores
+
+logfile = os.path.join(configs['dirs']['log'], 'compact_methylation.log')
+logging.basicConfig(filename=logfile,
+                    filemode = 'a',
+                    level=logging.INFO, 
+                    format='%(asctime)s %(message)s', 
+                    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+
+if __name__ == "__main__":
+    
+    projects = sys.argv[1:] or sorted(p.name for p in Path(PROJECTS_DIR).iterdir() if p.is_dir())
+    for name in projects:
+        files = compact_project(Project(name, lazy=True), ANNOTATION_DIR, n_jobs=N_JOBS)
+        logging.info(name + ": " + str(len(files)) + " files, annotation digests "
+                     + str(files['digest'].str[:16].value_counts().to_dict()))
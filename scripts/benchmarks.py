@@ -0,0 +1,175 @@
+"""
+Benchmarks of the data-loading and dataset-building hot paths on synthetic
+ TCGA-shaped cohorts (m2e.synthetic), at several scales.
+
+Every benchmark runs in a fresh process, so its peak memory (max RSS) is its
+ own; throughput and peak memory are printed and appended to RESULTS with
+ the commit they were measured at, for comparison between releases.
+ Cohorts are generated once per scale under BENCH_DIR and reused.
+
+Usage: python benchmarks.py [scale ...]   (default: small)
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from m2e.config import configs
+from m2e.project import Project
+from m2e.store import MatrixStore
+from m2e.correlation import rank_cpgs
+from m2e.sequence import pack_fasta, PromoterStore
+from m2e.synthetic import write_cohort, write_promoters
+from expr_meth_pred import build_dataset
+
+
+SCALES = {'small': dict(n_projects=2, n_cases=20, n_probes=20000, n_genes=2000),
+          'medium': dict(n_projects=4, n_cases=50, n_probes=100000, n_genes=20000),
+          'large': dict(n_projects=8, n_cases=100, n_probes=485577, n_genes=60483)}
+NUM_GENES = 100  # genes of get_case_data and build_dataset
+NUM_METH = 50  # CpGs of get_case_data and build_dataset
+PROMOTER_LEN = 1000
+BATCH_SIZE = 256  # promoters per encoded batch
+SEED = 0
+
+BENCH_DIR = Path(configs["dirs"]["data"]) / "benchmarks"
+RESULTS = BENCH_DIR / "results.jsonl"
+
+
+class Cohort(object):
+    """Synthetic cohort of a scale, generated on first use."""
+
+    def __init__(self, scale: str):
+        self.scale = scale
+        self.dir = BENCH_DIR / scale
+        self.projects_dir = str(self.dir / "projects") + "/"
+        self.store_dir = str(self.dir / "store")
+        self.fasta = self.dir / "proms.fna"
+        self.proms_dir = self.dir / "proms_store"
+        ids = self.dir / "ids.json"
+        if not ids.is_file():
+            self.dir.mkdir(parents=True, exist_ok=True)
+            projects, probes, genes = write_cohort(self.projects_dir, seed=SEED, **SCALES[scale])
+            write_promoters(self.fasta, [str(i) for i in range(len(genes))], PROMOTER_LEN, seed=SEED)
+            with open(ids, 'w') as f:
+                json.dump({'projects': projects, 'probes': probes, 'genes': genes}, f)
+        with open(ids, 'r') as f:
+            self.__dict__.update(json.load(f))
+        rng = np.random.RandomState(SEED)
+        self.sample_genes = list(rng.choice(self.genes, NUM_GENES, replace=False))
+        self.sample_cpgs = list(rng.choice(self.probes, NUM_METH, replace=False))
+
+    @property
+    def n_cases(self) -> int:
+        return len(self.projects) * SCALES[self.scale]['n_cases']
+
+
+def bench_project_init(cohort: Cohort):
+    for name in cohort.projects:
+        Project(name, projects_dir=cohort.projects_dir)
+    return cohort.n_cases, 'cases'
+
+
+def bench_get_case_data(cohort: Cohort):
+    project = Project(cohort.projects[0], projects_dir=cohort.projects_dir)
+    for case in project.case_ids:
+        project.get_case_data(case, genes=cohort.sample_genes, cpgs=cohort.sample_cpgs)
+    return len(project.case_ids), 'cases'
+
+
+def bench_build_dataset(cohort: Cohort, **kwargs):
+    df = build_dataset(cohort.projects, cohort.sample_genes, cohort.sample_cpgs,
+                       projects_dir=cohort.projects_dir, **kwargs)
+    assert len(df) == cohort.n_cases * NUM_GENES
+    return len(df), 'rows'
+
+
+def bench_build_dataset_parallel(cohort: Cohort):
+    return bench_build_dataset(cohort, n_jobs=-1, backend="process")
+
+
+def bench_ingest(cohort: Cohort):
+    shutil.rmtree(cohort.store_dir, ignore_errors=True)
+    store = MatrixStore(cohort.store_dir)
+    for name in cohort.projects:
+        project = Project(name, projects_dir=cohort.projects_dir)
+        for modality in ('methylation', 'expression'):
+            store.ingest(project, modality)
+    return cohort.n_cases, 'cases'
+
+
+def bench_build_dataset_store(cohort: Cohort):
+    return bench_build_dataset(cohort, store_dir=cohort.store_dir)
+
+
+def bench_rank_cpgs(cohort: Cohort):
+    ranks = rank_cpgs(MatrixStore(cohort.store_dir), cohort.projects, genes=cohort.sample_genes)
+    assert ranks['Gene'].nunique() == NUM_GENES
+    return NUM_GENES * len(cohort.probes), 'gene-probe pairs'
+
+
+def bench_encode_promoters(cohort: Cohort):
+    store = PromoterStore(pack_fasta(cohort.fasta, cohort.proms_dir))
+    names = [str(i) for i in range(len(cohort.genes))]
+    for start in range(0, len(names), BATCH_SIZE):
+        store.encode(names[start:start + BATCH_SIZE])
+    return len(names), 'promoters'
+
+
+# in order: the store benchmarks read the store bench_ingest writes
+BENCHMARKS = [bench_project_init, bench_get_case_data, bench_build_dataset, bench_build_dataset_parallel,
+              bench_ingest, bench_build_dataset_store, bench_rank_cpgs, bench_encode_promoters]
+
+
+def measure(bench, scale: str) -> dict:
+    """
+    Runs bench in the calling (fresh) process: seconds, items, and peak RSS
+    before (imports) and after the run.
+    """
+    cohort = Cohort(scale)
+    # ru_maxrss is in KB on Linux
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    items, unit = bench(cohort)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'benchmark': bench.__name__[len('bench_'):], 'scale': scale, 'seconds': seconds,
+            'items': items, 'unit': unit, 'throughput': items / seconds,
+            'base_mb': base, 'peak_mb': peak}
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+
+    scales = sys.argv[1:] or ['small']
+    assert all(s in SCALES for s in scales), "Scales: " + ", ".join(SCALES)
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    tag = {'commit': commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'cpus': os.cpu_count()}
+
+    for scale in scales:
+        Cohort(scale)  # generated outside the measurements
+        for bench in BENCHMARKS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = dict(tag, **pool.submit(measure, bench, scale).result())
+            print("%-8s %-24s %9.2f s %14.1f %s/s %9.1f MB peak (+%.1f MB)"
+                  % (scale, result['benchmark'], result['seconds'], result['throughput'],
+                     result['unit'], result['peak_mb'], result['peak_mb'] - result['base_mb']))
+            with open(RESULTS, 'a') as f:
+                f.write(json.dumps(result) + '\n')
@@ -2,8 +2,13 @@
 Script for running the experiment on predicting gene expression
  from methylation of CpG sites based on sites found to have the
  highest correlation with individual genes' expressions.
+
+Run with M2E_PROFILE=<report.json> to write seconds, rows and bytes per
+ stage and the peak RSS of the run as JSON (m2e.profiling).
 """
 
+import logging
+from functools import partial
 from pathlib import Path
 from typing import List, Tuple
 
@@ -12,43 +17,67 @@ import pandas as pd
 import lightgbm as lgb
 from sklearn.model_selection import RandomizedSearchCV
 
-from m2e.project import Project
+from m2e.project import Project, PROJECTS_DIR
+from m2e.index import CaseIndex
+from m2e.parallel import ordered_map, Progress
+from m2e.gene_ids import gene_id_map
+from m2e.training import build_lgb_dataset, halving_search
+from m2e.splits import smallest_projects_split, leave_project_out, grouped_kfold, grouped_holdout
+from m2e.inference import ModelArtifact
+from m2e.cache import CohortCache
+from m2e.profiling import profiled, stage
 
 
 # input
 NUM_METH = 50  # top 50 with predictive power
 NUM_GENES = 100  # num samples = (this) * nr_cases
 SEARCH_SPACE = None
+N_JOBS = -1  # case loading workers, -1 for all cores
+BACKEND = "thread"  # "thread" or "process"
+TRAIN_MODE = "streaming"  # "streaming" from the store, or "in_memory" DataFrame
+MEMORY_BUDGET = 8 << 30  # bytes for the streamed training Dataset
+# LGBMRegressor parameters searched by successive halving
+STREAM_SEARCH_SPACE = {'num_leaves': [15, 31, 63, 127],
+                       'learning_rate': [0.02, 0.05, 0.1],
+                       'min_child_samples': [20, 100, 500],
+                       'colsample_bytree': [0.5, 0.8, 1.0]}
+N_ITER = 27
+SPLIT = "projects"  # "projects" (17 smallest held out), "kfold" or "leave_project_out"
+K_FOLDS = 5
+VALID_FRACTION = 0.2  # of a split's train cases, for early stopping and the search
+THREADS_PER_JOB = 2  # LightGBM threads per search process
 
 # const
 DATA_PATH = Path("data/")
 LOOKUP_PATH = DATA_PATH / "genomics/gene_id_lookup.csv"
+STORE_DIR = DATA_PATH / "store"
+SEARCH_DIR = DATA_PATH / "search"  # binned Datasets and search checkpoint
+MODELS_DIR = DATA_PATH / "models"  # model artifacts for predict_expr.py
 CPG_CORR_PATH = DATA_PATH / "broad_tcga/analysis/gdac.broadinstitute.org_STAD-TP.Correlate_Methylation_vs_mRNA.Level_4.2016012800.0.0/Correlate_Methylation_vs_mRNA_STAD-TP_matrix.txt"
 
 
 
 def get_random_genes(num: int) -> List[str]:
     """
-    Return: list of random ncbi gene ids of length num.
+    Return: list of random ensembl gene ids of length num.
     """
-    df = pd.read_csv(LOOKUP_PATH)
-#     col = "NCBI gene ID"
-    col = "Gene stable ID"
-    ids = df[col].to_list()
+    ids = gene_id_map(str(LOOKUP_PATH)).ensembl.to_numpy()
     choice = np.random.choice(ids, size=num, replace=False)
     return choice.tolist()
     
-def get_top_cpgs(num: int) -> List[str]:
+def get_top_cpgs(num: int, path: Path = CPG_CORR_PATH) -> List[str]:
     """
     Return: list of cpgs with num highest absolute coefficients
-            for gene expression correlation from the firehose analysis.
+            for gene expression correlation from the firehose analysis,
+            or from a ranking of scripts/04_rank_cpgs.py at path.
     """
-    df = pd.read_csv(CPG_CORR_PATH, sep='\t')
+    df = pd.read_csv(path, sep='\t')
     cpg_col = 'Meth_Probe'
     corr_col = 'Corr_Coeff'
     df['abs_corr_coef'] = abs(df[corr_col])
     df.sort_values('abs_corr_coef', ascending=False, inplace=True)
-    return df[cpg_col][:num].to_list()
+    # a per-gene ranking lists a CpG once per gene it ranks for
+    return df[cpg_col].drop_duplicates()[:num].to_list()
 
 
 def build_model() -> lgb.LGBMRegressor:
@@ -68,7 +97,9 @@ def hyperparam_opt(search: RandomizedSearchCV,
     Returns:
         instance of model configured with the best found parameters.
     """
-    search.fit(X_train, y_train)
+    with stage('model.search') as s:
+        search.fit(X_train, y_train)
+        s.add(rows=len(X_train))
     return search.best_estimator_
 
 
@@ -78,33 +109,55 @@ def get_all_projects() -> List[str]:
     """
     projects_dir = Path("..") / "tcga/projects/"
     assert projects_dir.is_dir()
-    projects = [p.name for p in projects_dir.glob("*/")]
+    projects = [p.name for p in projects_dir.iterdir() if p.is_dir()]
     return projects
     
-def get_projects_cases(projects: List[str]) -> pd.DataFrame:
+def get_projects_cases(projects: List[str],
+                       index: CaseIndex = None) -> pd.DataFrame:
     """
     Returns: list of cases from the selected projects.
+             Read from the case index if given, without constructing projects.
     """
+    if index is not None:
+        return index.case_projects(projects)
     cases = {}
     for p in [Project(i) for i in projects]:
         for c in p.cases.keys():
             cases[c] = p.name
     return pd.DataFrame.from_dict(cases, orient="index")
 
-def split_train_test_cases(projects: List[str]) -> (
+def split_train_test_cases(projects: List[str],
+                           index: CaseIndex = None) -> (
         Tuple[List[str], List[str]]):
     """
     Splits cases in train and test sets.
     
     Returns: 2-tuple of train and test list.
     """
-    cases = get_projects_cases(projects)
-    case_counts = cases[0].value_counts()
-    projs_test = case_counts.index[-17:]
+    return smallest_projects_split(get_projects_cases(projects, index))
+
+def get_case_splits(projects: List[str], index: CaseIndex,
+                    how: str = SPLIT, k: int = K_FOLDS) -> (
+        List[Tuple[str, List[str], List[str]]]):
+    """
+    Train / test case splits from the case index alone, to be passed to
+    the dataset builders so that only the rows of a split are loaded.
+    
+    Args:
+        how: "projects", "kfold" (participant-grouped) or
+             "leave_project_out".
     
-    cases_test = cases.index[cases[0].isin(projs_test)].to_list()
-    cases_train = cases.index[~cases[0].isin(projs_test)].to_list()
-    return cases_train, cases_test
+    Returns: list of (split name, train cases, test cases).
+    """
+    cases = get_projects_cases(projects, index)
+    if how == "projects":
+        return [("projects",) + smallest_projects_split(cases)]
+    if how == "kfold":
+        return [("fold%d" % i,) + fold
+                for i, fold in enumerate(grouped_kfold(cases, k))]
+    if how == "leave_project_out":
+        return leave_project_out(cases)
+    raise ValueError("Unknown split: " + how)
 
 def aggregate_case_meth_expr(df_expr: pd.DataFrame,
                             df_meth: pd.DataFrame) -> (
@@ -122,7 +175,9 @@ def aggregate_case_meth_expr(df_expr: pd.DataFrame,
     assert df_expr.shape[1] == 1
     assert df_meth.shape[1] == 1
     
-    array = np.zeros(shape=(df_expr.shape[0], 1 + df_meth.shape[0]))
+    # float32 for store-served (decoded) frames, float64 for parsed files
+    dtype = np.result_type(df_expr.dtypes.iloc[0], df_meth.dtypes.iloc[0], np.float32)
+    array = np.zeros(shape=(df_expr.shape[0], 1 + df_meth.shape[0]), dtype=dtype)
     
     array[:, 0] = df_expr.iloc[:, 0]
     array[:, 1:] = df_meth.iloc[:, 0]
@@ -133,73 +188,284 @@ def aggregate_case_meth_expr(df_expr: pd.DataFrame,
                                + df_meth.index.to_list()))
     return df
 
-def build_dataset(projects: List[str], genes: List[str],
-                   cpgs: List[str]) -> pd.DataFrame:
+_WORKER_PROJECTS = {}
+
+
+def load_case_vectors(proj: Project, case: str, genes: List[str],
+                      cpgs: List[str]) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Builds the dataset used for the experiment.
+    Returns: 2-tuple of the case's expression (genes) and
+             methylation (cpgs) float32 vectors.
+    """
+    case_data = proj.get_case_data(case, genes=genes, cpgs=cpgs)
+    df_expr = case_data['expression']
+    df_meth = case_data['methylation']
+    
+    assert df_expr.shape[0] == len(genes)
+    assert df_meth.shape[0] == len(cpgs)
+    
+    return (df_expr.iloc[:, 0].to_numpy(dtype=np.float32),
+            df_meth.iloc[:, 0].to_numpy(dtype=np.float32))
+
+def load_case_vectors_in_worker(case: str, p_name: str, projects_dir: str,
+                                store_dir: str, index: CaseIndex,
+                                genes: List[str],
+                                cpgs: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Process-pool variant of load_case_vectors: the project is constructed
+    once per worker process instead of being pickled with every case.
+    """
+    key = (p_name, projects_dir, store_dir)
+    if key not in _WORKER_PROJECTS:
+        _WORKER_PROJECTS[key] = Project(p_name, projects_dir,
+                                        store_dir=store_dir, index=index)
+    return load_case_vectors(_WORKER_PROJECTS[key], case, genes, cpgs)
+
+@profiled('dataset.load')
+def load_cohort(projects: List[str], genes: List[str],
+                cpgs: List[str], n_jobs: int = 1,
+                backend: str = "thread",
+                max_in_flight: int = None,
+                projects_dir: str = PROJECTS_DIR,
+                store_dir: str = None,
+                index: CaseIndex = None,
+                cases: List[str] = None,
+                cache: CohortCache = None) -> (
+                Tuple[List[str], np.ndarray, np.ndarray]):
+    """
+    Loads the factorized form of the dataset: one expression and one
+    methylation vector per case, without broadcasting across genes.
+    
+    Case files are read on a pool of n_jobs workers with at most
+    max_in_flight reads outstanding; rows keep the sequential
+    (project, case) order regardless of n_jobs. Projects ingested in
+    the store at store_dir are sliced in one read instead.
     
     Args:
         projects: list of projects to include in dataset.
         genes: list of genes for which to extract expression.
         cpgs: list of CpG sites for which to extract methylation.
+        n_jobs: number of loading workers, -1 for all cores.
+        backend: "thread" or "process" pool.
+        max_in_flight: bound on outstanding case reads, default 2 * n_jobs.
+        store_dir: columnar store to serve ingested projects from.
+        index: case index to list project cases from.
+        cases: cases to load (e.g. a train split). if None: all cases.
+        cache: shared cohort cache (m2e.cache) serving the store's blocks,
+               loaded once for all processes running experiments.
+               Blocks of quantized stores (m2e.quantize) are cached as codes
+               and only the rows loaded are decoded.
+    
+    Returns:
+        3-tuple of case ids, expression (cases x genes) and
+        methylation (cases x cpgs) float32 arrays.
+    """
+    projs = [Project(p_name, projects_dir, store_dir=store_dir, index=index)
+             for p_name in projects]
+    wanted = None if cases is None else set(cases)
+    projs_cases = [[c for c in proj.cases.keys() if wanted is None or c in wanted]
+                   for proj in projs]
+    cases = [case for p_cases in projs_cases for case in p_cases]
+    
+    expr = np.empty((len(cases), len(genes)), dtype=np.float32)
+    meth = np.empty((len(cases), len(cpgs)), dtype=np.float32)
+    
+    row = 0
+    for proj, p_cases in zip(projs, projs_cases):
+        if not p_cases:
+            continue
+        rows = slice(row, row + len(p_cases))
+        row += len(p_cases)
         
+        if (proj.store is not None
+                and proj.store.has(proj.name, 'methylation')
+                and proj.store.has(proj.name, 'expression')):
+            if cache is not None:
+                for modality, features, out in [('expression', genes, expr), ('methylation', cpgs, meth)]:
+                    positions = proj.store.case_positions(proj.name, modality, p_cases)
+                    block = cache.get(store_dir, proj.name, modality, features)
+                    out[rows] = proj.store.decode(modality, block[positions])
+                logging.info("%s: %d cases from cache" % (proj.name, len(p_cases)))
+                continue
+            data = proj.get_cases_data(p_cases, genes=genes, cpgs=cpgs)
+            expr[rows] = data['expression']
+            meth[rows] = data['methylation']
+            logging.info("%s: %d cases from store" % (proj.name, len(p_cases)))
+            continue
+        
+        if backend == "process" and n_jobs != 1:
+            load = partial(load_case_vectors_in_worker, p_name=proj.name,
+                           projects_dir=projects_dir, store_dir=store_dir,
+                           index=index, genes=genes, cpgs=cpgs)
+        else:
+            load = partial(load_case_vectors, proj, genes=genes, cpgs=cpgs)
+        
+        progress = Progress(proj.name, total=len(p_cases))
+        for i, (case_expr, case_meth) in enumerate(
+                ordered_map(load, p_cases, n_jobs=n_jobs, backend=backend,
+                            max_in_flight=max_in_flight)):
+            expr[rows.start + i] = case_expr
+            meth[rows.start + i] = case_meth
+            progress.update()
+    
+    return cases, expr, meth
+
+@profiled('dataset.assemble')
+def assemble_dataset(cases: List[str], genes: List[str], cpgs: List[str],
+                     expr: np.ndarray, meth: np.ndarray,
+                     out_path: str = None) -> pd.DataFrame:
+    """
+    Broadcasts the factorized cohort into one preallocated float32 buffer
+    of (n_cases * n_genes) x (1 + n_cpgs).
+    
+    Args:
+        cases, genes, cpgs: row and column ids of expr and meth.
+        expr: (cases x genes) expression array.
+        meth: (cases x cpgs) methylation array.
+        out_path: if set, the buffer is a .npy memmap at this path,
+                  for cohorts larger than RAM.
+    
     Returns:
         DataFrame with (case_id, gene_id) x (gene_expression, cpg_meth1, ...)
     """
-#     raise NotImplementedError("Multithreading for IO-bounded runtime")
+    n_cases, n_genes, n_cpgs = len(cases), len(genes), len(cpgs)
+    assert expr.shape == (n_cases, n_genes)
+    assert meth.shape == (n_cases, n_cpgs)
     
-    dfs = []
-    for p_name in projects:
-        proj = Project(p_name)
-        
-        for case in proj.cases.keys():    
-            case_data = proj.get_case_data(case, genes=genes, cpgs=cpgs)
-            df_expr = case_data['expression']
-            df_meth = case_data['methylation']
-            
-            assert df_expr.shape[0] == len(genes)
-            assert df_meth.shape[0] == len(cpgs)
-            
-            df_case = aggregate_case_meth_expr(df_expr, df_meth)
-            
-            # add multilevel index
-            df_case.index = pd.MultiIndex.from_tuples(
-                [(case, gene) for gene in df_case.index],
-                names=['case', 'gene'])
-            
-            # add colname for expression
-            assert df_case.columns.to_list()[1:] == cpgs
-            df_case.columns = ['expression'] + cpgs
-            
-            dfs.append(df_case)
+    shape = (n_cases * n_genes, 1 + n_cpgs)
+    if out_path is None:
+        array = np.empty(shape, dtype=np.float32)
+    else:
+        array = np.lib.format.open_memmap(out_path, mode='w+',
+                                          dtype=np.float32, shape=shape)
+    
+    array[:, 0] = expr.reshape(-1)
+    # view rows as (case, gene) to broadcast each case's cpgs over genes
+    array[:, 1:].reshape(n_cases, n_genes, n_cpgs)[:] = meth[:, None, :]
+    
+    index = pd.MultiIndex.from_product([cases, genes],
+                                       names=['case', 'gene'])
+    return pd.DataFrame(data=array, index=index,
+                        columns=['expression'] + cpgs, copy=False)
+
+def build_dataset(projects: List[str], genes: List[str],
+                   cpgs: List[str], n_jobs: int = 1,
+                   backend: str = "thread",
+                   max_in_flight: int = None,
+                   projects_dir: str = PROJECTS_DIR,
+                   store_dir: str = None,
+                   index: CaseIndex = None,
+                   out_path: str = None,
+                   cases: List[str] = None,
+                   cache: CohortCache = None) -> pd.DataFrame:
+    """
+    Builds the dataset used for the experiment.
     
-    df_final = pd.concat(dfs, axis=0, join='inner')
+    Args:
+        projects: list of projects to include in dataset.
+        genes: list of genes for which to extract expression.
+        cpgs: list of CpG sites for which to extract methylation.
+        n_jobs, backend, max_in_flight, store_dir, index, cases, cache:
+            see load_cohort.
+        out_path: see assemble_dataset.
+        
+    Returns:
+        DataFrame with (case_id, gene_id) x (gene_expression, cpg_meth1, ...)
+    """
+    cases, expr, meth = load_cohort(projects, genes, cpgs, n_jobs=n_jobs,
+                                    backend=backend,
+                                    max_in_flight=max_in_flight,
+                                    projects_dir=projects_dir,
+                                    store_dir=store_dir, index=index,
+                                    cases=cases, cache=cache)
+    df_final = assemble_dataset(cases, genes, cpgs, expr, meth, out_path)
     assert df_final.columns.to_list() == ['expression'] + cpgs
     
     return df_final
     
     
+def fit_streaming(projects: List[str], genes: List[str], cpgs: List[str],
+                  cases_train: List[str], cases_test: List[str],
+                  search_dir: Path, artifact_dir: Path = None) -> lgb.Booster:
+    """
+    Streams the split's rows from the store into binned Datasets, searches
+    parameters and refits the best candidate, saved as a model artifact
+    (m2e.inference) to artifact_dir if given.
+    
+    The search and its early stopping run on a participant-grouped
+    validation set held out of cases_train; cases_test is only scored
+    by the refit model.
+    """
+    cases_fit, cases_valid = grouped_holdout(cases_train, VALID_FRACTION)
+    logging.info("%d fit, %d validation cases" % (len(cases_fit), len(cases_valid)))
+    
+    # binned once from the store, shared by all search candidates
+    search_dir.mkdir(parents=True, exist_ok=True)
+    train, _ = build_lgb_dataset(STORE_DIR, projects, genes, cpgs, cases=cases_fit,
+                                 memory_budget=MEMORY_BUDGET,
+                                 binary_path=search_dir / "train.bin")
+    build_lgb_dataset(STORE_DIR, projects, genes, cpgs, cases=cases_valid,
+                      memory_budget=MEMORY_BUDGET, reference=train,
+                      binary_path=search_dir / "valid.bin")
+    best_params, search_results = halving_search(
+        search_dir / "train.bin", search_dir / "valid.bin", STREAM_SEARCH_SPACE,
+        n_iter=N_ITER, threads_per_job=THREADS_PER_JOB,
+        checkpoint=search_dir / "checkpoint.jsonl")
+    logging.info("Best parameters: " + str(best_params))
+    
+    # refit of the best candidate on the same binned Dataset, scored on the test cases
+    test, _ = build_lgb_dataset(STORE_DIR, projects, genes, cpgs, cases=cases_test,
+                                memory_budget=MEMORY_BUDGET, reference=train)
+    params = dict(best_params)
+    rounds = params.pop('n_estimators')
+    evals = {}
+    with stage('model.fit') as s:
+        model = lgb.train(dict({'objective': 'regression', 'metric': 'l2', 'verbosity': -1}, **params),
+                          train, num_boost_round=rounds, valid_sets=[test], valid_names=['test'],
+                          callbacks=[lgb.record_evaluation(evals)])
+        s.add(rows=train.num_data())
+    test_l2 = evals['test']['l2'][-1]
+    logging.info("Test l2: %.5g" % test_l2)
+    if artifact_dir is not None:
+        ModelArtifact(model, cpgs, genes, meta={'params': best_params, 'projects': list(projects),
+                                                'n_train_cases': len(cases_fit),
+                                                'n_valid_cases': len(cases_valid),
+                                                'test_l2': test_l2}).save(artifact_dir)
+    return model
+    
+    
 if __name__ == '__main__':
     
     genes = get_random_genes(NUM_GENES)
     cpgs = get_top_cpgs(NUM_METH)
     
     tcga_projs = get_all_projects()
-    cases_train, cases_test = split_train_test_cases(tcga_projs)
+    index = CaseIndex()
     
-    df = build_dataset(tcga_projs, genes, cpgs)
-    df_train = df.iloc[df.loc['case'].isin(cases_train), :].copy()
-    df_test = df.iloc[df.loc['case'].isin(cases_test), :].copy()
-    
-    X_train = df_train.iloc[:, 1:]
-    y_train = df_train.iloc[:, 0]
-    X_test = df_test.iloc[:, 1:]
-    y_test = df_test.iloc[:, 0]
-    
-    model = build_model()
-    model = hyperparam_opt(SEARCH_SPACE, X_train, y_train)
-    model.fit(X_train, y_train)
+    # only the rows of a split's cases are loaded
+    for split, cases_train, cases_test in get_case_splits(tcga_projs, index):
+        logging.info("Split %s: %d train, %d test cases"
+                     % (split, len(cases_train), len(cases_test)))
+        if TRAIN_MODE == "streaming":
+            model = fit_streaming(tcga_projs, genes, cpgs, cases_train, cases_test,
+                                  SEARCH_DIR / split, MODELS_DIR / split)
+        else:
+            df_train = build_dataset(tcga_projs, genes, cpgs, n_jobs=N_JOBS,
+                                     backend=BACKEND, index=index, cases=cases_train)
+            df_test = build_dataset(tcga_projs, genes, cpgs, n_jobs=N_JOBS,
+                                    backend=BACKEND, index=index, cases=cases_test)
+            
+            X_train = df_train.iloc[:, 1:]
+            y_train = df_train.iloc[:, 0]
+            X_test = df_test.iloc[:, 1:]
+            y_test = df_test.iloc[:, 0]
+            
+            model = build_model()
+            model = hyperparam_opt(SEARCH_SPACE, X_train, y_train)
+            with stage('model.fit') as s:
+                model.fit(X_train, y_train)
+                s.add(rows=len(X_train))
     
     
 #     results = {"R2", "MSE", "MAE", "?"...}
-#     # can iterate and have distr
\ No newline at end of file
+#     # can iterate and have distr
@@ -0,0 +1,53 @@
+"""
+Batch prediction of gene expression with a saved model artifact
+ (m2e.inference, written by expr_meth_pred.py). Predictions are written
+ as the 'expression' modality of a matrix store at OUT_DIR.
+
+Usage: python predict_expr.py <artifact_dir> <out_dir> [project ...]
+       python predict_expr.py <artifact_dir> <out_dir> <name> <methylation file> ...
+
+ Projects default to all projects of the store with methylation. Given
+ methylation files, predictions are stored under project <name> with the
+ TCGA sample barcodes of the file names (or else the file names without
+ extension) as case ids.
+"""
+
+import os
+import sys
+import logging
+from pathlib import Path
+
+from m2e.config import configs
+from m2e.store import MatrixStore
+from m2e.inference import ModelArtifact, predict_store, predict_files, file_case_ids
+
+
+STORE_DIR = configs["dirs"]["store"]
+N_JOBS = -1  # file parsing workers, -1 for all cores
+
+logfile = os.path.join(configs['dirs']['log'], 'predict_expr.log')
+logging.basicConfig(filename=logfile,
+                    filemode = 'a',
+                    level=logging.INFO, 
+                    format='%(asctime)s %(message)s', 
+                    datefmt='%m/%d/%Y %I:%M:%S %p')
+
+
+if __name__ == "__main__":
+    
+    artifact_dir, out_dir, args = sys.argv[1], sys.argv[2], sys.argv[3:]
+    artifact = ModelArtifact.load(artifact_dir)
+    logging.info("Loaded model of " + str(len(artifact.cpgs)) + " CpGs, "
+                 + str(len(artifact.genes)) + " genes from " + artifact_dir)
+    
+    if len(args) > 1 and os.path.isfile(args[1]):
+        name, paths = args[0], args[1:]
+        files = file_case_ids(paths)
+        path = predict_files(artifact, files, out_dir, name, n_jobs=N_JOBS)
+        logging.info("Predicted " + str(len(files)) + " files into " + str(path))
+    else:
+        store = MatrixStore(STORE_DIR)
+        projects = args or sorted(p.name for p in Path(STORE_DIR).iterdir()
+                                  if p.is_dir() and store.has(p.name, 'methylation'))
+        for path in predict_store(artifact, STORE_DIR, projects, out_dir):
+            logging.info("Predicted " + str(path))
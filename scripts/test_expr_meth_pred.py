@@ -1,6 +1,8 @@
+import os
 import pdb
 import unittest
 
+import pytest
 import pandas as pd
 from sklearn.model_selection import RandomizedSearchCV
 from sklearn.datasets import make_regression
@@ -36,6 +38,13 @@ def test_get_top_cpgs():
     assert (cpgs1[:3] == cpgs2[:3] 
             == ["cg14830003", "cg07280731", "cg26475649"])
 
+def test_get_top_cpgs_per_gene_ranking(tmp_path):
+    path = tmp_path / "ranks.tsv"
+    pd.DataFrame({'Gene': ['g1', 'g1', 'g2', 'g2'],
+                  'Meth_Probe': ['c1', 'c2', 'c1', 'c3'],
+                  'Corr_Coeff': [0.9, 0.5, -0.8, 0.1]}).to_csv(path, sep='\t', index=False)
+    assert get_top_cpgs(3, path) == ['c1', 'c2', 'c3']
+
 def test_build_model():
     model = build_model()
 
@@ -90,10 +99,43 @@ def test_aggregate_case_meth_expr():
         'g1','g2','g3','g4'
     ]))
     
+def test_assemble_dataset():
+    expr = np.array([[1, 2], [3, 4], [5, 6]], dtype=np.float32)
+    meth = np.array([[-1, -2, -3], [-4, -5, -6], [-7, -8, -9]], dtype=np.float32)
+    df = assemble_dataset(['a', 'b', 'c'], ['g1', 'g2'], ['c1', 'c2', 'c3'],
+                          expr, meth)
+    assert df.shape == (6, 4)
+    assert df.index.to_list()[:3] == [('a', 'g1'), ('a', 'g2'), ('b', 'g1')]
+    assert df.columns.to_list() == ['expression', 'c1', 'c2', 'c3']
+    assert df.loc[('b', 'g2')].to_list() == [4, -4, -5, -6]
+    
 def test_build_dataset():
 #     projs = get_all_projects()[:1]
     projs = ["TCGA-CESC", "TCGA-UCS"]
     genes = get_random_genes(10)
     cpgs = get_top_cpgs(3)
     df = build_dataset(projs, genes, cpgs)
-    assert type(df) == pd.DataFrame
\ No newline at end of file
+    assert type(df) == pd.DataFrame
+
+@pytest.mark.skipif(not os.path.isdir(PROJECTS_DIR), reason="TCGA data tree not available")
+def test_build_dataset_parallel():
+    projs = ["TCGA-CESC", "TCGA-UCS"]
+    genes = get_random_genes(10)
+    cpgs = get_top_cpgs(3)
+    df = build_dataset(projs, genes, cpgs)
+    df_threads = build_dataset(projs, genes, cpgs, n_jobs=4, max_in_flight=3)
+    df_procs = build_dataset(projs, genes, cpgs, n_jobs=2, backend="process")
+    assert df.equals(df_threads)
+    assert df.equals(df_procs)
+
+@pytest.mark.skipif(not os.path.isdir(PROJECTS_DIR), reason="TCGA data tree not available")
+def test_build_dataset_cases(tmp_path):
+    projs = ["TCGA-CESC", "TCGA-UCS"]
+    genes = get_random_genes(10)
+    cpgs = get_top_cpgs(3)
+    index = CaseIndex(tmp_path / 'index.sqlite', projects_dir=PROJECTS_DIR)
+    _, cases_train, cases_test = get_case_splits(projs, index, how="kfold", k=2)[0]
+    df = build_dataset(projs, genes, cpgs, index=index)
+    df_test = build_dataset(projs, genes, cpgs, index=index, cases=cases_test)
+    assert set(df_test.index.get_level_values('case')) == set(cases_test)
+    assert df_test.equals(df.loc[df_test.index])